@@ -0,0 +1,56 @@
+"""Performance metrics of many runs at once against one run at a time with pandas
+
+Builds random equity curves (runs × dates), computes the metrics of all of them with
+analytics.compute_metrics and with a pandas loop over the runs, and prints both timings.
+
+Usage:
+    python benchmarks/bench_analytics.py --runs 500 --dates 2500
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.analytics import RunPanel
+
+def pandas_metrics(values: pd.Series, periods_per_year: float):
+    returns = values.pct_change().dropna()
+    return {
+        'total_return': values.iloc[-1] / values.iloc[0] - 1,
+        'volatility': returns.std() * np.sqrt(periods_per_year),
+        'sharpe': returns.mean() / returns.std() * np.sqrt(periods_per_year),
+        'max_drawdown': (values / values.cummax() - 1).min(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--dates", type=int, default=2500)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2010-01-01", periods=args.dates)
+    curves = 1e6 * np.exp(np.cumsum(rng.normal(3e-4, 0.01, (args.runs, args.dates)), axis=1))
+    runs = {f"run{i}": (pd.DataFrame({"Date": dates, "Portfolio value": curve}), None) for i, curve in enumerate(curves)}
+
+    timings = {}
+    start = time.perf_counter()
+    panel = RunPanel.from_runs(runs, periods_per_year=252)
+    timings["stacking"] = time.perf_counter() - start
+    start = time.perf_counter()
+    metrics = panel.metrics()
+    timings["all metrics"] = time.perf_counter() - start
+    start = time.perf_counter()
+    panel.rolling(63)
+    timings["rolling (63 dates)"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for df, _ in runs.values():
+        pandas_metrics(df.set_index("Date")["Portfolio value"], 252)
+    timings["pandas loop, 4 metrics"] = time.perf_counter() - start
+    print(f"{args.runs} runs × {args.dates} dates")
+    for label, seconds in timings.items():
+        print(f"{label:>24}: {seconds * 1e3:8.1f} ms")
+    print(metrics[['total_return', 'sharpe', 'max_drawdown']].describe().loc[['mean', 'std']])
+
+if __name__ == "__main__":
+    main()
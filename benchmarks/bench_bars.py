@@ -0,0 +1,58 @@
+"""Throughput and memory of a backtest on a timeline of synthetic minute bars
+
+Builds minute bars of the regular session (390 a day) for a few tickers, runs a bar backtest that
+rebalances weekly on a window of one day of bars, and prints the bars per second and the peak memory.
+
+Usage:
+    python benchmarks/bench_bars.py --bars 1000000 --tickers 5
+"""
+import argparse
+import logging
+import resource
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.broker import Backtest, EndOfWeek, StopLoss
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+def minute_data(n_bars, n_tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range("2010-01-04", periods=-(-n_bars // 390))
+    times = (days.to_numpy()[:, None] + np.timedelta64(570, "m") + np.arange(390) * np.timedelta64(1, "m")).ravel()[:n_bars]
+    tickers = [f"T{i}" for i in range(n_tickers)]
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 5e-4, (n_bars, n_tickers)), axis=0))
+    return pd.DataFrame({"Date": np.tile(times, n_tickers), "ticker": np.repeat(tickers, n_bars),
+                         "Adj Close": close.T.ravel()}), tickers
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bars", type=int, default=1_000_000)
+    parser.add_argument("--tickers", type=int, default=5)
+    parser.add_argument("--chunk", type=int, default=65536)
+    parser.add_argument("--stop-loss", action="store_true", help="check the stop loss on every bar")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    data, tickers = minute_data(args.bars, args.tickers)
+    print(f"data: {len(data):,} rows, {peak_memory_mb():,.0f} MB peak")
+    times = data["Date"].iloc[:args.bars]
+    backtest = Backtest(initial_date=times.iloc[390].to_pydatetime(), final_date=times.iloc[-1].to_pydatetime(),
+                        universe=tickers, portfolio_strategy=MinimumVarianceStrategy, s=timedelta(days=1),
+                        rebalance_flag=EndOfWeek, interval="1m", window_bars=390, bar_chunk_size=args.chunk,
+                        risk_model=StopLoss if args.stop_loss else None, verbose=False, persist=False,
+                        data_module=DataModule(data))
+    start = time.perf_counter()
+    values, _, _ = backtest.run_backtest()
+    seconds = time.perf_counter() - start
+    print(f"{len(values):,} bars in {seconds:.2f} s: {len(values) / seconds:,.0f} bars/s, "
+          f"{len(backtest.broker.get_transaction_log()):,} trades, {peak_memory_mb():,.0f} MB peak")
+
+if __name__ == "__main__":
+    main()
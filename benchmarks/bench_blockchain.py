@@ -0,0 +1,48 @@
+"""Blocks per second appended to one chain by concurrent writer threads and processes
+
+Each writer opens the chain store of a temporary folder and appends its blocks one at a time, so every
+block takes the lock of the chain. The rounds run the same writers in a thread pool and in a process
+pool, check that no block was lost and print the throughput.
+
+Usage:
+    python benchmarks/bench_blockchain.py --writers 1 4 8 --blocks 50
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pybacktestchain_ss.blockchain import load_blockchain, open_blockchain
+
+def append_blocks(args):
+    folder, writer, n_blocks = args
+    os.chdir(folder)
+    blockchain = open_blockchain("bench")
+    for i in range(n_blocks):
+        blockchain.add_block(f"writer{writer}-block{i}", f"data {writer} {i}")
+    return n_blocks
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--blocks", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    cwd = os.getcwd()
+    for executor in (ThreadPoolExecutor, ProcessPoolExecutor):
+        for writers in args.writers:
+            with tempfile.TemporaryDirectory() as folder:
+                os.chdir(folder)
+                start = time.perf_counter()
+                with executor(max_workers=writers) as pool:
+                    blocks = sum(pool.map(append_blocks, [(folder, w, args.blocks) for w in range(writers)]))
+                seconds = time.perf_counter() - start
+                blockchain = load_blockchain("bench")
+                assert len(blockchain.chain) == 1 + blocks and blockchain.is_valid()
+                print(f"{executor.__name__:>19}, {writers:>2} writers: {blocks / seconds:8.0f} blocks/s")
+                os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Time of the weights of a vector of risk aversions: one critical line path against one SciPy solve per gamma
+
+Draws covariance matrices of synthetic returns and computes the long-only RiskAverseStrategy weights of
+every gamma, then prints the solves per second of both methods and the largest objective gap.
+
+Usage:
+    python benchmarks/bench_frontier.py --tickers 50 --gammas 40 --dates 20
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from pybacktestchain_ss.frontier import _solve_gamma, frontier_weights
+
+def problems(n_dates, n_tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_dates):
+        returns = rng.normal(5e-4, 0.02, (250, n_tickers)) + rng.normal(0, 0.01, (250, 1))
+        yield returns.mean(axis=0), np.cov(returns, rowvar=False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--gammas", type=int, default=40)
+    parser.add_argument("--dates", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    gammas = np.geomspace(0.1, 1000, args.gammas)
+    frontier_time, scipy_time, gap = 0.0, 0.0, 0.0
+    for mu, Sigma in problems(args.dates, args.tickers):
+        start = time.perf_counter()
+        weights = frontier_weights(mu, Sigma, gammas)
+        frontier_time += time.perf_counter() - start
+        start = time.perf_counter()
+        x0 = np.ones(args.tickers) / args.tickers
+        for gamma, w in zip(gammas, weights):
+            x0 = _solve_gamma(mu, Sigma, gamma, x0)
+            objective = lambda x: -x @ mu + gamma / 2 * x @ Sigma @ x
+            gap = max(gap, objective(w) - objective(x0))
+        scipy_time += time.perf_counter() - start
+    solves = args.dates * args.gammas
+    print(f"critical line: {solves / frontier_time:,.0f} gammas/s, SciPy warm started: {solves / scipy_time:,.0f} gammas/s "
+          f"({scipy_time / frontier_time:.1f}x), largest objective gap {gap:.2e}")
+
+if __name__ == "__main__":
+    main()
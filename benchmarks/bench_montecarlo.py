@@ -0,0 +1,52 @@
+"""Paths per second of the Monte Carlo engine with 1 and with several worker processes
+
+Runs a block-bootstrap simulation on synthetic daily prices and prints the throughput and the spread
+of the Sharpe ratios over the paths.
+
+Usage:
+    python benchmarks/bench_montecarlo.py --paths 16 --workers 4
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.montecarlo import MonteCarlo
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+def daily_data(n_tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2017-01-01", "2020-01-01")
+    tickers = [f"T{i}" for i in range(n_tickers)]
+    close = 100 * np.exp(np.cumsum(rng.normal(3e-4, 0.015, (len(dates), n_tickers)), axis=0))
+    return pd.DataFrame({"Date": np.repeat(dates, n_tickers), "ticker": np.tile(tickers, len(dates)),
+                         "Adj Close": close.ravel()}), tickers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", type=int, default=16)
+    parser.add_argument("--tickers", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    data, tickers = daily_data(args.tickers)
+    data_module = DataModule(data)
+    for workers in (1, args.workers):
+        simulation = MonteCarlo(datetime(2019, 1, 1), datetime(2020, 1, 1), n_paths=args.paths, universe=tickers,
+                                universe_size=args.tickers // 2, start_jitter=timedelta(days=30),
+                                portfolio_strategy=MinimumVarianceStrategy, s=timedelta(days=360),
+                                max_workers=workers, paths_per_task=max(args.paths // (4 * workers), 1),
+                                data_module=data_module)
+        start = time.perf_counter()
+        result = simulation.run()
+        seconds = time.perf_counter() - start
+        sharpe = result.distribution().loc["sharpe"]
+        print(f"{workers:>2} workers: {args.paths / seconds:6.1f} paths/s, "
+              f"Sharpe 5%-95%: {sharpe[0.05]:.2f} to {sharpe[0.95]:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Memory and speed of the moments in full and in mixed (float32 storage) precision, with their accuracy
+
+Computes the information sets of a large synthetic universe at each month end with both precision
+policies, then prints the memory of the data and of the cached covariances, the time taken, and the
+accuracy report of a minimum variance backtest on a smaller universe.
+
+Usage:
+    python benchmarks/bench_precision.py --tickers 500
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+from pybacktestchain_ss.precision import FULL_PRECISION, MIXED_PRECISION, accuracy_report
+
+def daily_data(n_tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2018-01-01", "2020-01-01")
+    tickers = [f"T{i}" for i in range(n_tickers)]
+    close = 100 * np.exp(np.cumsum(rng.normal(3e-4, 0.015, (len(dates), n_tickers)), axis=0))
+    return pd.DataFrame({"Date": np.repeat(dates, n_tickers), "ticker": np.tile(tickers, len(dates)),
+                         "Adj Close": close.ravel()}), tickers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--report-tickers", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    data, _ = daily_data(args.tickers)
+    dates = pd.date_range("2019-01-01", "2020-01-01", freq="BME")
+    for label, precision in (("float64", FULL_PRECISION), ("mixed", MIXED_PRECISION)):
+        data_module = DataModule(data, precision=precision)
+        info = FirstTwoMoments(s=timedelta(days=360), data_module=data_module, adj_close_column="Adj Close")
+        start = time.perf_counter()
+        sets = [info.compute_information_at_bar(data_module.bar_panel().index(t)) for t in dates]
+        seconds = time.perf_counter() - start
+        moments = sum(s["covariance_matrix"].nbytes + s["expected_return"].nbytes for s in sets)
+        print(f"{label:>7}: data {data_module.memory_usage() / 1e6:7.1f} MB, {len(sets)} cached moments "
+              f"{moments / 1e6:7.1f} MB, {seconds / len(sets) * 1e3:6.1f} ms per date")
+    data, tickers = daily_data(args.report_tickers)
+    backtest = Backtest(datetime(2019, 1, 1), datetime(2020, 1, 1), universe=tickers,
+                        portfolio_strategy=MinimumVarianceStrategy, verbose=False, persist=False,
+                        data_module=DataModule(data))
+    print(accuracy_report(backtest, MIXED_PRECISION).summary().to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Overhead of the transaction cost models on the execution path of the broker
+
+Rebalances a portfolio of random weights many times, without costs and with every cost model,
+and prints the time per rebalancing.
+
+Usage:
+    python benchmarks/bench_transaction_costs.py --tickers 500 --rebalances 200
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from pybacktestchain_ss.broker import Broker
+from pybacktestchain_ss.transaction_costs import FixedBps, SpreadCost, SquareRootImpact
+
+def run(cost_model, n_tickers, n_rebalances, seed=0):
+    rng = np.random.default_rng(seed)
+    tickers = [f"T{i}" for i in range(n_tickers)]
+    volumes = dict(zip(tickers, rng.uniform(1e5, 1e7, n_tickers)))
+    base_prices = rng.uniform(10, 500, n_tickers)
+    broker = Broker(cash=1e8, verbose=False, cost_model=cost_model)
+    date = datetime(2024, 1, 1)
+    start = time.perf_counter()
+    for _ in range(n_rebalances):
+        prices = dict(zip(tickers, base_prices * (1 + 0.01 * rng.standard_normal(n_tickers))))
+        weights = rng.dirichlet(np.ones(n_tickers))
+        broker.execute_portfolio(dict(zip(tickers, weights)), prices, date, volumes)
+    return (time.perf_counter() - start) / n_rebalances, broker.get_transaction_log()["Cost"].sum()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--rebalances", type=int, default=200)
+    args = parser.parse_args()
+    models = {
+        "none": None,
+        "fixed 5bps": FixedBps(5),
+        "spread 10bps": SpreadCost(10),
+        "square-root impact": SquareRootImpact(),
+        "all": FixedBps(5) + SpreadCost(10) + SquareRootImpact(),
+    }
+    baseline = None
+    for label, model in models.items():
+        seconds, costs = run(model, args.tickers, args.rebalances)
+        baseline = baseline or seconds
+        print(f"{label:>20}: {seconds * 1e3:8.2f} ms per rebalancing ({seconds / baseline - 1:+.1%}), total costs {costs:,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Time of a point-in-time universe screen over thousands of tickers
+
+Builds a synthetic daily panel with listings and delistings, then screens it at every month end on
+minimum history, price floor and average dollar volume, and prints the time per screen date.
+
+Usage:
+    python benchmarks/bench_universe.py --tickers 10000 --days 2500
+"""
+import argparse
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.universe import ScreenPanel, UniverseScreen
+
+def synthetic_panel(n_tickers, n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2010-01-04", periods=n_days)
+    prices = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_days, n_tickers)), axis=0))
+    volumes = rng.lognormal(10, 2, (n_days, n_tickers))
+    # each ticker lists and delists at random dates
+    listed, delisted = np.sort(rng.integers(0, n_days, (2, n_tickers)), axis=0)
+    rows = np.arange(n_days)[:, None]
+    prices[(rows < listed) | (rows > delisted + n_days // 2)] = np.nan
+    return ScreenPanel(dates.as_unit("ns").asi8, np.array([f"T{i}" for i in range(n_tickers)]), prices, volumes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tickers", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=2500)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    panel = synthetic_panel(args.tickers, args.days)
+    print(f"panel of {args.tickers:,} tickers × {args.days:,} days built in {time.perf_counter() - start:.2f} s")
+    screen = UniverseScreen(lookback=timedelta(days=360), min_history=200, min_price=5, min_dollar_volume=1e5, top_n=1000)
+    dates = pd.bdate_range("2011-01-01", periods=args.days - 260, freq="BME")
+    dates = dates[dates < pd.Timestamp(panel.times[-1])]
+    start = time.perf_counter()
+    frame = screen.evaluate(panel, dates)
+    seconds = time.perf_counter() - start
+    print(f"{len(dates)} screen dates in {seconds:.3f} s: {1000 * seconds / len(dates):.2f} ms per date, "
+          f"{frame.sum(axis=1).mean():,.0f} members on average")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Jobs per second of a sweep run through the SQLite work queue by 1, 4 and 16 worker processes
+
+Each round submits the same sweep of risk-averse backtests on synthetic daily prices (stored once in
+the shared data store) to a fresh queue in a temporary folder, then starts the workers and times them
+until the queue is drained. The chain and the results are committed like on a cluster.
+
+Usage:
+    python benchmarks/bench_work_queue.py --jobs 64 --workers 1 4 16
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.blockchain import load_blockchain
+from pybacktestchain_ss.work_queue import SQLiteQueue, Worker, submit_sweep
+
+def daily_data(n_tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2018-01-01", "2020-01-01")
+    tickers = [f"T{i}" for i in range(n_tickers)]
+    close = 100 * np.exp(np.cumsum(rng.normal(3e-4, 0.015, (len(dates), n_tickers)), axis=0))
+    return pd.DataFrame({"Date": np.repeat(dates, n_tickers), "ticker": np.tile(tickers, len(dates)),
+                         "Adj Close": close.ravel()}), tickers
+
+def work(folder, prefetch):
+    os.chdir(folder)
+    logging.disable(logging.INFO)
+    Worker(SQLiteQueue(), prefetch=prefetch, poll_interval=0.05).run(idle_timeout=0.5)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=64)
+    parser.add_argument("--tickers", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--prefetch", type=int, default=2)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    data, tickers = daily_data(args.tickers)
+    requests = [{"initial_date": "2019-01-01", "final_date": "2020-01-01", "universe": tickers, "s": 360,
+                 "risk_threshold": 0.01 + i / args.jobs, "risk_model": "StopLoss"} for i in range(args.jobs)]
+    context = get_context("spawn")
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            queue = SQLiteQueue()
+            submit_sweep(queue, requests, data=data)
+            start = time.perf_counter()
+            processes = [context.Process(target=work, args=(folder, args.prefetch)) for _ in range(workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            seconds = time.perf_counter() - start
+            counts = queue.counts()
+            blocks = len(load_blockchain("backtest").chain) - 1
+            print(f"{workers:>2} workers: {counts['done'] / seconds:6.1f} jobs/s "
+                  f"({counts['done']} done, {counts['failed']} failed, {blocks} blocks)")
+            os.chdir(os.path.dirname(folder))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import glob
+import logging
+import os
+import pickle
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import maximum_filter1d
+
+from pybacktestchain_ss.run_cache import DEFAULT_CACHE_DIR
+from pybacktestchain_ss.valuation import _naive_dates
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _ffill(values: np.ndarray):
+    # forward-fills the NaNs of each row of a runs × dates array
+    valid = ~np.isnan(values)
+    last = np.maximum.accumulate(np.where(valid, np.arange(values.shape[1]), 0), axis=1)
+    filled = values[np.arange(values.shape[0])[:, None], last]
+    filled[~np.maximum.accumulate(valid, axis=1)] = np.nan
+    return filled
+
+def _quiet(function, *args, **kwargs):
+    # the NumPy nan-reductions warn on runs without any value, which just get NaN metrics
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return function(*args, **kwargs)
+
+def _trailing_sum(values: np.ndarray, window: int):
+    # sum of the last `window` values of each row, NaN before the window is full or if it holds a NaN
+    missing = np.isnan(values)
+    counts = np.cumsum(~missing, axis=1)
+    sums = np.cumsum(np.where(missing, 0.0, values), axis=1)
+    sums[:, window:] = sums[:, window:] - sums[:, :-window]
+    counts[:, window:] = counts[:, window:] - counts[:, :-window]
+    sums[counts < window] = np.nan
+    return sums
+
+def traded_notional(transaction_log: pd.DataFrame, dates):
+    """Traded notional |quantity × price| of a transaction log on each date
+
+    Trades between two dates count on the next one, like in mark_to_market.
+    """
+    dates = _naive_dates(dates).as_unit('ns').asi8
+    notional = np.zeros(len(dates))
+    if transaction_log is None or not len(transaction_log):
+        return notional
+    rows = np.searchsorted(dates, _naive_dates(transaction_log['Date']).as_unit('ns').asi8, side='left')
+    amounts = np.abs(transaction_log['Quantity'].to_numpy(dtype=float) * transaction_log['Price'].to_numpy(dtype=float))
+    valid = rows < len(dates)
+    np.add.at(notional, rows[valid], amounts[valid])
+    return notional
+
+def compute_metrics(panel, risk_free_rate: float = 0.0):
+    """compute_metrics computes the performance metrics of every run of a RunPanel at once
+
+    Each metric is one NumPy reduction along the dates axis of the runs × dates arrays, so hundreds of runs
+    cost about as much as one pass over their values.
+
+    Args:
+        panel (RunPanel): The equity curves and traded notionals of the runs
+        risk_free_rate (float): Annual risk-free rate of the Sharpe and Sortino ratios
+
+    Returns:
+        pd.DataFrame: One row per run, the metrics as columns (returns, volatilities and turnover annualized)
+
+    Example:
+        metrics = compute_metrics(RunPanel.from_cache('backtests/runs'))
+        metrics.sort_values('sharpe', ascending=False).head()
+    """
+    values, ppy = panel.values, panel.periods_per_year
+    returns = panel.returns
+    n_values = (~np.isnan(values)).sum(axis=1)
+    first, last = panel.first_values, panel.last_values
+    total_return = last / first - 1
+    n_periods = np.maximum(n_values - 1, 1)
+    cagr = _quiet(np.power, 1 + total_return, ppy / n_periods) - 1
+    mean = _quiet(np.nanmean, returns, axis=1)
+    std = _quiet(np.nanstd, returns, axis=1, ddof=1)
+    excess = mean - risk_free_rate / ppy
+    downside = _quiet(np.sqrt, _quiet(np.nanmean, np.minimum(returns, 0.0) ** 2, axis=1))
+    drawdown = panel.drawdown
+    durations = panel.drawdown_durations
+    max_drawdown = _quiet(np.nanmin, drawdown, axis=1)
+    metrics = pd.DataFrame({
+        'start': panel.start_dates,
+        'end': panel.end_dates,
+        'final_value': last,
+        'total_return': total_return,
+        'cagr': cagr,
+        'volatility': std * np.sqrt(ppy),
+        'sharpe': _quiet(np.divide, excess, std) * np.sqrt(ppy),
+        'sortino': _quiet(np.divide, excess, downside) * np.sqrt(ppy),
+        'max_drawdown': max_drawdown,
+        'calmar': _quiet(np.divide, cagr, -max_drawdown),
+        'max_drawdown_duration': pd.to_timedelta(_quiet(np.nanmax, durations, axis=1), unit='ns'),
+        'current_drawdown_duration': pd.to_timedelta(durations[np.arange(len(values)), panel.last_positions], unit='ns'),
+        'turnover': _quiet(np.divide, panel.notional.sum(axis=1), _quiet(np.nanmean, values, axis=1)) * ppy / n_periods,
+        'n_trades': panel.n_trades,
+        'costs': panel.costs,
+    }, index=pd.Index(panel.names, name='name'))
+    metrics.loc[n_values == 0, 'max_drawdown_duration'] = pd.NaT
+    return metrics
+
+def rolling_metrics(panel, window: int, risk_free_rate: float = 0.0):
+    """rolling_metrics computes the metrics of every run over a trailing window of `window` dates
+
+    The rolling means and variances come from cumulative sums and the rolling peak from a maximum filter,
+    so the cost does not grow with the window.
+
+    Returns:
+        dict: 'return', 'volatility', 'sharpe' and 'drawdown', each a dates × runs DataFrame
+            (NaN until the window is full)
+    """
+    if window < 2:
+        raise ValueError("window must be at least 2")
+    ppy = panel.periods_per_year
+    returns = panel.returns[:, 1:]
+    n = window - 1 # returns in a window of `window` values
+    sums = _trailing_sum(returns, n)
+    squares = _trailing_sum(returns ** 2, n)
+    mean = sums / n
+    variance = _quiet(np.maximum, (squares - n * mean ** 2) / (n - 1), 0.0) if n > 1 else np.full_like(mean, np.nan)
+    std = np.sqrt(variance)
+    values = panel.values
+    growth = np.full(values.shape, np.nan)
+    growth[:, window - 1:] = values[:, window - 1:] / values[:, :values.shape[1] - window + 1] - 1
+    # trailing peak of each window, the missing values never being the peak
+    peak = maximum_filter1d(np.where(np.isnan(values), -np.inf, values), size=window, axis=1,
+                            mode='nearest', origin=(window - 1) // 2)
+    drawdown = values / peak - 1
+    drawdown[np.isnan(_trailing_sum(values * 0.0, window))] = np.nan
+    pad = np.full((len(values), 1), np.nan)
+    results = {
+        'return': growth,
+        'volatility': np.hstack([pad, std * np.sqrt(ppy)]),
+        'sharpe': np.hstack([pad, _quiet(np.divide, mean - risk_free_rate / ppy, std) * np.sqrt(ppy)]),
+        'drawdown': drawdown,
+    }
+    return {name: pd.DataFrame(result.T, index=panel.dates, columns=panel.names) for name, result in results.items()}
+
+def load_runs(directory: str = DEFAULT_CACHE_DIR):
+    """Reads the completed runs of a RunCache directory (backtests/runs), as {name: (values, transaction log)}"""
+    runs = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.pkl'))):
+        try:
+            with open(path, 'rb') as f:
+                run = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Could not read the cached run {path}: {e}")
+            continue
+        runs[run.name] = (run.portfolio_values, run.broker_state.get('transaction_log'))
+    return runs
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class RunPanel:
+    """ The equity curves and ledgers of many runs, stacked as runs × dates arrays
+
+    The dates are the union of the dates of all the runs. A run is NaN before its first and after its
+    last date, and carries its last value over the dates of the other runs in between.
+    """
+    names: list
+    dates: pd.DatetimeIndex
+    values: np.ndarray # runs × dates portfolio values
+    notional: np.ndarray # runs × dates traded notional
+    n_trades: np.ndarray
+    costs: np.ndarray
+    periods_per_year: float = None # inferred from the spacing of the dates if None
+
+    def __post_init__(self):
+        if self.periods_per_year is None:
+            spacing = np.median(np.diff(self.dates.asi8)) if len(self.dates) > 1 else np.nan
+            self.periods_per_year = pd.Timedelta(days=365.25).value / spacing if spacing > 0 else 252.0
+
+    @classmethod
+    def from_runs(cls, runs: dict, periods_per_year: float = None):
+        """Stacks runs given as {name: (portfolio_values_df, transaction_log)}, the log may be None
+
+        Example:
+            values, _, _ = backtest.run_backtest()
+            panel = RunPanel.from_runs({backtest.backtest_name: (values, backtest.broker.get_transaction_log())})
+        """
+        if not runs:
+            raise ValueError("No runs to stack in a RunPanel")
+        names = list(runs)
+        curves = [cls._curve(values) for values, _ in runs.values()]
+        dates = pd.DatetimeIndex(np.unique(np.concatenate([c.index.asi8 for c in curves]))).as_unit('ns')
+        values = np.full((len(names), len(dates)), np.nan)
+        for i, curve in enumerate(curves):
+            values[i, np.searchsorted(dates.asi8, curve.index.asi8)] = curve.to_numpy(dtype=float)
+        filled = _ffill(values)
+        # no value after the last date of a run
+        last = len(dates) - 1 - np.argmax(~np.isnan(values[:, ::-1]), axis=1)
+        filled[np.arange(len(dates))[None, :] > last[:, None]] = np.nan
+        logs = [log for _, log in runs.values()]
+        notional = np.array([traded_notional(log, dates) for log in logs]).reshape(len(names), len(dates))
+        n_trades = np.array([0 if log is None else len(log) for log in logs], dtype=int)
+        costs = np.array([log['Cost'].sum() if log is not None and 'Cost' in log.columns else 0.0 for log in logs])
+        return cls(names, dates, filled, notional, n_trades, costs, periods_per_year)
+
+    @classmethod
+    def from_backtest(cls, backtest, portfolio_values_df: pd.DataFrame = None, periods_per_year: float = None):
+        """The panel of a single completed Backtest, its daily valuation by default"""
+        if portfolio_values_df is None:
+            portfolio_values_df = backtest.valuation.portfolio_values_df
+        return cls.from_runs({backtest.backtest_name: (portfolio_values_df, backtest.broker.get_transaction_log())},
+                             periods_per_year)
+
+    @classmethod
+    def from_cache(cls, directory: str = DEFAULT_CACHE_DIR, names: list = None, periods_per_year: float = None):
+        """The panel of the runs stored in a RunCache directory, optionally only the given names"""
+        runs = load_runs(directory)
+        if names is not None:
+            runs = {name: runs[name] for name in names if name in runs}
+        return cls.from_runs(runs, periods_per_year)
+
+    @staticmethod
+    def _curve(values):
+        # a portfolio_values_df (Date, Portfolio value) or a Series indexed by date, as a sorted Series
+        if isinstance(values, pd.DataFrame):
+            values = pd.Series(values['Portfolio value'].to_numpy(), index=values['Date'])
+        curve = pd.Series(values.to_numpy(dtype=float), index=_naive_dates(values.index).as_unit('ns'))
+        return curve[~curve.index.duplicated(keep='last')].sort_index()
+
+    @property
+    def first_positions(self):
+        return np.argmax(~np.isnan(self.values), axis=1)
+
+    @property
+    def last_positions(self):
+        return self.values.shape[1] - 1 - np.argmax(~np.isnan(self.values[:, ::-1]), axis=1)
+
+    @property
+    def first_values(self):
+        return self.values[np.arange(len(self.values)), self.first_positions]
+
+    @property
+    def last_values(self):
+        return self.values[np.arange(len(self.values)), self.last_positions]
+
+    @property
+    def start_dates(self):
+        return self.dates[self.first_positions]
+
+    @property
+    def end_dates(self):
+        return self.dates[self.last_positions]
+
+    @property
+    def returns(self):
+        """Returns between consecutive dates, runs × dates with NaN on the first date"""
+        returns = np.full(self.values.shape, np.nan)
+        returns[:, 1:] = self.values[:, 1:] / self.values[:, :-1] - 1
+        return returns
+
+    @property
+    def drawdown(self):
+        """Relative distance of each value to the running peak of its run, 0 at new highs"""
+        peak = np.fmax.accumulate(self.values, axis=1)
+        return self.values / peak - 1
+
+    @property
+    def drawdown_durations(self):
+        """Time since the last peak of each run on each date (ns), 0 at new highs"""
+        below = self.drawdown < 0
+        positions = np.arange(self.values.shape[1])
+        last_peak = np.maximum.accumulate(np.where(below, 0, positions[None, :]), axis=1)
+        durations = (self.dates.asi8[positions][None, :] - self.dates.asi8[last_peak]).astype(float)
+        durations[np.isnan(self.values)] = np.nan
+        return durations
+
+    def metrics(self, risk_free_rate: float = 0.0):
+        return compute_metrics(self, risk_free_rate)
+
+    def rolling(self, window: int, risk_free_rate: float = 0.0):
+        return rolling_metrics(self, window, risk_free_rate)
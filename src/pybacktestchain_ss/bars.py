@@ -0,0 +1,185 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.valuation import PriceMatrix
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+# bar intervals yfinance can download, the others are resampled from the largest one dividing them
+YF_INTERVALS = ['1m', '2m', '5m', '15m', '30m', '60m', '90m', '1d']
+
+# how each column of a bar is aggregated when resampling, the other columns keep their last value
+BAR_AGGREGATIONS = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Adj Close': 'last', 'Volume': 'sum'}
+
+_UNITS = {'m': 'min', 'min': 'min', 'h': 'h', 'd': 'D', 'wk': 'W'}
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def interval_to_timedelta(interval: str):
+    """Converts a bar interval like '1m', '5min', '1h' or '1d' to a pd.Timedelta"""
+    match = re.fullmatch(r'(\d+)\s*(m|min|h|d|wk)', str(interval).strip())
+    if match is None:
+        raise ValueError(f"Unknown bar interval {interval}, use e.g. '1m', '15m', '1h' or '1d'")
+    n, unit = match.groups()
+    if unit == 'wk':
+        return pd.Timedelta(weeks=int(n))
+    return pd.Timedelta(f"{n}{_UNITS[unit]}")
+
+def fetch_interval(interval: str):
+    """Returns the yfinance interval to download before resampling to `interval`"""
+    target = interval_to_timedelta(interval)
+    candidates = [i for i in YF_INTERVALS if target % interval_to_timedelta(i) == pd.Timedelta(0)]
+    if not candidates:
+        raise ValueError(f"Bar interval {interval} cannot be built from the yfinance intervals {YF_INTERVALS}")
+    return max(candidates, key=interval_to_timedelta)
+
+def resample_bars(df: pd.DataFrame, interval: str, time_column: str = 'Date', company_column: str = 'ticker'):
+    """resample_bars aggregates the bars of each ticker into coarser bars (e.g. 1m to 15m)
+
+    Bars are labelled by their start time. Open is the first, High the max, Low the min, Close and
+    Adj Close the last and Volume the sum of the bars of each bucket.
+
+    Example:
+        df = resample_bars(get_stocks_data(['AAPL'], '2024-01-02', '2024-01-05', interval='1m'), '15m')
+    """
+    freq = interval_to_timedelta(interval)
+    bucket = pd.to_datetime(df[time_column]).dt.floor(freq, ambiguous='NaT', nonexistent='NaT')
+    columns = [c for c in df.columns if c not in (time_column, company_column)]
+    aggregations = {c: BAR_AGGREGATIONS.get(c, 'last') for c in columns}
+    bars = df.assign(**{time_column: bucket}).groupby([company_column, time_column], sort=True).agg(aggregations)
+    return bars.reset_index()[[c for c in df.columns]]
+
+def _naive_ns(times):
+    # wall-clock time in ns, the convention of Information.slice_data for naive dates
+    times = pd.DatetimeIndex(pd.to_datetime(times))
+    if times.tz is not None:
+        times = times.tz_localize(None)
+    return times.as_unit('ns').asi8
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class BarPanel:
+    """ The bars of a universe as a time × tickers array, sliced by position instead of by pandas filters
+
+    Row i is the bar starting at times[i], NaN where a ticker has no bar. Windows are contiguous row
+    ranges found with a binary search, so a step of the timeline costs the same with a thousand bars
+    or with millions.
+    """
+    times: np.ndarray # int64 ns, naive wall-clock time
+    tickers: np.ndarray
+    values: np.ndarray
+
+    def __post_init__(self):
+        self._columns = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self._filled = None
+
+    @classmethod
+    def from_data(cls, data: pd.DataFrame, time_column: str = 'Date', company_column: str = 'ticker',
+                  value_column: str = 'Adj Close', dtype=np.float64):
+        """Builds the panel of one column of long-format bars, without a pandas pivot"""
+        keys = _naive_ns(data[time_column])
+        times = np.unique(keys)
+        codes, tickers = pd.factorize(data[company_column], sort=True)
+        values = np.full((len(times), len(tickers)), np.nan, dtype=dtype)
+        values[np.searchsorted(times, keys), codes] = data[value_column].to_numpy(dtype=dtype)
+        return cls(times, np.asarray(tickers), values)
+
+    def column(self, ticker):
+        return self._columns[ticker]
+
+    def index(self, t):
+        """Position of the first bar at or after t"""
+        return int(np.searchsorted(self.times, _naive_ns([t])[0], side='left'))
+
+    def range(self, start, end):
+        """Positions [i0, i1) of the bars with start <= time <= end"""
+        return self.index(start), int(np.searchsorted(self.times, _naive_ns([end])[0], side='right'))
+
+    def window(self, i: int, n_bars: int):
+        """The n_bars bars strictly before bar i (fewer at the start of the data)"""
+        return self.values[max(i - n_bars, 0):i]
+
+    @property
+    def filled(self):
+        """Values forward-filled along time: the last known price of each ticker at each bar"""
+        if self._filled is None:
+            valid = ~np.isnan(self.values)
+            last = np.maximum.accumulate(np.where(valid, np.arange(len(self.times))[:, None], 0), axis=0)
+            filled = self.values[last, np.arange(len(self.tickers))]
+            # before the first bar of a ticker there is no price
+            filled[~np.maximum.accumulate(valid, axis=0)] = np.nan
+            self._filled = filled
+        return self._filled
+
+    def last_prices(self, start: int, stop: int):
+        """Prices known at bars start..stop-1: the last price strictly before each bar"""
+        prices = np.full((stop - start, len(self.tickers)), np.nan, dtype=self.values.dtype)
+        lo = max(start, 1)
+        prices[lo - start:] = self.filled[lo - 1:stop - 1]
+        return prices
+
+    def prices_at(self, i: int):
+        """The {ticker: price} dict the broker trades at on bar i"""
+        if i == 0:
+            return {}
+        row = self.filled[i - 1]
+        return {ticker: float(row[j]) for j, ticker in enumerate(self.tickers) if not np.isnan(row[j])}
+
+    def held_prices(self, i: int, positions: dict):
+        """Prices on bar i of the held tickers only, O(number of positions)"""
+        if i == 0:
+            return {}
+        row = self.filled[i - 1]
+        return {ticker: float(row[self._columns[ticker]]) for ticker in positions}
+
+    def price_matrix(self, rows):
+        """The PriceMatrix of the given bars, e.g. to mark a bar backtest to market once per day"""
+        rows = np.asarray(rows, dtype=int)
+        values = np.full((len(rows), len(self.tickers)), np.nan)
+        has_previous = rows > 0
+        values[has_previous] = self.filled[rows[has_previous] - 1]
+        return PriceMatrix(self.times[rows].astype('datetime64[ns]'), self.tickers, values)
+
+@dataclass
+class BarValuer:
+    """ Values a bar backtest chunk by chunk from its transaction log, in memory bounded by the chunk size """
+    panel: BarPanel
+    initial_cash: float
+
+    def __post_init__(self):
+        self.holdings = np.zeros(len(self.panel.tickers))
+        self.cash = float(self.initial_cash)
+        self._logged = 0 # rows of the transaction log already applied
+
+    def values(self, transaction_log: pd.DataFrame, start: int, stop: int):
+        """Portfolio values of bars start..stop-1, all the trades of these bars must be in the log"""
+        n = stop - start
+        trades = np.zeros((n, len(self.panel.tickers)))
+        cash = np.full(n, np.nan)
+        log = transaction_log.iloc[self._logged:]
+        if len(log):
+            rows = np.searchsorted(self.panel.times, _naive_ns(log['Date']), side='right') - 1 - start
+            signs = np.where(log['Action'].astype(str).to_numpy() == 'SELL', -1.0, 1.0)
+            columns = np.array([self.panel.column(ticker) for ticker in log['Ticker']])
+            np.add.at(trades, (rows, columns), signs * log['Quantity'].to_numpy(dtype=float))
+            balances = log['Cash'].to_numpy(dtype=float)
+            last = np.r_[rows[1:] != rows[:-1], True]
+            cash[rows[last]] = balances[last]
+            self._logged += len(log)
+        holdings = self.holdings + np.cumsum(trades, axis=0)
+        cash = pd.Series(cash).ffill().fillna(self.cash).to_numpy()
+        prices = self.panel.last_prices(start, stop)
+        values = cash + np.where(holdings != 0, holdings * prices, 0.0).sum(axis=1)
+        if n:
+            self.holdings, self.cash = holdings[-1], cash[-1]
+        return values
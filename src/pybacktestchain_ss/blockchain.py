@@ -1,8 +1,181 @@
 import hashlib
+import hmac
+import json
+import logging
+import struct
+import threading
 import time
+import zlib
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 import pickle # prefered serialization method
 import os 
+import shutil
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+import pandas as pd
+from pybacktestchain_ss.results_io import normalize_transaction_log
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+PAYLOAD_FORMAT = 'merkle-v1'
+BLOB_FOLDER = 'blockchain/blobs'
+# prefixes separating leaves from inner nodes, so that a node can never be passed off as a trade
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+BLOCKCHAIN_FOLDER = 'blockchain'
+SNAPSHOT_FORMAT = 'snapshot-v1'
+# blocks kept in the chain file, older ones are archived in segments by compact()
+DEFAULT_SNAPSHOT_INTERVAL = 1000
+# environment variable holding the key the snapshots are signed with, a key file is created otherwise
+SNAPSHOT_KEY_ENV = 'PYBACKTESTCHAIN_SNAPSHOT_KEY'
+
+#---------------------------------------------------------
+# Chain store
+#---------------------------------------------------------
+
+# lock depth per chain name and thread, so that a thread holding a lock can take it again
+_held_locks = threading.local()
+
+def _chain_path(name: str):
+    return os.path.join(BLOCKCHAIN_FOLDER, f'{name}.pkl')
+
+@contextmanager
+def chain_lock(name: str):
+    """chain_lock holds an exclusive lock on a chain, shared by the threads and processes of this machine
+
+    Example:
+        with chain_lock('backtest'):
+            blockchain = load_blockchain('backtest')
+    """
+    depths = _held_locks.__dict__.setdefault('depths', {})
+    if depths.get(name, 0) > 0:
+        depths[name] += 1
+        try:
+            yield
+        finally:
+            depths[name] -= 1
+        return
+    os.makedirs(BLOCKCHAIN_FOLDER, exist_ok=True)
+    with open(os.path.join(BLOCKCHAIN_FOLDER, f'{name}.lock'), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        depths[name] = 1
+        try:
+            yield
+        finally:
+            depths[name] = 0
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _write_bytes(data: bytes, path: str):
+    """Writes data to a temporary file and renames it over path, readers never see a partial file"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _write_atomic(obj, path: str):
+    """Pickles obj to a temporary file and renames it over path, readers never see a partial file"""
+    _write_bytes(pickle.dumps(obj), path)
+
+def _read_chain(name: str):
+    path = _chain_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        blockchain = pickle.load(f)
+    return _reconcile(blockchain, read_snapshot(name))
+
+#---------------------------------------------------------
+# Snapshots and archive segments
+#---------------------------------------------------------
+
+def _snapshot_path(name: str, folder: str = BLOCKCHAIN_FOLDER):
+    return os.path.join(folder, f'{name}.snapshot.json')
+
+def _archive_folder(name: str, folder: str = BLOCKCHAIN_FOLDER):
+    return os.path.join(folder, f'{name}.archive')
+
+def snapshot_key(folder: str = BLOCKCHAIN_FOLDER):
+    """The HMAC key of the snapshots: the SNAPSHOT_KEY_ENV variable, or a random key kept in the chain folder"""
+    if os.environ.get(SNAPSHOT_KEY_ENV):
+        return os.environ[SNAPSHOT_KEY_ENV].encode()
+    path = os.path.join(folder, '.snapshot_key')
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        try:
+            # only the first process creates the key, the others read it
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(32).hex().encode())
+        except FileExistsError:
+            pass
+    with open(path, 'rb') as f:
+        return f.read().strip()
+
+def _sign(content: dict, folder: str = BLOCKCHAIN_FOLDER):
+    message = json.dumps(content, sort_keys=True, separators=(',', ':')).encode()
+    return hmac.new(snapshot_key(folder), message, hashlib.sha256).hexdigest()
+
+def read_snapshot(name: str, folder: str = BLOCKCHAIN_FOLDER):
+    """Reads the snapshot of a chain and checks its signature, None if the chain was never compacted
+
+    The snapshot holds the height and the tip hash of the archived part of the chain, and the digest
+    of the last archive segment, which links back to the previous ones.
+    """
+    path = _snapshot_path(name, folder)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        snapshot = json.loads(f.read())
+    signature = snapshot.pop('signature', '')
+    if not hmac.compare_digest(signature, _sign(snapshot, folder)):
+        raise ValueError(f"The snapshot of blockchain {name} is not signed with the snapshot key")
+    return snapshot
+
+def _reconcile(blockchain, snapshot: dict):
+    # a compaction interrupted between the snapshot and the chain file leaves archived blocks in the chain file
+    if snapshot is None or snapshot['height'] <= blockchain.base_height:
+        return blockchain
+    archived = snapshot['height'] - blockchain.base_height
+    if archived > len(blockchain.chain) or blockchain.chain[archived - 1].hash != snapshot['tip']:
+        raise ValueError(f"Blockchain {blockchain.name} does not continue its snapshot")
+    blockchain.chain = blockchain.chain[archived:]
+    blockchain.base_height, blockchain.base_hash = snapshot['height'], snapshot['tip']
+    return blockchain
+
+def _read_segment(name: str, segment: str, digest: str, folder: str = BLOCKCHAIN_FOLDER):
+    """Reads the manifest of an archive segment, checked against the digest recorded by its successor"""
+    with open(os.path.join(_archive_folder(name, folder), segment), 'rb') as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Archive segment {segment} of blockchain {name} does not match its digest")
+    return json.loads(data)
+
+def _read_segments(name: str, snapshot: dict, folder: str = BLOCKCHAIN_FOLDER):
+    # the manifests of all the segments, oldest first, following the digests back from the snapshot
+    manifests, segment, digest = [], snapshot['last_segment'], snapshot['last_segment_sha256']
+    while segment is not None:
+        manifest = _read_segment(name, segment, digest, folder)
+        manifests.append(manifest)
+        segment, digest = manifest['previous_segment'], manifest['previous_segment_sha256']
+    return manifests[::-1]
 
 @dataclass
 class Block:
@@ -25,14 +198,32 @@ class Block:
              + self.previous_hash).encode()
         ).hexdigest()
     
+@dataclass
+class BlockHeader:
+    """ A block without its payload: enough to check the hash links, the payload digest stands for the data """
+    height: int
+    name_backtest: str
+    timestamp: float
+    previous_hash: str
+    hash: str
+    data_sha256: str
+
+    @classmethod
+    def of(cls, block: Block, height: int):
+        return cls(height, block.name_backtest, block.timestamp, block.previous_hash, block.hash,
+                   hashlib.sha256(block.data.encode()).hexdigest())
+
 @dataclass
 class Blockchain:
     name: str
-    chain: list = field(default_factory=list)
+    chain: list = field(default_factory=list) # the blocks after the archived ones, all of them if never compacted
+    base_height: int = 0 # number of archived blocks before chain[0]
+    base_hash: str = '' # hash of the last archived block, the previous hash of chain[0]
+    snapshot_interval: int = DEFAULT_SNAPSHOT_INTERVAL # the chain is compacted when it holds more blocks
 
     def store(self):
-        with open(f'blockchain/{self.name}.pkl', 'wb') as f:
-            pickle.dump(self, f)
+        with chain_lock(self.name):
+            _write_atomic(self, _chain_path(self.name))
 
     def __post_init__(self):
         # Initialize the chain with the genesis block
@@ -44,12 +235,127 @@ class Blockchain:
         return Block('Genesis Block', '', '0')
 
     def add_block(self, name:str, data: str):
-        previous_block = self.chain[-1]
-        new_block = Block(name, data, previous_block.hash)
-        self.chain.append(new_block)
-        self.store()
+        return self.add_blocks([(name, data)])[0]
+
+    def add_block_once(self, name: str, data: str):
+        """Appends a block unless the chain already holds one with the same name and data, returns it either way
+
+        This makes a commit safe to retry: a writer interrupted after its append finds its block instead of
+        adding it twice. Only the hot chain is looked at, so the retry must come before the next compaction.
+        """
+        with chain_lock(self.name):
+            stored = _read_chain(self.name)
+            for block in reversed(stored.chain if stored is not None else self.chain):
+                if block.name_backtest == name and block.data == data:
+                    return block
+            return self.add_block(name, data)
+
+    def _link(self, items: list):
+        # chain the new blocks after the current tip
+        blocks, previous_hash = [], self.chain[-1].hash
+        for name, data in items:
+            block = Block(name, data, previous_hash)
+            blocks.append(block)
+            previous_hash = block.hash
+        return blocks
+
+    def add_blocks(self, items: list):
+        """Appends many (name, data) blocks in a single write and returns them.
+
+        The blocks are built without holding the lock. If another writer moved the tip of the stored
+        chain in the meantime, this chain is refreshed from disk and the blocks are linked again.
+        """
+        expected_tip = self.chain[-1].hash
+        blocks = self._link(items)
+        with chain_lock(self.name):
+            stored = _read_chain(self.name)
+            if stored is not None:
+                # the stored chain may have been compacted by another writer
+                self.chain, self.base_height, self.base_hash = stored.chain, stored.base_height, stored.base_hash
+                if stored.chain[-1].hash != expected_tip:
+                    # optimistic append failed, retry on top of the stored tip (the lock guarantees progress)
+                    blocks = self._link(items)
+            self.chain.extend(blocks)
+            self.store()
+            if self.snapshot_interval and len(self.chain) > self.snapshot_interval:
+                self.compact()
+        return blocks
+
+    @property
+    def height(self):
+        """Number of blocks of the whole chain, archived ones included"""
+        return self.base_height + len(self.chain)
+
+    def compact(self, keep: int = 1):
+        """Moves all the blocks but the last `keep` ones to a cold archive segment and signs a new snapshot
+
+        The segment holds the archived blocks and their headers, and the digest of the previous segment, so
+        the segments form a hash chain ending at the snapshot. The chain file only keeps the recent blocks,
+        which makes opening the chain for an append independent of its history.
+        """
+        with chain_lock(self.name):
+            stored = _read_chain(self.name)
+            if stored is not None:
+                self.chain, self.base_height, self.base_hash = stored.chain, stored.base_height, stored.base_hash
+            archived = self.chain[:max(len(self.chain) - max(keep, 1), 0)]
+            if not archived:
+                return None
+            snapshot = read_snapshot(self.name)
+            first, last = self.base_height, self.base_height + len(archived) - 1
+            folder = _archive_folder(self.name)
+            os.makedirs(folder, exist_ok=True)
+            blocks_file = f'{first:010d}-{last:010d}.blocks.pkl'
+            blocks_data = pickle.dumps(archived)
+            _write_bytes(blocks_data, os.path.join(folder, blocks_file))
+            manifest = {
+                'first': first, 'last': last, 'blocks': blocks_file,
+                'blocks_sha256': hashlib.sha256(blocks_data).hexdigest(),
+                'headers': [list(BlockHeader.of(block, first + i).__dict__.values()) for i, block in enumerate(archived)],
+                'previous_segment': snapshot['last_segment'] if snapshot else None,
+                'previous_segment_sha256': snapshot['last_segment_sha256'] if snapshot else None,
+            }
+            segment = f'{first:010d}-{last:010d}.json'
+            manifest_data = json.dumps(manifest, separators=(',', ':')).encode()
+            _write_bytes(manifest_data, os.path.join(folder, segment))
+            snapshot = {'format': SNAPSHOT_FORMAT, 'name': self.name, 'height': last + 1, 'tip': archived[-1].hash,
+                        'last_segment': segment, 'last_segment_sha256': hashlib.sha256(manifest_data).hexdigest(),
+                        'created': time.time()}
+            snapshot['signature'] = _sign(snapshot)
+            # the snapshot first: a chain file still holding the archived blocks is reconciled on read
+            _write_bytes(json.dumps(snapshot, sort_keys=True).encode(), _snapshot_path(self.name))
+            self.chain = self.chain[len(archived):]
+            self.base_height, self.base_hash = last + 1, archived[-1].hash
+            self.store()
+            logging.info(f"Archived blocks {first} to {last} of blockchain {self.name}")
+            return snapshot
+
+    def headers(self, folder: str = BLOCKCHAIN_FOLDER):
+        """The headers of every block, archived ones included, without reading the archived payloads"""
+        headers = []
+        snapshot = read_snapshot(self.name, folder) if self.base_height else None
+        if snapshot is not None:
+            for manifest in _read_segments(self.name, snapshot, folder):
+                headers.extend(BlockHeader(*header) for header in manifest['headers'])
+        headers.extend(BlockHeader.of(block, self.base_height + i) for i, block in enumerate(self.chain))
+        return headers
+
+    def archived_blocks(self, folder: str = BLOCKCHAIN_FOLDER):
+        """Reads back the archived blocks, oldest first, each segment checked against its digest"""
+        snapshot = read_snapshot(self.name, folder) if self.base_height else None
+        if snapshot is None:
+            return
+        archive = _archive_folder(self.name, folder)
+        for manifest in _read_segments(self.name, snapshot, folder):
+            with open(os.path.join(archive, manifest['blocks']), 'rb') as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() != manifest['blocks_sha256']:
+                raise ValueError(f"Archived blocks {manifest['blocks']} of blockchain {self.name} do not match their digest")
+            yield manifest, pickle.loads(data)
 
     def is_valid(self):
+        # the recent blocks only, verify_full also checks the archive
+        if self.base_height and self.chain and self.chain[0].previous_hash != self.base_hash:
+            return False
         for i in range(1, len(self.chain)):
             current_block = self.chain[i]
             previous_block = self.chain[i - 1]
@@ -61,11 +367,33 @@ class Blockchain:
                 return False
 
         return True
+
+    def verify_full(self, folder: str = BLOCKCHAIN_FOLDER):
+        """Checks the whole chain: the snapshot signature, every archived block hash and every link up to the tip
+
+        This reads all the archive segments, it is meant to be run on demand rather than before each append.
+        """
+        try:
+            previous_hash, height = '0', 0
+            for manifest, blocks in self.archived_blocks(folder):
+                for i, block in enumerate(blocks):
+                    header = BlockHeader(*manifest['headers'][i])
+                    if block.hash != block.calculate_hash or header != BlockHeader.of(block, manifest['first'] + i):
+                        raise ValueError(f"Archived block {manifest['first'] + i} was altered")
+                    if height and block.previous_hash != previous_hash:
+                        raise ValueError(f"Archived block {manifest['first'] + i} does not link to the previous one")
+                    previous_hash, height = block.hash, height + 1
+            if height != self.base_height or (height and previous_hash != self.base_hash):
+                raise ValueError("The archive does not end where the chain starts")
+        except (ValueError, OSError) as e:
+            logging.warning(f"Blockchain {self.name} failed the full verification: {e}")
+            return False
+        return self.is_valid()
     
     def __str__(self):
         # display the blockchain
         to_return = ''
-        for i, block in enumerate(self.chain):
+        for i, block in enumerate(self.chain, self.base_height):
             to_return += "-" * 80 + '\n'
             to_return += f"Block {i}\n"
             to_return += "-" * 80 + '\n'
@@ -78,12 +406,199 @@ class Blockchain:
     
     # remove the blockchain
     def remove_blockchain(self):
-        os.remove(f'blockchain/{self.name}.pkl')
+        remove_blockchain(self.name)
     
 
 def load_blockchain(name: str):
-    with open(f'blockchain/{name}.pkl', 'rb') as f:
-        return pickle.load(f)
+    # no lock needed, the file is only ever replaced atomically
+    with open(_chain_path(name), 'rb') as f:
+        return _reconcile(pickle.load(f), read_snapshot(name))
+
+def open_blockchain(name: str):
+    """Loads a chain, creating it if it does not exist yet (safe when several processes do it at once)"""
+    with chain_lock(name):
+        blockchain = _read_chain(name)
+        if blockchain is None:
+            blockchain = Blockchain(name)
+        return blockchain
     
 def remove_blockchain(name: str):
-    os.remove(f'blockchain/{name}.pkl')
\ No newline at end of file
+    os.remove(_chain_path(name))
+    # and its archive, if it was ever compacted
+    if os.path.exists(_snapshot_path(name)):
+        os.remove(_snapshot_path(name))
+    if os.path.isdir(_archive_folder(name)):
+        shutil.rmtree(_archive_folder(name))
+
+#---------------------------------------------------------
+# Compact results payloads
+#---------------------------------------------------------
+
+def _column_type(series: pd.Series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    if pd.api.types.is_integer_dtype(series):
+        return 'int'
+    if pd.api.types.is_float_dtype(series):
+        return 'float'
+    return 'str'
+
+def _encode_value(value, kind: str):
+    if kind == 'datetime':
+        return struct.pack('<q', pd.Timestamp(value).value)
+    if kind == 'int':
+        return struct.pack('<q', int(value))
+    if kind == 'float':
+        return struct.pack('<d', float(value))
+    encoded = str(value).encode()
+    return struct.pack('<H', len(encoded)) + encoded
+
+def _decode_value(buffer: bytes, offset: int, kind: str):
+    if kind == 'datetime':
+        return pd.Timestamp(struct.unpack_from('<q', buffer, offset)[0]), offset + 8
+    if kind == 'int':
+        return struct.unpack_from('<q', buffer, offset)[0], offset + 8
+    if kind == 'float':
+        return struct.unpack_from('<d', buffer, offset)[0], offset + 8
+    length = struct.unpack_from('<H', buffer, offset)[0]
+    return buffer[offset + 2:offset + 2 + length].decode(), offset + 2 + length
+
+def encode_trades(df: pd.DataFrame):
+    """encode_trades serializes each row of a transaction log to canonical bytes
+
+    Args:
+        df (pd.DataFrame): The transaction log
+
+    Returns:
+        tuple: The schema as a list of (column, type) and the list of encoded records
+    """
+    df = normalize_transaction_log(df)
+    schema = [(column, _column_type(df[column])) for column in df.columns]
+    records = []
+    for row in df.itertuples(index=False, name=None):
+        records.append(b''.join(_encode_value(value, kind) for value, (_, kind) in zip(row, schema)))
+    return schema, records
+
+def decode_trades(schema: list, records: list):
+    """decode_trades is the inverse of encode_trades"""
+    rows = []
+    for record in records:
+        row, offset = [], 0
+        for _, kind in schema:
+            value, offset = _decode_value(record, offset, kind)
+            row.append(value)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=[column for column, _ in schema])
+
+def _leaf_hash(record: bytes):
+    return hashlib.sha256(LEAF_PREFIX + record).digest()
+
+def _node_hash(left: bytes, right: bytes):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+def _merkle_levels(records: list):
+    level = [_leaf_hash(record) for record in records] or [hashlib.sha256(b'').digest()]
+    levels = [level]
+    while len(level) > 1:
+        if len(level) % 2:
+            # an odd node is paired with itself
+            level = level + [level[-1]]
+        level = [_node_hash(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+def merkle_root(records: list):
+    """merkle_root computes the Merkle root (hex) of a list of encoded trade records"""
+    return _merkle_levels(records)[-1][0].hex()
+
+def merkle_proof(records: list, index: int):
+    """merkle_proof returns the sibling hashes proving that records[index] is part of the Merkle root
+
+    Returns:
+        list: (sibling hash hex, sibling is on the left) pairs from the leaf up to the root
+    """
+    proof = []
+    for level in _merkle_levels(records)[:-1]:
+        if len(level) % 2:
+            level = level + [level[-1]]
+        sibling = index ^ 1
+        proof.append((level[sibling].hex(), sibling < index))
+        index //= 2
+    return proof
+
+def verify_merkle_proof(record: bytes, proof: list, root: str):
+    """verify_merkle_proof checks a single trade record against a Merkle root, without the other trades"""
+    node = _leaf_hash(record)
+    for sibling, is_left in proof:
+        sibling = bytes.fromhex(sibling)
+        node = _node_hash(sibling, node) if is_left else _node_hash(node, sibling)
+    return node.hex() == root
+
+def store_blob(data: bytes, folder: str = BLOB_FOLDER):
+    """store_blob saves bytes under their sha256 digest (content-addressed) and returns the digest"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(folder, f'{digest}.bin')
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return digest
+
+def load_blob(digest: str, folder: str = BLOB_FOLDER):
+    """load_blob reads a content-addressed blob and checks that it was not altered"""
+    with open(os.path.join(folder, f'{digest}.bin'), 'rb') as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Blob {digest} does not match its hash")
+    return data
+
+def results_payload(df: pd.DataFrame, folder: str = BLOB_FOLDER):
+    """results_payload builds the compact block data for a transaction log
+
+    The block only keeps the Merkle root of the trades, their count and the digest of a compressed
+    blob holding the full log. The blob is stored next to the chain, in a content-addressed folder.
+
+    Example:
+        blockchain.add_block(backtest_name, results_payload(transaction_log))
+    """
+    schema, records = encode_trades(df)
+    body = b''.join(struct.pack('<I', len(record)) + record for record in records)
+    header = json.dumps({'schema': schema}, separators=(',', ':')).encode()
+    blob = zlib.compress(struct.pack('<I', len(header)) + header + body, 9)
+    digest = store_blob(blob, folder)
+    return json.dumps({'format': PAYLOAD_FORMAT, 'root': merkle_root(records), 'n': len(records),
+                       'blob': digest}, separators=(',', ':'), sort_keys=True)
+
+def parse_payload(data: str):
+    """Returns the payload of a block as a dict, or None for blocks storing plain text"""
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or payload.get('format') != PAYLOAD_FORMAT:
+        return None
+    return payload
+
+def load_trade_records(block: Block, folder: str = BLOB_FOLDER):
+    """Reads back the schema and the encoded trade records of a block, checked against its Merkle root"""
+    payload = parse_payload(block.data)
+    if payload is None:
+        raise ValueError(f"Block {block.name_backtest} does not carry a {PAYLOAD_FORMAT} payload")
+    blob = zlib.decompress(load_blob(payload['blob'], folder))
+    header_length = struct.unpack_from('<I', blob, 0)[0]
+    schema = [tuple(column) for column in json.loads(blob[4:4 + header_length])['schema']]
+    records, offset = [], 4 + header_length
+    while offset < len(blob):
+        length = struct.unpack_from('<I', blob, offset)[0]
+        records.append(blob[offset + 4:offset + 4 + length])
+        offset += 4 + length
+    if len(records) != payload['n'] or merkle_root(records) != payload['root']:
+        raise ValueError(f"Trades of block {block.name_backtest} do not match its Merkle root")
+    return schema, records
+
+def load_results(block: Block, folder: str = BLOB_FOLDER):
+    """load_results returns the transaction log stored by a block as a DataFrame"""
+    schema, records = load_trade_records(block, folder)
+    return decode_trades(schema, records)
@@ -1,15 +1,25 @@
+import numpy as np
 import pandas as pd
 import logging
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, Type
+from typing import Callable, Optional, Type
 
 import os 
-import pickle
 from pybacktestchain_ss.data_module import UNIVERSE_SEC, FirstTwoMoments, get_stocks_data, DataModule, Information
-from pybacktestchain_ss.utils import generate_random_name
-from pybacktestchain_ss.blockchain import Blockchain
+from pybacktestchain_ss.utils import generate_random_name, run_name
+from pybacktestchain_ss.blockchain import Blockchain, open_blockchain, results_payload
+from pybacktestchain_ss.registry import BacktestRegistry, DEFAULT_REGISTRY_PATH
+from pybacktestchain_ss.results_io import get_results_writer
 from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy, RiskAverseStrategy
+from pybacktestchain_ss.transaction_costs import CostModel
+from pybacktestchain_ss.valuation import PriceMatrix, mark_to_market
+from pybacktestchain_ss.bars import BarValuer, fetch_interval
+from pybacktestchain_ss.analytics import RunPanel
+from pybacktestchain_ss.universe import ScreenPanel, UniverseScreen, restrict_information_set
+from pybacktestchain_ss.checkpoint import Checkpoint, CheckpointStore, DEFAULT_CHECKPOINT_DIR, lineage_key
+from pybacktestchain_ss.precision import PrecisionPolicy, plan_memory, precision_policy
+from pybacktestchain_ss.run_cache import CachedRun, RunCache, DEFAULT_CACHE_DIR, backtest_config, data_fingerprint, run_identity
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -32,25 +42,21 @@ class Broker:
     transaction_log: pd.DataFrame = None
     entry_prices: dict = None
     verbose: bool = True
+    cost_model: Optional[CostModel] = None # transaction costs, e.g. FixedBps(5), None for frictionless fills
 
     def initialize_blockchain(self, name: str):
         # Check if the blockchain is already initialized and stored in the blockchain folder
         # if folder blockchain does not exist, create it
         if not os.path.exists('blockchain'):
-            os.makedirs('blockchain')
-        chains = os.listdir('blockchain')
-        ending = f'{name}.pkl'
-        if ending in chains:
+            os.makedirs('blockchain', exist_ok=True)
+        exists = os.path.exists(f'blockchain/{name}.pkl')
+        # load or create the chain under its lock, so that concurrent backtests share the same chain
+        self.blockchain = open_blockchain(name)
+        if exists:
             if self.verbose:
                 logging.warning(f"Blockchain with name {name} already exists. Please use a different name.")
-            with open(f'blockchain/{name}.pkl', 'rb') as f:
-                self.blockchain = pickle.load(f)
             return
 
-        self.blockchain = Blockchain(name)
-        # Store the blockchain
-        self.blockchain.store()
-
         if self.verbose:
             logging.info(f"Blockchain with name {name} initialized and stored in the blockchain folder.")
 
@@ -60,17 +66,27 @@ class Broker:
             self.positions = {}
         # Initialize the transaction log as an empty DataFrame if none is provided
         if self.transaction_log is None:
-            self.transaction_log = pd.DataFrame(columns=['Date', 'Action', 'Ticker', 'Quantity', 'Price', 'Cash'])
+            self.transaction_log = pd.DataFrame(columns=['Date', 'Action', 'Ticker', 'Quantity', 'Price', 'Cash', 'Cost'])
     
         # Initialize the entry prices as a dictionary
         if self.entry_prices is None:
             self.entry_prices = {}
 
-    def buy(self, ticker: str, quantity: int, price: float, date: datetime):
-        """Executes a buy order for the specified ticker."""
+    def buy(self, ticker: str, quantity: int, price: float, date: datetime, cost: float = 0.0):
+        """Executes a buy order for the specified ticker, cost is the transaction cost paid on top of the price."""
+        if self._buy(ticker, quantity, price, cost):
+            self.log_transaction(date, 'BUY', ticker, quantity, price, cost)
+
+    def sell(self, ticker: str, quantity: int, price: float, date: datetime, cost: float = 0.0):
+        """Executes a sell order for the specified ticker, cost is the transaction cost deducted from the proceeds."""
+        if self._sell(ticker, quantity, price, cost):
+            self.log_transaction(date, 'SELL', ticker, quantity, price, cost)
+
+    def _buy(self, ticker: str, quantity: int, price: float, cost: float = 0.0):
+        # updates the cash and the positions, returns True if the order was filled
         if quantity == 0:
-            return
-        total_cost = price * quantity
+            return False
+        total_cost = price * quantity + cost
         if self.cash >= total_cost:
             self.cash -= total_cost
             if ticker in self.positions:
@@ -81,39 +97,46 @@ class Broker:
                 position.entry_price = new_entry_price
             else:
                 self.positions[ticker] = Position(ticker, quantity, price)
-            self.log_transaction(date, 'BUY', ticker, quantity, price)
             self.entry_prices[ticker] = price
-        else:
-            if self.verbose:
-                logging.warning(f"Not enough cash to buy {quantity} shares of {ticker} at {price}. Available cash: {self.cash}")
-    
-    def sell(self, ticker: str, quantity: int, price: float, date: datetime):
-        """Executes a sell order for the specified ticker."""
+            return True
+        if self.verbose:
+            logging.warning(f"Not enough cash to buy {quantity} shares of {ticker} at {price}. Available cash: {self.cash}")
+        return False
+
+    def _sell(self, ticker: str, quantity: int, price: float, cost: float = 0.0):
         if ticker in self.positions and self.positions[ticker].quantity >= quantity:
             position = self.positions[ticker]
             position.quantity -= quantity
-            self.cash += price * quantity
+            self.cash += price * quantity - cost
             if position.quantity == 0:
                 del self.positions[ticker]
                 del self.entry_prices[ticker]
-            self.log_transaction(date, 'SELL', ticker, quantity, price)
-        else:
-            if self.verbose:
-                logging.warning(f"Not enough shares to sell {quantity} shares of {ticker}. Position size: {self.positions.get(ticker, 0)}")
-    
-    def log_transaction(self, date, action, ticker, quantity, price):
+            return True
+        if self.verbose:
+            logging.warning(f"Not enough shares to sell {quantity} shares of {ticker}. Position size: {self.positions.get(ticker, 0)}")
+        return False
+
+    def log_transaction(self, date, action, ticker, quantity, price, cost=0.0):
         """Logs the transaction."""
-        transaction = pd.DataFrame([{
+        self.log_transactions([self._transaction(date, action, ticker, quantity, price, cost)])
+
+    def _transaction(self, date, action, ticker, quantity, price, cost=0.0):
+        return {
             'Date': date,
             'Action': action,
             'Ticker': ticker,
             'Quantity': quantity,
             'Price': price,
-            'Cash': self.cash
-        }])
-
-        self.transaction_log = pd.concat([self.transaction_log, transaction], ignore_index=True)
+            'Cash': self.cash,
+            'Cost': cost
+        }
 
+    def log_transactions(self, transactions: list):
+        """Appends several transactions to the log at once (one concat per rebalancing instead of one per trade)."""
+        if not transactions:
+            return
+        self.transaction_log = pd.concat([self.transaction_log, pd.DataFrame(transactions)], ignore_index=True)
+    
     def get_cash_balance(self):
         return self.cash
 
@@ -127,47 +150,63 @@ class Broker:
             portfolio_value += position.quantity * market_prices[ticker]
         return portfolio_value
     
-    def execute_portfolio(self, portfolio: dict, prices: dict, date: datetime):
-        """Executes the trades for the portfolio based on the generated weights."""
-        
-        # First, handle all the sell orders to free up cash
-        for ticker, weight in portfolio.items():
-            price = prices.get(ticker)
-            if price is None:
+    def execute_portfolio(self, portfolio: dict, prices: dict, date: datetime, volumes: dict = None):
+        """Executes the trades for the portfolio based on the generated weights.
+
+        The orders of all the tickers are sized and priced by the cost model in one vectorized pass, on the
+        value of the portfolio before trading. Sells go first to free up cash, then the buys are filled in
+        order while there is enough cash to pay for them and their costs.
+
+        Args:
+            portfolio (dict): Target weight by ticker
+            prices (dict): Fill price by ticker
+            date (datetime): Date of the trades
+            volumes (dict): Average daily volume by ticker, used by the cost models with market impact
+        """
+        tickers = []
+        for ticker in portfolio:
+            if prices.get(ticker) is None:
                 if self.verbose:
                     logging.warning(f"Price for {ticker} not available on {date}")
                 continue
-            total_value = self.get_portfolio_value(prices)
-            target_value = total_value * weight
-            current_value = self.positions.get(ticker, Position(ticker, 0, 0)).quantity * price
-            diff_value = target_value - current_value
-            quantity_to_trade = int(diff_value / price)
-            if quantity_to_trade < 0:
-                self.sell(ticker, abs(quantity_to_trade), price, date)
-        
+            tickers.append(ticker)
+        if not tickers:
+            return
+        weights = np.array([portfolio[ticker] for ticker in tickers], dtype=float)
+        price = np.array([prices[ticker] for ticker in tickers], dtype=float)
+        held = np.array([self.positions[ticker].quantity if ticker in self.positions else 0 for ticker in tickers], dtype=float)
+        total_value = self.get_portfolio_value(prices)
+        # number of shares to trade, truncated towards zero
+        quantities = np.trunc((total_value * weights - held * price) / price).astype(int)
+        volume = None
+        if self.cost_model is not None:
+            volume = None if volumes is None else np.array([volumes.get(ticker, np.nan) for ticker in tickers], dtype=float)
+            costs = self.cost_model.costs(quantities, price, volume)
+        else:
+            costs = np.zeros(len(tickers))
+
+        transactions = []
+        # First, handle all the sell orders to free up cash
+        for i in np.flatnonzero(quantities < 0):
+            quantity, cost = int(-quantities[i]), float(costs[i])
+            if self._sell(tickers[i], quantity, float(price[i]), cost):
+                transactions.append(self._transaction(date, 'SELL', tickers[i], quantity, float(price[i]), cost))
+
         # Then, handle all the buy orders, checking if there's enough cash
-        for ticker, weight in portfolio.items():
-            price = prices.get(ticker)
-            if price is None:
+        for i in np.flatnonzero(quantities > 0):
+            quantity, cost = int(quantities[i]), float(costs[i])
+            available_cash = self.get_cash_balance()
+            if quantity * price[i] + cost > available_cash:
                 if self.verbose:
-                    logging.warning(f"Price for {ticker} not available on {date}")
-                continue
-            total_value = self.get_portfolio_value(prices)
-            target_value = total_value * weight
-            current_value = self.positions.get(ticker, Position(ticker, 0, 0)).quantity * price
-            diff_value = target_value - current_value
-            quantity_to_trade = int(diff_value / price)
-            if quantity_to_trade > 0:
-                available_cash = self.get_cash_balance()
-                cost = quantity_to_trade * price
-                if cost <= available_cash:
-                    self.buy(ticker, quantity_to_trade, price, date)
-                else:
-                    if self.verbose:
-                        logging.warning(f"Not enough cash to buy {quantity_to_trade} of {ticker} on {date}. Needed: {cost}, Available: {available_cash}")
-                        logging.info(f"Buying as many shares of {ticker} as possible with available cash.")
-                    quantity_to_trade = int(available_cash / price)
-                    self.buy(ticker, quantity_to_trade, price, date)
+                    logging.warning(f"Not enough cash to buy {quantity} of {tickers[i]} on {date}. Needed: {quantity * price[i] + cost}, Available: {available_cash}")
+                    logging.info(f"Buying as many shares of {tickers[i]} as possible with available cash.")
+                # the cost per share of the full order is an upper bound for the smaller one
+                quantity = int(available_cash / (price[i] + cost / quantity))
+                if self.cost_model is not None:
+                    cost = float(self.cost_model.costs(np.array([quantity]), price[i:i + 1], None if volume is None else volume[i:i + 1])[0])
+            if self._buy(tickers[i], quantity, float(price[i]), cost):
+                transactions.append(self._transaction(date, 'BUY', tickers[i], quantity, float(price[i]), cost))
+        self.log_transactions(transactions)
 
     def get_transaction_log(self):
         """Returns the transaction log."""
@@ -178,6 +217,18 @@ class RebalanceFlag:
     def time_to_rebalance(self, t: datetime):
         pass 
 
+    def rebalance_mask(self, times):
+        """Flags the bars to rebalance on: the first bar of each day for which time_to_rebalance is True
+
+        The flag is evaluated once per day, so that the daily calendars also work on intraday bars.
+        """
+        times = pd.DatetimeIndex(times)
+        days = times.normalize()
+        first_bars = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(times) else np.array([], dtype=int)
+        mask = np.zeros(len(times), dtype=bool)
+        mask[[i for i in first_bars if self.time_to_rebalance(days[i])]] = True
+        return mask
+
 # Implementation of e.g. rebalancing at the end of each month
 @dataclass
 class EndOfMonth(RebalanceFlag):
@@ -258,74 +309,424 @@ class Backtest:
     risk_threshold: float = 0.1
     initial_cash: int = 1000000 # making this mutable
     name_blockchain: str = 'backtest'
+    registry_path: Optional[str] = DEFAULT_REGISTRY_PATH # None to not index the run in the registry
+    results_format: str = 'csv' # format of the stored transaction log: 'csv', 'parquet' or 'feather'
     verbose: bool = True
+    progress_callback: Optional[Callable] = None # called with (dates, values) while the backtest runs
+    progress_interval: int = 20 # number of steps between two progress_callback calls
+    data_module: Optional[DataModule] = None # already loaded data, the price data is downloaded if None
+    price_store: Optional[str] = None # path of a PriceStore to read the price data from instead of downloading it
+    information_cache: Optional[dict] = None # information sets and prices by (t, s, storage dtype), can be shared between backtests
+    persist: bool = True # False to not store the results (csv, blockchain and registry)
+    strategy_batch_size: int = 64 # number of dates whose portfolios are optimized in one vectorized call
+    cost_model: Optional[CostModel] = None # transaction costs paid by the broker, e.g. FixedBps(5) + SquareRootImpact()
+    volume_column: str = 'Volume' # traded volumes, needed by the cost models with market impact
+    interval: str = '1d' # bar interval, e.g. '1h' or '5m', intraday bars are downloaded and resampled to it
+    window_bars: Optional[int] = None # information window in bars instead of the period s (s still sets the history loaded)
+    bar_chunk_size: int = 65536 # number of bars processed at once on a bar timeline, bounds the memory used
+    universe_screen: Optional[UniverseScreen] = None # point-in-time screen of the universe at each rebalancing date
+    use_cache: bool = True # return the stored results when the same configuration already ran on the same data
+    cache_dir: str = DEFAULT_CACHE_DIR
+    checkpoint_interval: Optional[int] = None # dates between two checkpoints of a daily run, None to not checkpoint
+    checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR
+    precision: Optional[PrecisionPolicy] = None # e.g. 'float32': data and moments stored in float32, sums in float64
+    memory_budget: Optional[int] = None # bytes (or '2GB'), picks the precision and the chunk sizes that fit in it
     broker: Broker = field(init=False)
     
     def __post_init__(self):
-        self.broker = Broker(cash=self.initial_cash, verbose=self.verbose) # broker starts with the initial cash set when calling backtest
+        self.precision = precision_policy(self.precision)
+        self.broker = Broker(cash=self.initial_cash, verbose=self.verbose, cost_model=self.cost_model) # broker starts with the initial cash set when calling backtest
+        # replaced by the alias of the run identity once the data is loaded
         self.backtest_name = generate_random_name()
-        self.broker.initialize_blockchain(self.name_blockchain)
+        self.run_id = None
+        self.valuation = None # daily value, exposures, cash and drawdown, set by run_backtest
+        self._screen_panel = None # prefix sums of the data for the universe screen, built on first use
+        if self.persist:
+            self.broker.initialize_blockchain(self.name_blockchain)
 
-    def run_backtest(self):
-        logging.info(f"Running backtest from {self.initial_date} to {self.final_date}.")
+    def load_data(self):
+        """Loads the price data of the universe (download or price store), starting s days before the backtest"""
         logging.info(f"Retrieving price data for universe")
-        if self.risk_model is not None:
-            self.risk_model = self.risk_model(threshold=self.risk_threshold)
         # USING actual_start TO DOWNLOAD DATA S-DAYS BEFORE THE BACKTESTING STARTS SO THAT THE FIRST COMPUTED PORTFOLIO IS NOT FULL OF NaNs
         actual_start = self.initial_date - self.s
         # self.initial_date to yyyy-mm-dd format
         init_ = actual_start.strftime('%Y-%m-%d')
         # self.final_date to yyyy-mm-dd format
         final_ = self.final_date.strftime('%Y-%m-%d')
-        df = get_stocks_data(self.universe, init_, final_)
-        # Initialize the DataModule
-        data_module = DataModule(df)
-        # Create the Information object
-        info = self.information_class(s = self.s, 
+        if self.price_store is not None:
+            # only the prices column of the universe over the backtest window is read from disk
+            fields = [self.adj_close_column] + ([self.volume_column] if self.loads_volume else [])
+            data_module = DataModule.from_store(self.price_store, init_, final_, fields=fields, tickers=self.universe)
+            return data_module if self.interval == '1d' else data_module.resample(self.interval, self.time_column, self.company_column)
+        fetched = fetch_interval(self.interval)
+        if fetched == '1d':
+            df = get_stocks_data(self.universe, init_, final_)
+        else:
+            df = get_stocks_data(self.universe, init_, final_, interval=fetched)
+        # Initialize the DataModule, resampled when the interval cannot be downloaded as is
+        data_module = DataModule(df, self.time_column)
+        if fetched != self.interval:
+            data_module = data_module.resample(self.interval, self.time_column, self.company_column)
+        return data_module
+
+    @property
+    def bar_mode(self):
+        # calendar days by default, the bars of the data for intraday intervals or windows in bars
+        return self.interval != '1d' or self.window_bars is not None
+
+    @property
+    def data_columns(self):
+        # the columns of the price data the results depend on
+        columns = [self.time_column, self.company_column, self.adj_close_column]
+        return columns + [self.volume_column] if self.loads_volume else columns
+
+    @property
+    def needs_volume(self):
+        return self.cost_model is not None and self.cost_model.requires_volume
+
+    @property
+    def loads_volume(self):
+        # the volumes are read by the cost model or by the universe screen
+        return self.needs_volume or (self.universe_screen is not None and self.universe_screen.requires_volume)
+
+    def create_information(self, data_module: DataModule):
+        """Creates the Information object of the backtest on top of the data"""
+        return self.information_class(s = self.s, 
                                     data_module = data_module,
                                     time_column=self.time_column,
                                     company_column=self.company_column,
                                     adj_close_column=self.adj_close_column,
+                                    volume_column=self.volume_column,
+                                    window_bars=self.window_bars,
                                     portfolio_strategy=self.portfolio_strategy)
-        # Run the backtest
+
+    def information_key(self, t: datetime):
+        """Key of the information set at t in an information cache: the date, the window and the storage dtype"""
+        precision = self.data_module.precision
+        return pd.Timestamp(t), self.s, 'float64' if precision is None else precision.storage
+
+    def information_at(self, info: Information, t: datetime):
+        """Returns the information set and the prices at t, from the information cache when there is one"""
+        if self.information_cache is None:
+            return info.compute_information(t), info.get_prices(t)
+        key = self.information_key(t)
+        if key not in self.information_cache:
+            self.information_cache[key] = (info.compute_information(t), info.get_prices(t))
+        return self.information_cache[key]
+
+    def information_set_at(self, info: Information, t: datetime):
+        """Returns the information set at t, from the information cache when there is one"""
+        if self.information_cache is None:
+            return info.compute_information(t)
+        return self.information_at(info, t)[0]
+
+    def screen_panel(self, info: Information):
+        """The ScreenPanel of the data, built on first use"""
+        if self._screen_panel is None:
+            self._screen_panel = ScreenPanel.from_data_module(info.data_module, self.time_column, self.company_column,
+                                                              self.adj_close_column, self.volume_column)
+        return self._screen_panel
+
+    def compute_portfolios(self, info: Information, times, information_sets: list):
+        """The portfolios of many dates, on the members of the universe screen at each date when there is one
+
+        The companies screened out of the universe get a weight of zero, so that their positions are sold.
+        """
+        if self.universe_screen is None:
+            return info.compute_portfolios(information_sets)
+        panel = self.screen_panel(info)
+        screened = [restrict_information_set(information_set, self.universe_screen.members(panel, t))
+                    for t, information_set in zip(times, information_sets)]
+        portfolios = info.compute_portfolios(screened)
+        return [{company: portfolio.get(company, 0.0) for company in information_set.get('companies', [])}
+                for information_set, portfolio in zip(information_sets, portfolios)]
+
+    def price_matrix(self, info: Information, dates):
+        """Returns the prices of all the dates as a PriceMatrix, from the information cache when it has them all"""
+        if self.information_cache is not None:
+            keys = [self.information_key(t) for t in dates]
+            if all(key in self.information_cache for key in keys):
+                return PriceMatrix.from_dicts(dates, [self.information_cache[key][1] for key in keys])
+        return info.price_matrix(dates)
+
+    def run_backtest(self):
+        logging.info(f"Running backtest from {self.initial_date} to {self.final_date}.")
+        config = backtest_config(self)
+        if self.data_module is None:
+            self.data_module = self.load_data()
+        if self.memory_budget is not None:
+            self.apply_memory_plan()
+        if self.precision is not None:
+            self.data_module = self.data_module.with_precision(self.precision)
+        # the same configuration on the same data always gets the same identity and the same name
+        self.run_id = run_identity(config, data_fingerprint(self.data_module.data, self.data_columns))
+        self.lineage = lineage_key(config)
+        self.backtest_name = run_name(self.run_id)
+        if self.use_cache and self.persist:
+            cached = RunCache(self.cache_dir).load(self.run_id)
+            if cached is not None:
+                logging.info(f"Run {self.run_id} ({cached.name}) already completed, returning the cached results.")
+                return self.restore(cached)
+        if self.risk_model is not None:
+            self.risk_model = self.risk_model(threshold=self.risk_threshold)
+        # Create the Information object
+        info = self.create_information(self.data_module)
+        # Run the backtest, on calendar days or on the bars of the data
+        run = self.run_bars if self.bar_mode else self.run_days
+        portfolio_values_df, initial_portfolio_comp, final_portfolio_comp = run(info)
+        final_portfolio_value = portfolio_values_df['Portfolio value'].iloc[-1] if len(portfolio_values_df) else self.broker.cash
+        logging.info(f"Backtest completed. Final portfolio value: {final_portfolio_value}")
+        if self.persist:
+            self.store_results(final_portfolio_value)
+            if self.use_cache:
+                self.cache_results(final_portfolio_value, portfolio_values_df, initial_portfolio_comp, final_portfolio_comp)
+        logging.info(final_portfolio_comp)
+        return portfolio_values_df, initial_portfolio_comp, final_portfolio_comp
+
+    def memory_plan(self):
+        """The MemoryPlan of the memory budget for the loaded data"""
+        data = self.data_module.data
+        columns = [column for column in self.data_columns[2:] if column in data.columns]
+        return plan_memory(self.memory_budget, len(data), len(columns), data[self.company_column].nunique(),
+                           len(np.unique(self.data_module.times(self.time_column))), self.precision)
+
+    def apply_memory_plan(self):
+        """Sets the precision and the chunk sizes from the memory budget, a smaller chunk size set by hand is kept"""
+        plan = self.memory_plan()
+        self.precision = plan.precision
+        self.strategy_batch_size = min(self.strategy_batch_size, plan.strategy_batch_size)
+        self.bar_chunk_size = min(self.bar_chunk_size, plan.bar_chunk_size)
+        if not plan.cache_moments and self.information_cache is not None:
+            logging.info("The information sets of every date do not fit in the memory budget, they are not cached")
+            self.information_cache = None
+        return plan
+
+    def apply_risk_model(self, t: datetime, portfolio: dict, prices: dict, broker: Broker = None):
+        broker = self.broker if broker is None else broker
+        if isinstance(self.risk_model, StopLoss):
+            self.risk_model.trigger_stop_loss(t, portfolio, prices, broker)
+        if isinstance(self.risk_model, ProfitTaking):
+            self.risk_model.trigger_profit_taking(t, portfolio, prices, broker)
+
+    def run_days(self, info: Information):
+        """Runs the backtest day by day, returns the portfolio values and the first and last portfolios"""
+
         dates_list = []
         portfolio_values_list = []
         initial_portfolio_comp = None
         final_portfolio_comp = None
-        for t in pd.date_range(start=self.initial_date, end=self.final_date, freq='D'):  
-            information_set = info.compute_information(t)
-            portfolio = info.compute_portfolio(information_set)
-            prices = info.get_prices(t) 
-            if self.risk_model is not None:  
-                # Trigger stop loss
-                if isinstance(self.risk_model, StopLoss):
-                    self.risk_model.trigger_stop_loss(t, portfolio, prices, self.broker)
-                # Trigger profit-taking
-                if isinstance(self.risk_model, ProfitTaking):
-                    self.risk_model.trigger_profit_taking(t, portfolio, prices, self.broker)
-            # now the portfolio will be done on day1 instead of the first rebalancing date        
-            if self.rebalance_flag().time_to_rebalance(t) or t==self.initial_date:
-                logging.info("-----------------------------------")
-                logging.info(f"Rebalancing portfolio at {t}")
-                self.broker.execute_portfolio(portfolio, prices, t)
-            # saving the current portfolio values for charting
-            current_portfolio_value = self.broker.get_portfolio_value(info.get_prices(t))
-            dates_list.append(t)
-            portfolio_values_list.append(current_portfolio_value)
-            # saving the first and last portfolio compositions for charting
-            if initial_portfolio_comp is None and portfolio:
-                initial_portfolio_comp = portfolio.copy()
-            final_portfolio_comp = portfolio.copy()
-        final_portfolio_value = self.broker.get_portfolio_value(info.get_prices(self.final_date))
-        logging.info(f"Backtest completed. Final portfolio value: {final_portfolio_value}")
+        dates = pd.date_range(start=self.initial_date, end=self.final_date, freq='D')
+        # the prices of all the dates at once, the broker only needs them on trading days
+        price_matrix = self.price_matrix(info, dates)
+        first, checkpoint = 0, None
+        if self.checkpoint_interval is not None:
+            # go on from the latest checkpoint of a run with the same history, if there is one
+            checkpoint = self.resume(dates)
+            if checkpoint is not None:
+                first, initial_portfolio_comp, final_portfolio_comp = \
+                    checkpoint.next_index, checkpoint.initial_portfolio, checkpoint.final_portfolio
+        for start in range(first, len(dates), self.strategy_batch_size):
+            chunk = dates[start:start + self.strategy_batch_size]
+            # the portfolios of a chunk of dates are optimized in one go, then traded day by day
+            portfolios = self.compute_portfolios(info, chunk, [self.information_set_at(info, t) for t in chunk])
+            for i, (t, portfolio) in enumerate(zip(chunk, portfolios), start):
+                rebalance = self.rebalance_flag().time_to_rebalance(t) or t==self.initial_date
+                if self.risk_model is not None or rebalance:
+                    prices = price_matrix.prices_at(i)
+                if self.risk_model is not None:  
+                    # Trigger stop loss or profit-taking
+                    self.apply_risk_model(t, portfolio, prices)
+                # now the portfolio will be done on day1 instead of the first rebalancing date        
+                if rebalance:
+                    logging.info("-----------------------------------")
+                    logging.info(f"Rebalancing portfolio at {t}")
+                    # the volumes are only read on rebalancing dates, and only when the cost model uses them
+                    volumes = info.get_volumes(t) if self.needs_volume else None
+                    self.broker.execute_portfolio(portfolio, prices, t, volumes)
+                # streaming the partial results, e.g. to update a chart while the backtest runs
+                if self.progress_callback is not None:
+                    dates_list.append(t)
+                    portfolio_values_list.append(price_matrix.value_at(i, self.broker.cash, self.broker.positions))
+                    if len(dates_list) % self.progress_interval == 0:
+                        self.progress_callback(dates_list, portfolio_values_list)
+                # saving the first and last portfolio compositions for charting
+                if initial_portfolio_comp is None and portfolio:
+                    initial_portfolio_comp = portfolio.copy()
+                final_portfolio_comp = portfolio.copy()
+            end = start + len(chunk)
+            if self.checkpoint_interval is not None and \
+                    (end == len(dates) or end - (checkpoint.next_index if checkpoint else 0) >= self.checkpoint_interval):
+                checkpoint = self.save_checkpoint(dates, end, initial_portfolio_comp, final_portfolio_comp, checkpoint)
+        # the values of all the dates in one pass over the transaction log
+        self.valuation = mark_to_market(self.broker.get_transaction_log(), price_matrix, self.initial_cash)
+        portfolio_values_df = self.valuation.portfolio_values_df
+        if self.progress_callback is not None:
+            self.progress_callback(list(portfolio_values_df['Date']), list(portfolio_values_df['Portfolio value']))
+        return portfolio_values_df, initial_portfolio_comp, final_portfolio_comp
+
+    def save_checkpoint(self, dates, next_index: int, initial_portfolio: dict, final_portfolio: dict,
+                        previous: Optional[Checkpoint] = None):
+        """Checkpoints the broker after the first next_index dates, see checkpoint.CheckpointStore"""
+        date = dates[next_index - 1]
+        positions = list(self.broker.positions.values())
+        log = self.broker.get_transaction_log()
+        checkpoint = Checkpoint(key=self.lineage, date=date, next_index=next_index, cash=self.broker.cash,
+                                tickers=np.array([p.ticker for p in positions]),
+                                quantities=np.array([p.quantity for p in positions], dtype=np.int64),
+                                entry_prices=np.array([p.entry_price for p in positions], dtype=float),
+                                last_entry_prices=dict(self.broker.entry_prices), ledger_rows=0, ledger_offset=0,
+                                data_fingerprint=self.history_fingerprint(date),
+                                initial_portfolio=initial_portfolio, final_portfolio=final_portfolio,
+                                last_trade=pd.Timestamp(log['Date'].iloc[-1]) if len(log) else None)
+        logging.info(f"Checkpoint of {self.backtest_name} at {date}")
+        return CheckpointStore(self.checkpoint_dir).save(checkpoint, log, previous)
+
+    def history_fingerprint(self, date):
+        # the data a run has seen up to date included
+        times = self.data_module.times()
+        end = np.searchsorted(times, self.data_module.to_ns(pd.Timestamp(date) + pd.Timedelta(days=1)), side='left')
+        return data_fingerprint(self.data_module.data.iloc[:end], self.data_columns)
+
+    def resume(self, dates):
+        """Restores the broker from the latest checkpoint of the lineage, None if it cannot be used
+
+        A checkpoint is used when it is within the dates of this run and the data up to its date is the
+        same, so a run resumed or extended from it gives the results of a run from scratch.
+        """
+        loaded = CheckpointStore(self.checkpoint_dir).load(self.lineage)
+        if loaded is None:
+            return None
+        checkpoint, frames = loaded
+        if checkpoint.next_index > len(dates) or dates[checkpoint.next_index - 1] != checkpoint.date:
+            return None
+        if checkpoint.data_fingerprint != self.history_fingerprint(checkpoint.date):
+            logging.warning(f"The data changed before the checkpoint of {checkpoint.date}, running from the start")
+            return None
+        self.broker.cash = checkpoint.cash
+        self.broker.positions = {ticker: Position(ticker, int(quantity), float(price))
+                                 for ticker, quantity, price in zip(checkpoint.tickers, checkpoint.quantities, checkpoint.entry_prices)}
+        self.broker.entry_prices = dict(checkpoint.last_entry_prices)
+        self.broker.transaction_log = pd.concat([self.broker.transaction_log] + frames, ignore_index=True) if frames \
+            else self.broker.transaction_log
+        logging.info(f"Resuming {self.backtest_name} after {checkpoint.date} ({checkpoint.next_index} of {len(dates)} dates)")
+        return checkpoint
+
+    def extend(self, final_date: datetime, data_module: Optional[DataModule] = None):
+        """Extends a completed run to a later final date, only the new dates are simulated
+
+        Args:
+            final_date (datetime): The new final date
+            data_module (DataModule): The data with the new dates, downloaded again if None
+
+        Example:
+            backtest = Backtest(datetime(2019, 1, 1), datetime(2020, 1, 1), checkpoint_interval=20)
+            backtest.run_backtest()
+            backtest.extend(datetime(2020, 2, 1))
+        """
+        if self.checkpoint_interval is None:
+            raise ValueError("Only a run with checkpoints can be extended, set checkpoint_interval")
+        self.final_date = final_date
+        self.data_module = data_module
+        self._screen_panel = None
+        broker = Broker(cash=self.initial_cash, verbose=self.verbose, cost_model=self.cost_model)
+        if self.persist:
+            broker.blockchain = self.broker.blockchain
+        self.broker = broker
+        if isinstance(self.risk_model, RiskModel):
+            # run_backtest instantiates the risk model class again
+            self.risk_model = type(self.risk_model)
+        return self.run_backtest()
+
+    def run_bars(self, info: Information):
+        """Runs the backtest on the bars of the data (e.g. minute bars) instead of calendar days
+
+        Only the rebalancing bars compute an information set and trade, every bar when there is a risk
+        model. The portfolio is valued chunk by chunk from the transaction log, so that the memory used
+        does not grow with the number of bars beyond the data and the value series.
+        """
+        panel = info.bar_panel()
+        start, stop = panel.range(self.initial_date, self.final_date)
+        times = pd.DatetimeIndex(panel.times[start:stop])
+        rebalance = self.rebalance_flag().rebalance_mask(times)
+        if len(rebalance):
+            # the portfolio is done on the first bar, like on day 1 of run_days
+            rebalance[0] = True
+        values = np.empty(stop - start)
+        valuer = BarValuer(panel, self.initial_cash)
+        initial_portfolio_comp = None
+        final_portfolio_comp = None
+        portfolio = {}
+        for chunk_start in range(start, stop, self.bar_chunk_size):
+            chunk_stop = min(chunk_start + self.bar_chunk_size, stop)
+            bars = np.flatnonzero(rebalance[chunk_start - start:chunk_stop - start]) + chunk_start
+            information_sets = [info.compute_information_at_bar(i) for i in bars]
+            portfolios = dict(zip(bars.tolist(), self.compute_portfolios(info, times[bars - start], information_sets)))
+            for i in (range(chunk_start, chunk_stop) if self.risk_model is not None else bars.tolist()):
+                t = times[i - start]
+                if self.risk_model is not None:
+                    self.apply_risk_model(t, portfolio, panel.held_prices(i, self.broker.positions))
+                if i in portfolios:
+                    portfolio = portfolios[i]
+                    logging.info("-----------------------------------")
+                    logging.info(f"Rebalancing portfolio at {t}")
+                    volumes = info.get_volumes(t) if self.needs_volume else None
+                    self.broker.execute_portfolio(portfolio, panel.prices_at(i), t, volumes)
+                    if initial_portfolio_comp is None and portfolio:
+                        initial_portfolio_comp = portfolio.copy()
+                    final_portfolio_comp = portfolio.copy()
+            values[chunk_start - start:chunk_stop - start] = valuer.values(self.broker.get_transaction_log(), chunk_start, chunk_stop)
+            if self.progress_callback is not None:
+                self.progress_callback(list(times[:chunk_stop - start]), list(values[:chunk_stop - start]))
+        # exposures, cash and drawdown on the last bar of each day
+        days = times.normalize()
+        last_bars = np.flatnonzero(np.r_[days[1:] != days[:-1], True]) + start if len(times) else np.array([], dtype=int)
+        self.valuation = mark_to_market(self.broker.get_transaction_log(), panel.price_matrix(last_bars), self.initial_cash)
+        return pd.DataFrame({"Date": times, "Portfolio value": values}), initial_portfolio_comp, final_portfolio_comp
+
+    def performance(self, risk_free_rate: float = 0.0):
+        """The performance metrics of the completed backtest, see analytics.compute_metrics
+
+        Example:
+            backtest.run_backtest()
+            backtest.performance()[['sharpe', 'max_drawdown', 'turnover']]
+        """
+        return RunPanel.from_backtest(self).metrics(risk_free_rate).iloc[0]
+
+    def cache_results(self, final_value: float, portfolio_values_df: pd.DataFrame, initial_portfolio: dict, final_portfolio: dict):
+        """Saves the outcome of the run under its identity, so that running it again returns immediately"""
+        broker_state = {'cash': self.broker.cash, 'positions': self.broker.positions,
+                        'entry_prices': self.broker.entry_prices, 'transaction_log': self.broker.transaction_log}
+        return RunCache(self.cache_dir).save(CachedRun(self.run_id, self.backtest_name, final_value, portfolio_values_df,
+                                                       initial_portfolio, final_portfolio, broker_state))
+
+    def restore(self, cached: CachedRun):
+        """Puts the broker in its state at the end of a cached run and returns the results of run_backtest"""
+        for key, value in cached.broker_state.items():
+            setattr(self.broker, key, value)
+        self.backtest_name = cached.name
+        dates = pd.DatetimeIndex(cached.portfolio_values['Date'])
+        self.valuation = mark_to_market(self.broker.get_transaction_log(),
+                                        self.price_matrix(self.create_information(self.data_module), dates), self.initial_cash)
+        if self.progress_callback is not None:
+            self.progress_callback(list(cached.portfolio_values['Date']), list(cached.portfolio_values['Portfolio value']))
+        return cached.portfolio_values, cached.initial_portfolio, cached.final_portfolio
+
+    def store_results(self, final_portfolio_value: float, once: bool = False):
+        """Saves the transaction log, adds it to the blockchain and indexes the run in the registry
+
+        With once, the block is not added again if the chain already holds it, so that a commit can be retried.
+        """
         df = self.broker.get_transaction_log()
         # create backtests folder if it does not exist
         if not os.path.exists('backtests'):
-            os.makedirs('backtests')
-        # save to csv, use the backtest name 
-        df.to_csv(f"backtests/{self.backtest_name}.csv")
-        # store the backtest in the blockchain
-        self.broker.blockchain.add_block(self.backtest_name, df.to_string())
-        portfolio_values_df = pd.DataFrame({"Date":dates_list, "Portfolio value":portfolio_values_list})
-        logging.info(portfolio)
-        return portfolio_values_df, initial_portfolio_comp, final_portfolio_comp
\ No newline at end of file
+            os.makedirs('backtests', exist_ok=True)
+        # save the transaction log (csv by default), use the backtest name 
+        file = get_results_writer(self.results_format).write(df, self.backtest_name, 'backtests')
+        # store the backtest in the blockchain, the block keeps the Merkle root of the trades and the log goes to a blob
+        add_block = self.broker.blockchain.add_block_once if once else self.broker.blockchain.add_block
+        block = add_block(self.backtest_name, results_payload(df))
+        # index the run so that it can be found without reading the csv files or the blockchain
+        if self.registry_path is not None:
+            BacktestRegistry(self.registry_path).register_backtest(self, final_value=final_portfolio_value, file=file,
+                                                                   block_hash=block.hash)
+        return block
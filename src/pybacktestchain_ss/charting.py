@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _to_float(x):
+    """Converts dates (or any numeric sequence) to a float array usable for geometry"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(float)
+    if x.dtype == object:
+        return pd.to_datetime(x).to_numpy().astype('datetime64[ns]').astype(np.int64).astype(float)
+    return x.astype(float)
+
+def lttb_indices(x, y, n_out: int):
+    """lttb_indices selects the points to keep with the Largest-Triangle-Three-Buckets method
+
+    Args:
+        x (array-like): The x values (numbers or dates), sorted
+        y (array-like): The y values
+        n_out (int): Number of points to keep (first and last point are always kept)
+
+    Returns:
+        np.ndarray: Sorted indices of the points to keep
+
+    Example:
+        idx = lttb_indices(df['Date'], df['Portfolio value'], 500)
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _to_float(x)
+    y = np.asarray(y, dtype=float)
+
+    # the first and last points are fixed, the rest is split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point for the final bucket)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # pick the point of the current bucket forming the largest triangle
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                       - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+def minmax_indices(y, n_buckets: int):
+    """minmax_indices keeps the minimum and maximum of each bucket, which preserves peaks and drawdowns
+
+    Args:
+        y (array-like): The y values
+        n_buckets (int): Number of buckets, at most 2 * n_buckets + 2 points are kept
+
+    Returns:
+        np.ndarray: Sorted indices of the points to keep
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if 2 * n_buckets + 2 >= n or n_buckets < 1:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    # pad the series so that every bucket has the same length and reduce them at once
+    size = int(np.max(np.diff(edges)))
+    padded = np.full((n_buckets, size), np.nan)
+    offsets = np.arange(size)
+    positions = edges[:-1, None] + offsets
+    valid = positions < edges[1:, None]
+    padded[valid] = y[positions[valid]]
+    lows = edges[:-1] + np.nanargmin(padded, axis=1)
+    highs = edges[:-1] + np.nanargmax(padded, axis=1)
+    return np.unique(np.concatenate([[0, n - 1], lows, highs]))
+
+def downsample(df: pd.DataFrame, max_points: int = 1000, x_column: str = 'Date',
+               y_column: str = 'Portfolio value', method: str = 'lttb'):
+    """downsample reduces a time series to at most max_points rows while preserving its shape
+
+    Args:
+        df (pd.DataFrame): The series to downsample, sorted by x_column
+        max_points (int): Maximum number of rows to return
+        x_column (str): The x axis column
+        y_column (str): The y axis column
+        method (str): 'lttb' or 'minmax'
+
+    Returns:
+        pd.DataFrame: The downsampled rows of df
+
+    Example:
+        small = downsample(portfolio_values_df, max_points=500)
+    """
+    if len(df) <= max_points:
+        return df
+    if method == 'lttb':
+        idx = lttb_indices(df[x_column].to_numpy(), df[y_column].to_numpy(), max_points)
+    elif method == 'minmax':
+        idx = minmax_indices(df[y_column].to_numpy(), max(1, (max_points - 2) // 2))
+    else:
+        raise ValueError(f"Unknown downsampling method {method}")
+    return df.iloc[idx]
+
+def top_weights(portfolio: dict, max_slices: int = 10, other_label: str = 'Other'):
+    """top_weights keeps the largest weights of a portfolio and groups the rest, to keep pie charts readable"""
+    items = sorted(((k, v) for k, v in portfolio.items() if v), key=lambda kv: abs(kv[1]), reverse=True)
+    if len(items) <= max_slices:
+        return dict(items)
+    kept = dict(items[:max_slices - 1])
+    kept[other_label] = sum(v for _, v in items[max_slices - 1:])
+    return kept
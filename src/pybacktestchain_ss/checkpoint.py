@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.blockchain import _write_atomic
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+DEFAULT_CHECKPOINT_DIR = 'backtests/checkpoints'
+
+# fields of the configuration a checkpoint can be reused across: a later final date extends the run
+EXTENSIBLE_FIELDS = {'final_date'}
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def lineage_key(config: dict):
+    """lineage_key identifies the runs that share their history: the same configuration but the final date
+
+    Example:
+        key = lineage_key(backtest_config(backtest))
+    """
+    lineage = {key: value for key, value in config.items() if key not in EXTENSIBLE_FIELDS}
+    payload = json.dumps(lineage, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class Checkpoint:
+    """ The state of a daily backtest after its first next_index dates, enough to go on from there
+
+    The information sets are recomputed from the data at each date, so the broker, the ledger and the
+    portfolios are the whole state. The data seen so far is fingerprinted, a checkpoint is only reused
+    on the same history.
+    """
+    key: str
+    date: pd.Timestamp # last simulated date
+    next_index: int # index of the next date to simulate, from the initial date
+    cash: float
+    tickers: np.ndarray
+    quantities: np.ndarray
+    entry_prices: np.ndarray # average entry price of each position
+    last_entry_prices: dict # price of the last buy of each ticker (Broker.entry_prices)
+    ledger_rows: int
+    ledger_offset: int # bytes of the ledger file holding the ledger_rows first transactions
+    data_fingerprint: str
+    initial_portfolio: Optional[dict] = None
+    final_portfolio: Optional[dict] = None
+    last_trade: Optional[pd.Timestamp] = None
+
+@dataclass
+class CheckpointStore:
+    """ Latest checkpoint of each lineage in backtests/checkpoints, next to an append-only ledger
+
+    The transaction log is not rewritten at each checkpoint: only the new transactions are appended to
+    the ledger file, and the checkpoint keeps the byte offset of the ledger it is consistent with. The
+    checkpoint itself is written atomically after the ledger, so a crash at any point leaves the last
+    checkpoint and its ledger prefix intact.
+    """
+    directory: str = DEFAULT_CHECKPOINT_DIR
+
+    def path(self, key: str):
+        return os.path.join(self.directory, f"{key}.ckpt")
+
+    def ledger_path(self, key: str):
+        return os.path.join(self.directory, f"{key}.ledger")
+
+    def save(self, checkpoint: Checkpoint, transaction_log: pd.DataFrame, previous: Optional[Checkpoint] = None):
+        """Appends the transactions made since the previous checkpoint to the ledger and writes checkpoint"""
+        os.makedirs(self.directory, exist_ok=True)
+        ledger_rows, offset = (previous.ledger_rows, previous.ledger_offset) if previous is not None else (0, 0)
+        with open(self.ledger_path(checkpoint.key), 'ab') as f:
+            # drop whatever a crashed run appended after the previous checkpoint
+            f.truncate(offset)
+            if len(transaction_log) > ledger_rows:
+                pickle.dump(transaction_log.iloc[ledger_rows:], f)
+            f.flush()
+            os.fsync(f.fileno())
+            checkpoint.ledger_offset = f.tell()
+        checkpoint.ledger_rows = len(transaction_log)
+        _write_atomic(checkpoint, self.path(checkpoint.key))
+        return checkpoint
+
+    def load(self, key: str):
+        """Returns the latest Checkpoint of a lineage and the frames of its ledger, None if there is none"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                checkpoint = pickle.load(f)
+            frames = []
+            with open(self.ledger_path(key), 'rb') as f:
+                while f.tell() < checkpoint.ledger_offset:
+                    frames.append(pickle.load(f))
+        except Exception as e:
+            logging.warning(f"Could not read the checkpoint {key}: {e}")
+            return None
+        return checkpoint, frames
+
+    def remove(self, key: str):
+        for path in (self.path(key), self.ledger_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,250 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import tomllib
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.analytics import RunPanel
+from pybacktestchain_ss.data_module import DataModule, get_stocks_data
+from pybacktestchain_ss.service import backtest_from_request
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+# top-level keys of a batch file
+CONFIG_KEYS = {'defaults', 'backtests', 'data', 'persist'}
+
+# keys of the data section: where the prices of all the backtests are loaded from, once
+DATA_KEYS = {'price_store', 'file'}
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _require_yaml():
+    """Imports PyYAML, which is only needed for the YAML batch files"""
+    try:
+        return importlib.import_module('yaml')
+    except ImportError as e:
+        raise ImportError("YAML batch files require PyYAML, install it with `pip install pyyaml`") from e
+
+def load_config(path: str):
+    """load_config reads a batch file, in JSON, TOML or YAML depending on its extension
+
+    Example:
+        config = load_config('nightly.toml')
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path) as f:
+            config = json.load(f)
+    elif extension == '.toml':
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    elif extension in ('.yaml', '.yml'):
+        with open(path) as f:
+            config = _require_yaml().safe_load(f)
+    else:
+        raise ValueError(f"Unknown batch file format {extension}, use .json, .toml or .yaml")
+    unknown = set(config) - CONFIG_KEYS
+    if unknown:
+        raise ValueError(f"Unknown keys in {path}: {sorted(unknown)}")
+    unknown = set(config.get('data', {})) - DATA_KEYS
+    if unknown:
+        raise ValueError(f"Unknown data keys in {path}: {sorted(unknown)}")
+    return config
+
+def expand_config(config: dict):
+    """expand_config returns the (label, request) of each backtest of a batch, the defaults filled in
+
+    Each backtest is a service request (see service.REQUEST_FIELDS), plus an optional label naming it
+    in the output.
+    """
+    defaults = config.get('defaults', {})
+    requests = []
+    for i, backtest in enumerate(config.get('backtests', [])):
+        request = {**defaults, **backtest}
+        requests.append((str(request.pop('label', i)), request))
+    return requests
+
+def read_prices(path: str, time_column: str = 'Date'):
+    """Reads long-format price data (one row per date and ticker) from a csv or parquet file"""
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    df[time_column] = pd.to_datetime(df[time_column])
+    return df
+
+def _json_value(value):
+    if isinstance(value, (np.floating, float)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class BatchRunner:
+    """ Runs many backtests in one process, loading their prices once
+
+    All the backtests are built (and their configuration checked) before any runs. The prices of the
+    union of their universes over the union of their windows are then loaded once, from a price store,
+    a file or the download. Each backtest runs on its own window of them, the data an interactive run would
+    load, and each universe gets one information cache per precision shared by all its backtests, so that
+    a moment computed for one strategy is reused by the others.
+
+    Args:
+        requests (list): (label, request) of each backtest, see expand_config
+        data (dict): {'price_store': path} or {'file': path}, the prices are downloaded if empty
+        persist (bool): Store the results like an interactive run (files, blockchain and registry)
+
+    Example:
+        records = BatchRunner(expand_config(load_config('nightly.yaml'))).run()
+    """
+    requests: list
+    data: dict = field(default_factory=dict)
+    persist: bool = True
+
+    def __post_init__(self):
+        self.backtests = [(label, backtest_from_request(request, verbose=False, persist=self.persist))
+                          for label, request in self.requests]
+        self._data = None
+        self._precision = None # precision policy of the loaded prices, mixed for a float32 price store
+        self._universes = {} # (universe, columns) -> DataModule of the prices of the universe
+        self._modules = {} # (universe, columns, window, precision) -> DataModule
+        self._caches = {} # (universe, columns, information class, storage dtype) -> information cache
+
+    def load_data(self):
+        """The prices of all the backtests, loaded on first use"""
+        if self._data is None:
+            tickers = list(dict.fromkeys(ticker for _, backtest in self.backtests for ticker in backtest.universe))
+            start = min(backtest.initial_date - backtest.s for _, backtest in self.backtests).strftime('%Y-%m-%d')
+            end = max(backtest.final_date for _, backtest in self.backtests).strftime('%Y-%m-%d')
+            logging.info(f"Loading the prices of {len(tickers)} tickers from {start} to {end}")
+            if self.data.get('price_store') is not None:
+                data_module = DataModule.from_store(self.data['price_store'], start, end, tickers=tickers)
+                self._data, self._precision = data_module.data, data_module.precision
+            elif self.data.get('file') is not None:
+                self._data = read_prices(self.data['file'])
+            else:
+                self._data = get_stocks_data(tickers, start, end)
+        return self._data
+
+    def data_module(self, backtest):
+        """The DataModule of a backtest: its window of the shared prices of its universe, with its precision
+
+        The window is the one an interactive run loads, [initial_date - s, final_date), with the rows of a
+        date in the order of the universe, so that the run gets the same data fingerprint and run_id as
+        alone, whatever the other backtests of the batch.
+        """
+        columns = (backtest.time_column, backtest.company_column, backtest.adj_close_column)
+        universe = tuple(backtest.universe)
+        if (universe, columns) not in self._universes:
+            data = self.load_data()
+            data = data[data[backtest.company_column].isin(universe)]
+            if data.empty:
+                raise ValueError(f"No prices for the universe {list(universe)}")
+            # parsed and sorted once, then sliced for each window
+            self._universes[(universe, columns)] = DataModule(data, backtest.time_column, self._precision)
+        window = ((backtest.initial_date - backtest.s).strftime('%Y-%m-%d'), backtest.final_date.strftime('%Y-%m-%d'))
+        key = (universe, columns, window, backtest.precision)
+        if key not in self._modules:
+            # converted once, then shared by all the backtests of that window and precision
+            base = self._universes[(universe, columns)]
+            data = base.between(base.to_ns(window[0]), base.to_ns(window[1]))
+            position = {ticker: i for i, ticker in enumerate(universe)}
+            order = np.argsort(data[backtest.company_column].map(position).to_numpy(), kind='stable')
+            data = data.iloc[order].reset_index(drop=True)
+            self._modules[key] = DataModule(data, backtest.time_column, backtest.precision or base.precision)
+        return self._modules[key]
+
+    def prepare(self, backtest):
+        """Gives a backtest the shared DataModule and information cache of its universe and precision"""
+        backtest.data_module = self.data_module(backtest)
+        cache_moments = True
+        if backtest.memory_budget is not None:
+            # the budget picks the precision, whose DataModule is then shared like an explicit one
+            cache_moments = backtest.apply_memory_plan().cache_moments
+            backtest.data_module = self.data_module(backtest)
+        if cache_moments:
+            precision = backtest.data_module.precision
+            key = (tuple(backtest.universe), backtest.time_column, backtest.company_column, backtest.adj_close_column,
+                   backtest.information_class, 'float64' if precision is None else precision.storage)
+            backtest.information_cache = self._caches.setdefault(key, {})
+        return backtest
+
+    def run_one(self, label: str, backtest):
+        """Runs a backtest, returns its record: identity, final value and performance metrics, or the error"""
+        record = {'label': label, 'status': 'done'}
+        start = time.perf_counter()
+        try:
+            values, _, _ = self.prepare(backtest).run_backtest()
+            record.update(name=backtest.backtest_name, run_id=backtest.run_id,
+                          final_value=float(values['Portfolio value'].iloc[-1]) if len(values) else None)
+            metrics = RunPanel.from_backtest(backtest).metrics().iloc[0]
+            record.update({metric: _json_value(value) for metric, value in metrics.items()})
+        except Exception as e:
+            logging.error(f"Backtest {label} failed: {e!r}")
+            record.update(status='failed', error=repr(e))
+        record['seconds'] = time.perf_counter() - start
+        return record
+
+    def run(self, callback: Optional[Callable] = None):
+        """Runs all the backtests in order, calling callback with each record as soon as it is ready"""
+        records = []
+        for label, backtest in self.backtests:
+            records.append(self.run_one(label, backtest))
+            if callback is not None:
+                callback(records[-1])
+        return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pybacktestchain-batch',
+                                     description='Run the backtests of batch files (JSON, TOML or YAML) in one process')
+    parser.add_argument('configs', nargs='+', help='Batch files, run one after the other')
+    parser.add_argument('-o', '--output', help='Write the records to this file (.jsonl or .csv) instead of stdout')
+    parser.add_argument('--no-persist', action='store_true', help='Do not store the results of the runs')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log the progress of the runs')
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    runners = []
+    for path in args.configs:
+        config = load_config(path)
+        runners.append(BatchRunner(expand_config(config), config.get('data', {}),
+                                   config.get('persist', True) and not args.no_persist))
+    csv = args.output is not None and args.output.endswith('.csv')
+    out = sys.stdout if args.output is None or csv else open(args.output, 'w')
+    records = []
+    def emit(record):
+        # one JSON line per backtest as soon as it is done, so that a pipeline can follow a long batch
+        records.append(record)
+        if not csv:
+            out.write(json.dumps(record, default=str) + '\n')
+            out.flush()
+    try:
+        for runner in runners:
+            runner.run(emit)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if csv:
+        pd.DataFrame(records).to_csv(args.output, index=False)
+    return int(any(record['status'] == 'failed' for record in records))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,18 @@
 #%%
 import yfinance as yf
+import numpy as np
 import pandas as pd 
 from sec_cik_mapper import StockMapper
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 import logging 
-from typing import Callable
-from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy
+from typing import Callable, Optional
+import warnings
+from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy, compute_weight_schedule
+from pybacktestchain_ss.precision import MIXED_PRECISION, PrecisionPolicy, precision_policy
+from pybacktestchain_ss.price_store import PriceStore
+from pybacktestchain_ss.valuation import PriceMatrix
+from pybacktestchain_ss.bars import BarPanel, resample_bars
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -22,13 +28,14 @@ UNIVERSE_SEC = list(StockMapper().ticker_to_cik.keys())
 #---------------------------------------------------------
 
 # function that retrieves historical data on prices for a given stock
-def get_stock_data(ticker, start_date, end_date):
+def get_stock_data(ticker, start_date, end_date, interval='1d'):
     """get_stock_data retrieves historical data on prices for a given stock
 
     Args:
         ticker (str): The stock ticker
         start_date (str): Start date in the format 'YYYY-MM-DD'
         end_date (str): End date in the format 'YYYY-MM-DD'
+        interval (str): Bar interval supported by yfinance, e.g. '1d', '1h' or '1m'
 
     Returns:
         pd.DataFrame: A pandas dataframe with the historical data
@@ -37,20 +44,22 @@ def get_stock_data(ticker, start_date, end_date):
         df = get_stock_data('AAPL', '2000-01-01', '2020-12-31')
     """
     stock = yf.Ticker(ticker)
-    data = stock.history(start=start_date, end=end_date, auto_adjust=False, actions=False)
+    data = stock.history(start=start_date, end=end_date, interval=interval, auto_adjust=False, actions=False)
     # as dataframe 
     df = pd.DataFrame(data)
     df['ticker'] = ticker
     df.reset_index(inplace=True)
-    return df
+    # intraday bars come with a 'Datetime' column, the rest of the package expects 'Date'
+    return df.rename(columns={'Datetime': 'Date'})
 
-def get_stocks_data(tickers, start_date, end_date):
+def get_stocks_data(tickers, start_date, end_date, interval='1d'):
     """get_stocks_data retrieves historical data on prices for a list of stocks
 
     Args:
         tickers (list): List of stock tickers
         start_date (str): Start date in the format 'YYYY-MM-DD'
         end_date (str): End date in the format 'YYYY-MM-DD'
+        interval (str): Bar interval supported by yfinance, e.g. '1d', '1h' or '1m'
 
     Returns:
         pd.DataFrame: A pandas dataframe with the historical data
@@ -63,7 +72,7 @@ def get_stocks_data(tickers, start_date, end_date):
     dfs = []
     for ticker in tickers:
         try:
-            df = get_stock_data(ticker, start_date, end_date)
+            df = get_stock_data(ticker, start_date, end_date, interval)
             # append if not empty
             if not df.empty:
                 dfs.append(df)
@@ -73,6 +82,17 @@ def get_stocks_data(tickers, start_date, end_date):
     data = pd.concat(dfs)
     return data
 
+def _read_only(values: pd.Series, precision: PrecisionPolicy = None):
+    # numeric columns are backed by a read-only copy, the others are kept as they are
+    if not (isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf'):
+        return values
+    array = values.to_numpy().copy()
+    if precision is not None and array.dtype.kind == 'f':
+        # floats are stored in the dtype of the precision policy
+        array = precision.store(array)
+    array.setflags(write=False)
+    return array
+
 #---------------------------------------------------------
 # Classes 
 #---------------------------------------------------------
@@ -80,7 +100,114 @@ def get_stocks_data(tickers, start_date, end_date):
 # Class that represents the data used in the backtest. 
 @dataclass
 class DataModule:
+    """ The price data of a backtest, normalized once when it is built and read-only afterwards
+
+    The timestamps are converted once to UTC nanoseconds and the rows sorted by time, so that a window
+    of the data is a binary search. A naive date, of the data or of a query, is a wall-clock time in the
+    timezone of the data. The numeric columns are read-only, so that one DataModule can be shared by
+    concurrent backtests. With a precision policy, the float columns and the bar panels are stored in
+    its storage dtype (e.g. float32).
+    """
     data: pd.DataFrame
+    time_column: str = 'Date'
+    precision: Optional[PrecisionPolicy] = None
+    tz: object = field(default=None, init=False) # timezone of the data, None for naive dates
+    _panels: dict = field(default_factory=dict, init=False, repr=False)
+    _times: dict = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.precision = precision_policy(self.precision)
+        data = self.data
+        if self.time_column in data.columns:
+            times = pd.to_datetime(data[self.time_column])
+            self.tz = times.dt.tz
+            keys = self._utc_ns(times)
+            order = np.argsort(keys, kind='stable')
+            data = data.assign(**{self.time_column: times}).iloc[order].reset_index(drop=True)
+            self._times[self.time_column] = keys[order]
+        self.data = pd.DataFrame({column: _read_only(data[column], self.precision) for column in data.columns},
+                                 index=data.index, copy=False)
+
+    def with_precision(self, precision):
+        """The same data stored with another precision policy, self if it already has it"""
+        precision = precision_policy(precision)
+        if precision == self.precision:
+            return self
+        return DataModule(self.data, self.time_column, precision)
+
+    def memory_usage(self):
+        """Bytes of the numeric columns and of the bar panels built so far"""
+        columns = sum(self.data[column].to_numpy().nbytes for column in self.data.columns
+                      if self.data[column].dtype.kind in 'biuf')
+        return columns + sum(panel.values.nbytes for panel in self._panels.values())
+
+    def _utc_ns(self, times):
+        # UTC nanoseconds of timestamps, naive ones being in the timezone of the data
+        times = pd.DatetimeIndex(pd.to_datetime(times))
+        if times.tz is None and self.tz is not None:
+            times = times.tz_localize(self.tz, ambiguous='NaT', nonexistent='NaT')
+        if times.tz is not None:
+            times = times.tz_convert('UTC').tz_localize(None)
+        return times.as_unit('ns').asi8
+
+    def to_ns(self, t):
+        """UTC nanoseconds of a query date, compared with the timestamps of the data
+
+        A naive t is a wall-clock time in the timezone of the data. An aware t is compared with naive
+        data by its wall-clock time, as the data has no timezone to convert it to.
+        """
+        t = pd.Timestamp(t)
+        if t.tzinfo is None:
+            if self.tz is None:
+                return t.as_unit('ns').value
+            t = t.tz_localize(self.tz, ambiguous=True, nonexistent='shift_forward')
+        elif self.tz is None:
+            return t.tz_localize(None).as_unit('ns').value
+        return t.as_unit('ns').value
+
+    def times(self, time_column: str = None):
+        """The timestamps of a column in UTC nanoseconds (int64), in the order of the rows"""
+        time_column = time_column or self.time_column
+        if time_column not in self._times:
+            self._times[time_column] = self._utc_ns(self.data[time_column])
+        return self._times[time_column]
+
+    def between(self, start: int, end: int, time_column: str = None):
+        """The rows with start <= time < end, the bounds in UTC nanoseconds (see to_ns)
+
+        The rows are sorted by time, so the window is found with a binary search on the time column
+        of the module. The window is a copy, the caller can add columns to it.
+        """
+        time_column = time_column or self.time_column
+        times = self.times(time_column)
+        if time_column == self.time_column:
+            lo, hi = np.searchsorted(times, [start, end], side='left')
+            return self.data.iloc[lo:hi].copy()
+        return self.data[(times >= start) & (times < end)]
+
+    def bar_panel(self, time_column: str = 'Date', company_column: str = 'ticker', value_column: str = 'Adj Close'):
+        """Returns the BarPanel of a column (built once, then shared by every Information on this data)"""
+        key = (time_column, company_column, value_column)
+        if key not in self._panels:
+            dtype = np.float64 if self.precision is None else self.precision.storage
+            self._panels[key] = BarPanel.from_data(self.data, time_column, company_column, value_column, dtype)
+        return self._panels[key]
+
+    def resample(self, interval: str, time_column: str = 'Date', company_column: str = 'ticker'):
+        """Returns a DataModule with the bars aggregated to a coarser interval, e.g. '15m' from minute bars"""
+        return DataModule(resample_bars(self.data, interval, time_column, company_column), time_column, self.precision)
+
+    @classmethod
+    def from_store(cls, path: str, start=None, end=None, fields: list = None, tickers: list = None,
+                   strict: bool = False):
+        """Creates a DataModule from an on-disk PriceStore, reading only the given fields, tickers and dates
+
+        The tickers missing from the store are logged and skipped, as by get_stocks_data, unless strict.
+        The prices of a float32 store get the mixed precision policy: the sums over them are taken in float64.
+        """
+        store = PriceStore(path)
+        precision = MIXED_PRECISION if np.dtype(store.meta['dtype']) == np.float32 else None
+        return cls(store.window(start, end, fields, tickers, strict), store.meta['time_column'], precision)
 
 # Interface for the information set 
 @dataclass
@@ -90,24 +217,48 @@ class Information:
     time_column: str = 'Date'
     company_column: str = 'ticker'
     adj_close_column: str = 'Close'
+    volume_column: str = 'Volume'
     portfolio_strategy: Callable = None
+    window_bars: Optional[int] = None # if set, the window is the last window_bars bars instead of the period s
 
     def slice_data(self, t : datetime):
+        # the data between t-s and t, t is converted once and the window found by binary search
+        end = self.data_module.to_ns(t)
+        if self.window_bars is not None:
+            # the window starts window_bars bars before t, whatever the time between the bars
+            panel = self.bar_panel()
+            start = self.data_module.to_ns(pd.Timestamp(panel.times[self.bar_window_start(panel.index(t))]))
+        else:
+            start = end - pd.Timedelta(self.s).value
+        return self.data_module.between(start, end, self.time_column)
 
-        # Get the data module 
-        data = self.data_module.data
+    def accumulate(self, values):
+        # a window of stored values in the compute dtype of the precision policy, for the sums over it
+        precision = self.data_module.precision
+        return values if precision is None else precision.accumulate(values)
 
-        # Convert both `t` and the data column to timezone-aware, if needed
-        if t.tzinfo is not None:
-            # If `t` is timezone-aware, make sure data is also timezone-aware
-            data[self.time_column] = pd.to_datetime(data[self.time_column]).dt.tz_localize(t.tzinfo.zone, ambiguous='NaT', nonexistent='NaT')
-        else:
-            # If `t` is timezone-naive, ensure the data is timezone-naive as well
-            data[self.time_column] = pd.to_datetime(data[self.time_column]).dt.tz_localize(None)
-        
-        # Get the data only between t-s and t
-        data = data[(data[self.time_column] >= t - self.s) & (data[self.time_column] < t)]
-        return data
+    def store_information(self, information_set: dict):
+        # the moments of an information set are kept in the storage dtype, like the data they come from
+        precision = self.data_module.precision
+        if precision is None:
+            return information_set
+        return {key: precision.store(value) if isinstance(value, np.ndarray) and value.dtype.kind == 'f' else value
+                for key, value in information_set.items()}
+
+    def bar_panel(self):
+        # the prices as a time × tickers array, shared with the other users of the data module
+        return self.data_module.bar_panel(self.time_column, self.company_column, self.adj_close_column)
+
+    def bar_window_start(self, i : int):
+        # position of the first bar of the window of bar i
+        panel = self.bar_panel()
+        if self.window_bars is not None:
+            return max(i - self.window_bars, 0)
+        return int(np.searchsorted(panel.times, panel.times[i] - pd.Timedelta(self.s).value, side='left'))
+
+    def compute_information_at_bar(self, i : int):
+        # information set at bar i of the bar panel, subclasses can compute it from the arrays directly
+        return self.compute_information(pd.Timestamp(self.bar_panel().times[i]))
 
     def get_prices(self, t : datetime):
         # gets the prices at which the portfolio will be rebalanced at time t 
@@ -119,12 +270,29 @@ class Information:
         prices = prices.to_dict()
         return prices
 
+    def price_matrix(self, dates):
+        # the prices of get_prices for many dates at once, as a PriceMatrix
+        return PriceMatrix.from_data(self.data_module.data, dates, self.s, self.time_column,
+                                     self.company_column, self.adj_close_column)
+
+    def get_volumes(self, t : datetime, window : int = 20):
+        # average daily volume of each company over the last `window` observations before t
+        data = self.slice_data(t)
+        if self.volume_column not in data.columns:
+            return {}
+        volumes = data.groupby(self.company_column)[self.volume_column].apply(lambda v: v.tail(window).mean())
+        return volumes.to_dict()
+
     def compute_information(self, t:datetime):  
         pass
 
     def compute_portfolio(self, information_set:dict):
         pass
 
+    def compute_portfolios(self, information_sets:list):
+        # portfolios of many dates, subclasses can compute them in one vectorized call
+        return [self.compute_portfolio(information_set) for information_set in information_sets]
+
 @dataclass
 class FirstTwoMoments(Information):
  
@@ -135,6 +303,7 @@ class FirstTwoMoments(Information):
         data = self.slice_data(t)
         # the information set will be a dictionary with the data
         information_set = {}
+        data[self.adj_close_column] = self.accumulate(data[self.adj_close_column].to_numpy())
         # sort data by ticker and date
         data = data.sort_values(by=[self.company_column, self.time_column])
         # expected return per company
@@ -153,7 +322,26 @@ class FirstTwoMoments(Information):
         # add to the information set
         information_set['covariance_matrix'] = covariance_matrix
         information_set['companies'] = data.columns.to_numpy()
-        return information_set
+        return self.store_information(information_set)
+
+    def compute_information_at_bar(self, i : int):
+        """Same information set as compute_information, from the bar panel without pandas
+
+        The expected returns are the mean returns between consecutive bars, a missing bar gives no
+        return. The covariance is computed on the bars where no price is missing, like the dropna above.
+        """
+        panel = self.bar_panel()
+        prices = self.accumulate(panel.values[self.bar_window_start(i):i])
+        present = ~np.isnan(prices).all(axis=0)
+        prices = prices[:, present]
+        with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected_return = np.nanmean(prices[1:] / prices[:-1] - 1, axis=0)
+            complete = prices[~np.isnan(prices).any(axis=1)]
+            covariance_matrix = np.atleast_2d(np.cov(complete, rowvar=False, ddof=1)) if prices.shape[1] \
+                else np.empty((0, 0))
+        return self.store_information({'expected_return': expected_return, 'covariance_matrix': covariance_matrix,
+                                       'companies': panel.tickers[present]})
 
     def compute_portfolio(self, information_set:dict):
         try:
@@ -164,4 +352,59 @@ class FirstTwoMoments(Information):
         except Exception as e:
             logging.warning("Error computing portfolio, returning equal weight portfolio")
             logging.warning(e)
-            return {k: 1/len(information_set['companies']) for k in information_set['companies']}
\ No newline at end of file
+            return {k: 1/len(information_set['companies']) for k in information_set['companies']}
+
+    def compute_portfolios(self, information_sets:list):
+        if self.portfolio_strategy is None:
+            return super().compute_portfolios(information_sets)
+        try:
+            # dates with the same universe are stacked and solved together
+            return compute_weight_schedule(self.portfolio_strategy, information_sets)
+        except Exception as e:
+            logging.warning("Error computing the portfolios in batch, computing them one date at a time")
+            logging.warning(e)
+            return super().compute_portfolios(information_sets)
+
+@dataclass
+class FactorMoments(FirstTwoMoments):
+    """ Low-rank statistical factor model (PCA) of the returns, for universes of thousands of tickers
+
+    The covariance matrix is Σ = B F Bᵀ + diag(D), with k factors. It is never built: the strategies
+    solve with it through the Woodbury identity in O(N·k²). Missing prices are handled pairwise, a
+    ticker with gaps does not remove dates for all the others.
+    """
+    n_factors: int = 5
+    min_observations: int = 20 # tickers with fewer returns in the window are left out
+    min_specific_share: float = 0.01 # floor of the specific variance, as a share of the total variance
+
+    # the array version of FirstTwoMoments does not apply to the factor model
+    compute_information_at_bar = Information.compute_information_at_bar
+
+    def compute_information(self, t:datetime):
+        data = self.slice_data(t)
+        data[self.adj_close_column] = self.accumulate(data[self.adj_close_column].to_numpy())
+        information_set = {}
+        # returns by date and company, NaN where a price is missing (no dropna over all the tickers)
+        prices = data.pivot_table(index=self.time_column, columns=self.company_column, values=self.adj_close_column)
+        returns = prices.sort_index().pct_change(fill_method=None).iloc[1:]
+        counts = returns.count()
+        returns = returns.loc[:, counts >= self.min_observations]
+        counts = counts[returns.columns].to_numpy()
+        R = returns.to_numpy()
+        mean = np.nanmean(R, axis=0)
+        # pairwise-complete total variance of each ticker
+        variance = np.nansum((R - mean) ** 2, axis=0) / (counts - 1)
+        # demeaned returns with the missing values at zero, scaled so that XᵀX has the variances on its diagonal
+        X = np.nan_to_num(R - mean) / np.sqrt(counts - 1)
+        # thin SVD of the T×N matrix, O(T²·N) instead of the O(N³) of a dense covariance
+        _, singular_values, Vt = np.linalg.svd(X, full_matrices=False)
+        k = max(0, min(self.n_factors, len(R) - 1, X.shape[1]))
+        loadings = Vt[:k].T * singular_values[:k]
+        specific_variance = np.maximum(variance - (loadings ** 2).sum(axis=1), self.min_specific_share * variance)
+
+        information_set['expected_return'] = mean
+        information_set['factor_loadings'] = loadings
+        information_set['factor_covariance'] = np.eye(k)
+        information_set['specific_variance'] = specific_variance
+        information_set['companies'] = returns.columns.to_numpy()
+        return self.store_information(information_set)
@@ -0,0 +1,301 @@
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import minimize
+
+from pybacktestchain_ss.analytics import RunPanel
+from pybacktestchain_ss.broker import Backtest, Broker
+from pybacktestchain_ss.data_module import Information
+from pybacktestchain_ss.portfolio_strategies import _to_portfolio, covariance_matrix
+from pybacktestchain_ss.universe import restrict_information_set
+from pybacktestchain_ss.valuation import mark_to_market
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+# tolerance of the breakpoints and of the optimality (KKT) checks
+TOLERANCE = 1e-10
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+class _FreeSetSolver:
+    """ Solves the equality-constrained problem on a set of free assets, one Cholesky factorization per free set
+
+    The path visits a set at most a few times, the factorizations are kept so that coming back to a set
+    (and evaluating many gammas on it) does not factorize Σ_FF again.
+    """
+    def __init__(self, mu: np.ndarray, Sigma: np.ndarray):
+        self.mu, self.Sigma = mu, Sigma
+        self.cache = {}
+
+    def __call__(self, free: np.ndarray):
+        key = free.tobytes()
+        if key not in self.cache:
+            factor = cho_factor(self.Sigma[np.ix_(free, free)])
+            u = cho_solve(factor, np.ones(free.sum()))
+            v = cho_solve(factor, self.mu[free])
+            s_u, s_v = u.sum(), v.sum()
+            # on the free assets x = a + λb, the budget multiplier is ν = (λ s_v - 1) / s_u
+            self.cache[key] = (u / s_u, v - s_v / s_u * u, s_u, s_v)
+        return self.cache[key]
+
+def _start_set(mu: np.ndarray, Sigma: np.ndarray, solve: _FreeSetSolver):
+    """The free assets at λ = ∞: the long-only minimum variance portfolio of the assets tied at the highest
+    expected return, a single asset without a tie"""
+    tied = mu >= mu.max() - TOLERANCE * max(abs(mu.max()), 1.0)
+    free = tied.copy()
+    for _ in range(2 * len(mu) + 2):
+        a, _, s_u, _ = solve(free)
+        if a.min() < -TOLERANCE:
+            # a negative weight, the asset leaves
+            free[np.flatnonzero(free)[np.argmin(a)]] = False
+            continue
+        # multipliers of the tied assets at zero, an asset with a negative one enters
+        eta = Sigma[tied & ~free][:, free] @ a - 1 / s_u
+        if len(eta) and eta.min() < -TOLERANCE:
+            free[np.flatnonzero(tied & ~free)[np.argmin(eta)]] = True
+            continue
+        return free
+    raise ValueError("No starting portfolio for the critical line (degenerate problem)")
+
+def critical_line(mu: np.ndarray, Sigma: np.ndarray, lambda_min: float = 0.0):
+    """critical_line traces the long-only mean-variance frontier as a list of linear segments
+
+    The RiskAverseStrategy problem is written with λ = 1/γ: min ½ xᵀΣx - λ μᵀx with Σx = 1, x ≥ 0. Between two
+    breakpoints the set of free (non-zero) assets does not change and the solution is affine in λ. The
+    path starts from the asset with the highest expected return (λ = ∞, γ = 0), or from the minimum variance
+    portfolio of the assets tied at the highest expected return, and lowers λ, an asset
+    leaving the portfolio when its weight reaches zero and entering it when its multiplier does (Markowitz'
+    critical line algorithm).
+
+    Args:
+        mu (np.ndarray): N expected returns
+        Sigma (np.ndarray): N×N covariance matrix
+        lambda_min (float): The path stops below this λ, i.e. above the largest γ needed
+
+    Returns:
+        list: Segments (lambda_high, lambda_low, free, a, b), x[free] = a + λb for λ in [lambda_low, lambda_high]
+    """
+    n = len(mu)
+    solve = _FreeSetSolver(mu, Sigma)
+    free = _start_set(mu, Sigma, solve)
+    lam, segments = np.inf, []
+    # every asset enters and leaves a bounded number of times in a non-degenerate problem
+    for _ in range(4 * n + 4):
+        a, b, s_u, s_v = solve(free)
+        # multipliers of the assets at zero: η = c + λd, they must stay non-negative
+        c = Sigma[~free][:, free] @ a - 1 / s_u
+        d = Sigma[~free][:, free] @ b - mu[~free] + s_v / s_u
+        candidates = []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            leaving = np.where(b > TOLERANCE, -a / b, -np.inf)
+            entering = np.where(d > TOLERANCE, -c / d, -np.inf)
+        leaving[leaving >= lam * (1 - TOLERANCE)] = -np.inf
+        entering[entering >= lam * (1 - TOLERANCE)] = -np.inf
+        if len(leaving):
+            candidates.append((leaving.max(), 'leave', np.flatnonzero(free)[np.argmax(leaving)]))
+        if len(entering):
+            candidates.append((entering.max(), 'enter', np.flatnonzero(~free)[np.argmax(entering)]))
+        next_lam, event, asset = max(candidates, default=(-np.inf, None, None), key=lambda candidate: candidate[0])
+        segments.append((lam, max(next_lam, lambda_min), free.copy(), a, b))
+        if event is None or next_lam <= lambda_min:
+            return segments
+        free[asset] = event == 'enter'
+        lam = next_lam
+    raise ValueError("The critical line did not converge (degenerate problem)")
+
+def _is_optimal(x: np.ndarray, mu: np.ndarray, Sigma: np.ndarray, lam: float):
+    # KKT conditions of min ½ xᵀΣx - λ μᵀx with Σx = 1 and x ≥ 0
+    if not np.isfinite(x).all() or x.min() < -1e-8 or abs(x.sum() - 1) > 1e-8:
+        return False
+    if np.isinf(lam):
+        return True
+    gradient = Sigma @ x - lam * mu
+    free = x > 1e-12
+    nu = -gradient[free].mean()
+    scale = 1e-7 * max(np.abs(gradient).max(), 1e-12)
+    return np.abs(gradient[free] + nu).max() <= scale and (gradient[~free] + nu >= -scale).all()
+
+def _solve_gamma(mu: np.ndarray, Sigma: np.ndarray, gamma: float, x0: np.ndarray):
+    """One SciPy solve of the RiskAverseStrategy problem for gamma, starting from x0"""
+    res = minimize(lambda x: -x.dot(mu) + gamma / 2 * x.dot(Sigma).dot(x), x0,
+                   jac=lambda x: -mu + gamma * Sigma.dot(x),
+                   constraints=({'type': 'eq', 'fun': lambda x: np.sum(x) - 1},),
+                   bounds=[(0.0, 1.0)] * len(mu), method='SLSQP')
+    if not res.success:
+        raise ValueError(f"Optimization did not converge for gamma={gamma}")
+    return res.x
+
+def frontier_weights(expected_return: np.ndarray, covariance_matrix: np.ndarray, gammas):
+    """frontier_weights returns the long-only RiskAverseStrategy weights for a whole vector of risk aversions
+
+    The weights of every gamma are read off one critical line path, so the whole vector costs about as
+    much as one solve. If the path fails (e.g. a singular covariance matrix) the gammas are solved one by
+    one with SciPy, each from equal weights like the RiskAverseStrategy.
+
+    Args:
+        expected_return (np.ndarray): N expected returns
+        covariance_matrix (np.ndarray): N×N covariance matrix
+        gammas: G risk aversions, γ = 0 gives the asset with the highest expected return
+
+    Returns:
+        np.ndarray: G×N weights, in the order of gammas
+
+    Example:
+        weights = frontier_weights(info_set['expected_return'], info_set['covariance_matrix'], [0.5, 1, 2, 5])
+    """
+    mu = np.asarray(expected_return, dtype=float)
+    Sigma = np.asarray(covariance_matrix, dtype=float)
+    gammas = np.asarray(gammas, dtype=float)
+    with np.errstate(divide='ignore'):
+        lambdas = 1 / gammas
+    weights = np.zeros((len(gammas), len(mu)))
+    try:
+        segments = critical_line(mu, Sigma, lambdas.min() if len(lambdas) else 0.0)
+        for g, lam in enumerate(lambdas):
+            # the segment containing λ, segments go by decreasing λ
+            lam_high, lam_low, free, a, b = next(s for s in segments if s[1] <= lam or s is segments[-1])
+            weights[g, free] = a if np.isinf(lam) else a + lam * b
+            weights[g] = np.clip(weights[g], 0, None)
+            weights[g] /= weights[g].sum()
+            if not _is_optimal(weights[g], mu, Sigma, lam):
+                raise ValueError(f"The critical line is not optimal for gamma={gammas[g]}")
+        return weights
+    except (ValueError, np.linalg.LinAlgError) as e:
+        logging.info(f"Critical line failed ({e}), solving the gammas one by one")
+    # a warm start from the previous gamma can stop far from the optimum, each gamma starts from equal weights
+    x0 = np.ones(len(mu)) / len(mu)
+    for g, gamma in enumerate(gammas):
+        weights[g] = _solve_gamma(mu, Sigma, gamma, x0)
+    return weights
+
+def efficient_frontier(information_set: dict, gammas):
+    """The frontier of an information set: weights, expected return and volatility for each gamma
+
+    Returns:
+        pd.DataFrame: One row per gamma, the weights by company then 'expected_return' and 'volatility'
+    """
+    Sigma = covariance_matrix(information_set)
+    weights = frontier_weights(information_set['expected_return'], Sigma, gammas)
+    frontier = pd.DataFrame(weights, index=pd.Index(gammas, name='gamma'), columns=information_set['companies'])
+    frontier['expected_return'] = weights @ information_set['expected_return']
+    frontier['volatility'] = np.sqrt(np.einsum('gi,ij,gj->g', weights, Sigma, weights))
+    return frontier
+
+def frontier_portfolios(information_set: dict, gammas):
+    """The portfolios of all the gammas for one information set, equal weights if it cannot be solved"""
+    companies = information_set.get('companies')
+    if companies is None or len(companies) == 0:
+        return [{} for _ in gammas]
+    try:
+        weights = frontier_weights(information_set['expected_return'], covariance_matrix(information_set), gammas)
+        return [_to_portfolio(w, companies) for w in weights]
+    except Exception as e:
+        logging.warning("Error computing the frontier portfolios, returning equal weight portfolios")
+        logging.warning(e)
+        return [{k: 1/len(companies) for k in companies} for _ in gammas]
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class FrontierBacktest(Backtest):
+    """ The RiskAverseStrategy backtested for many risk aversions in a single pass over the dates
+
+    The information set of each date is computed once and the weights of every gamma come from one
+    frontier path, then each gamma trades with its own broker. The values of all the gammas are returned
+    side by side, one column per gamma.
+
+    Example:
+        backtest = FrontierBacktest(datetime(2019, 1, 1), datetime(2020, 1, 1), gammas=[0.5, 1, 2, 5, 10])
+        values, _, _ = backtest.run_backtest()
+        backtest.performance()[['sharpe', 'volatility']]
+    """
+    gammas: list = field(default_factory=lambda: [0.5, 1, 2, 5, 10])
+
+    def __post_init__(self):
+        super().__post_init__()
+        # one broker and one valuation per gamma, self.broker is the one of the first gamma
+        self.brokers = {gamma: self.broker if g == 0 else Broker(cash=self.initial_cash, verbose=self.verbose, cost_model=self.cost_model)
+                        for g, gamma in enumerate(self.gammas)}
+        if self.persist:
+            for broker in self.brokers.values():
+                broker.blockchain = self.broker.blockchain
+        self.valuations = {}
+
+    @staticmethod
+    def label(gamma: float):
+        return f"gamma={gamma:g}"
+
+    def run_backtest(self):
+        if self.bar_mode:
+            raise ValueError("FrontierBacktest runs on daily data only")
+        if self.checkpoint_interval is not None:
+            raise ValueError("FrontierBacktest runs all the gammas at once and does not checkpoint, "
+                             "set checkpoint_interval=None")
+        if self.use_cache and self.persist:
+            logging.info("The run cache keeps a single broker, FrontierBacktest runs are not cached")
+        self.use_cache = False
+        return super().run_backtest()
+
+    def run_days(self, info: Information):
+        """Runs every gamma day by day, returns the values by gamma and the portfolios of the first gamma"""
+        dates = pd.date_range(start=self.initial_date, end=self.final_date, freq='D')
+        price_matrix = self.price_matrix(info, dates)
+        initial_portfolios, final_portfolios = None, None
+        for t_index, t in enumerate(dates):
+            rebalance = self.rebalance_flag().time_to_rebalance(t) or t==self.initial_date
+            if self.risk_model is None and not rebalance:
+                continue
+            information_set = self.information_set_at(info, t)
+            if self.universe_screen is not None:
+                companies = information_set.get('companies', [])
+                information_set = restrict_information_set(information_set, self.universe_screen.members(self.screen_panel(info), t))
+            portfolios = frontier_portfolios(information_set, self.gammas)
+            if self.universe_screen is not None:
+                # the companies screened out are sold
+                portfolios = [{company: portfolio.get(company, 0.0) for company in companies} for portfolio in portfolios]
+            prices = price_matrix.prices_at(t_index)
+            volumes = info.get_volumes(t) if rebalance and self.needs_volume else None
+            for gamma, portfolio in zip(self.gammas, portfolios):
+                broker = self.brokers[gamma]
+                if self.risk_model is not None:
+                    self.apply_risk_model(t, portfolio, prices, broker)
+                if rebalance:
+                    broker.execute_portfolio(portfolio, prices, t, volumes)
+            if initial_portfolios is None and portfolios and portfolios[0]:
+                initial_portfolios = portfolios
+            final_portfolios = portfolios
+        values = pd.DataFrame({'Date': dates})
+        for gamma, broker in self.brokers.items():
+            self.valuations[gamma] = mark_to_market(broker.get_transaction_log(), price_matrix, self.initial_cash)
+            values[self.label(gamma)] = self.valuations[gamma].portfolio_values
+        self.valuation = self.valuations[self.gammas[0]]
+        if self.progress_callback is not None:
+            self.progress_callback(list(values['Date']), list(values[self.label(self.gammas[0])]))
+        # the column run_backtest reports the final value of
+        values['Portfolio value'] = values[self.label(self.gammas[0])]
+        first = lambda portfolios: None if portfolios is None else portfolios[0].copy()
+        return values, first(initial_portfolios), first(final_portfolios)
+
+    def store_results(self, final_portfolio_value: float, once: bool = False):
+        """Stores the transaction log of each gamma as its own run, named after the backtest and the gamma"""
+        name = self.backtest_name
+        try:
+            for gamma, broker in self.brokers.items():
+                self.broker, self.backtest_name = broker, f"{name}-gamma{gamma:g}"
+                super().store_results(self.valuations[gamma].portfolio_values[-1], once)
+        finally:
+            self.broker, self.backtest_name = self.brokers[self.gammas[0]], name
+
+    def performance(self, risk_free_rate: float = 0.0):
+        """The performance metrics of each gamma, one row per gamma"""
+        return RunPanel.from_runs({self.label(gamma): (self.valuations[gamma].portfolio_values_df, broker.get_transaction_log())
+                                   for gamma, broker in self.brokers.items()}).metrics(risk_free_rate)
@@ -0,0 +1,213 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional, Type
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.analytics import RunPanel
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments, Information, get_stocks_data
+from pybacktestchain_ss.broker import Backtest, EndOfMonth, RiskModel
+from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy, RiskAverseStrategy
+from pybacktestchain_ss.transaction_costs import CostModel
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+# metrics of analytics.compute_metrics kept in the summary of each path
+PATH_METRICS = ['final_value', 'total_return', 'cagr', 'volatility', 'sharpe', 'sortino', 'max_drawdown',
+                'turnover', 'n_trades', 'costs']
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def block_bootstrap(returns: np.ndarray, rng: np.random.Generator, block_length: int):
+    """block_bootstrap resamples the rows of a dates × tickers array of returns in blocks of consecutive rows
+
+    Whole rows are drawn, so the correlation between the tickers is kept, and blocks of block_length dates,
+    so is the short-term autocorrelation (volatility clusters, momentum). The result has as many rows as
+    the input.
+    """
+    n = len(returns)
+    if n == 0:
+        return returns
+    block_length = min(max(int(block_length), 1), n)
+    n_blocks = -(-n // block_length)
+    starts = rng.integers(0, n - block_length + 1, n_blocks)
+    rows = (starts[:, None] + np.arange(block_length)).ravel()[:n]
+    return returns[rows]
+
+def bootstrap_prices(prices: np.ndarray, rng: np.random.Generator, block_length: int):
+    """A resampled dates × tickers price panel with the block-bootstrapped log returns of `prices`
+
+    Each ticker starts from its first price and has no price before it, like in the original panel.
+    Missing prices give no return.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_returns = np.nan_to_num(np.diff(np.log(prices), axis=0))
+    paths = np.vstack([np.zeros((1, prices.shape[1])), np.cumsum(block_bootstrap(log_returns, rng, block_length), axis=0)])
+    # each ticker starts from its first observed price on its first date
+    first_rows, columns = np.argmax(~np.isnan(prices), axis=0), np.arange(prices.shape[1])
+    resampled = prices[first_rows, columns] * np.exp(paths - paths[first_rows, columns])
+    resampled[np.isnan(prices)] = np.nan
+    return resampled
+
+def _simulate_paths(source: dict, paths: list):
+    """Runs the Backtest of each (path, SeedSequence) on its resampled data, returns one summary per path"""
+    dates, tickers, prices = source['dates'], source['tickers'], source['prices']
+    config = source['config']
+    summaries = []
+    for path, seed_sequence in paths:
+        rng = np.random.default_rng(seed_sequence)
+        columns = np.arange(len(tickers))
+        if config['universe_size'] is not None and config['universe_size'] < len(tickers):
+            columns = np.sort(rng.choice(len(tickers), config['universe_size'], replace=False))
+        values = prices[:, columns]
+        if config['block_length']:
+            values = bootstrap_prices(values, rng, config['block_length'])
+        jitter = config['start_jitter'].days
+        offset = timedelta(days=int(rng.integers(-jitter, jitter + 1))) if jitter else timedelta(0)
+        # the resampled panel back to the long format of the data module
+        present = ~np.isnan(values)
+        rows, cols = np.nonzero(present)
+        data = pd.DataFrame({config['time_column']: dates[rows], config['company_column']: tickers[columns][cols],
+                             config['adj_close_column']: values[present]})
+        backtest = Backtest(initial_date=config['initial_date'] + offset, final_date=config['final_date'] + offset,
+                            universe=list(tickers[columns]), data_module=DataModule(data, config['time_column']),
+                            **config['backtest'])
+        summary = {'path': path, 'initial_date': backtest.initial_date, 'universe': ','.join(backtest.universe)}
+        try:
+            backtest.run_backtest()
+            metrics = RunPanel.from_backtest(backtest).metrics().iloc[0]
+            summary.update({metric: metrics[metric] for metric in PATH_METRICS})
+        except Exception as e:
+            logging.warning(f"Path {path} failed: {e}")
+            summary.update({metric: np.nan for metric in PATH_METRICS})
+        summaries.append(summary)
+    return summaries
+
+# the source data of the worker processes, sent once per process instead of once per batch
+_WORKER_SOURCE = None
+
+def _init_worker(source: dict):
+    global _WORKER_SOURCE
+    _WORKER_SOURCE = source
+
+def _simulate_paths_in_worker(paths: list):
+    # top-level so that it can be sent to worker processes
+    return _simulate_paths(_WORKER_SOURCE, paths)
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class MonteCarloResult:
+    summaries: pd.DataFrame # one row per path: its parameters and its metrics
+
+    def distribution(self, quantiles: list = [0.05, 0.25, 0.5, 0.75, 0.95]):
+        """Mean, standard deviation and quantiles of each metric over the paths"""
+        metrics = self.summaries[[m for m in PATH_METRICS if m in self.summaries.columns]].astype(float)
+        return pd.concat([metrics.mean().rename('mean'), metrics.std().rename('std'),
+                          metrics.quantile(quantiles).T], axis=1)
+
+    def p_value(self, metric: str, observed: float):
+        """Share of the paths doing at least as well as the observed value (e.g. the Sharpe of the real backtest)"""
+        values = self.summaries[metric].dropna().to_numpy(dtype=float)
+        return float((values >= observed).mean()) if len(values) else np.nan
+
+@dataclass
+class MonteCarlo:
+    """ Robustness of a strategy: many Backtests on resampled versions of one loaded DataModule
+
+    Each path draws, from its own seeded stream, a random sub-universe, a shifted start date and a
+    block bootstrap of the price history, then runs the strategy and the broker on it. The paths run
+    in batches across processes and only their metrics are kept, so the memory does not grow with the
+    length of the curves.
+
+    Example:
+        result = MonteCarlo(datetime(2019, 1, 1), datetime(2020, 1, 1), n_paths=1000, universe_size=5).run()
+        result.distribution().loc['sharpe']
+    """
+    initial_date: datetime
+    final_date: datetime
+    n_paths: int = 1000
+    block_length: Optional[int] = 20 # dates per bootstrap block, None to keep the original prices
+    start_jitter: timedelta = timedelta(days=0) # start dates are shifted by up to ± start_jitter
+    universe_size: Optional[int] = None # tickers drawn from the universe for each path, all of them if None
+    seed: Optional[int] = 0 # the paths are reproducible for a given seed, whatever the number of workers
+    universe: list = field(default_factory=lambda: \
+                           ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'META', 'TSLA', 'NVDA', 'INTC', 'CSCO', 'NFLX'])
+    portfolio_strategy: PortfolioStrategy = field(default_factory=lambda: RiskAverseStrategy)
+    information_class : Type[Information] = FirstTwoMoments
+    s: timedelta = timedelta(days=360)
+    time_column: str = 'Date'
+    company_column: str = 'ticker'
+    adj_close_column: str = 'Adj Close'
+    rebalance_flag: type = EndOfMonth
+    risk_model: Optional[Type[RiskModel]] = None
+    risk_threshold: float = 0.1
+    cost_model: Optional[CostModel] = None
+    initial_cash: int = 1000000
+    max_workers: Optional[int] = None
+    use_processes: bool = True # paths in worker processes instead of threads
+    paths_per_task: int = 16 # paths sent to a worker at once
+    data_module: Optional[DataModule] = None
+
+    def load_data(self):
+        """Downloads the history of the universe once, for the information window of the earliest start"""
+        start = self.initial_date - self.s - self.start_jitter
+        end = self.final_date + self.start_jitter
+        logging.info(f"Retrieving price data for universe from {start} to {end}")
+        df = get_stocks_data(self.universe, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        return DataModule(df, self.time_column)
+
+    def source(self):
+        """The prices of the universe as a dates × tickers panel, and the configuration of the paths"""
+        panel = self.data_module.bar_panel(self.time_column, self.company_column, self.adj_close_column)
+        columns = [panel.column(ticker) for ticker in self.universe if ticker in panel.tickers]
+        backtest = dict(portfolio_strategy=self.portfolio_strategy, information_class=self.information_class, s=self.s,
+                        time_column=self.time_column, company_column=self.company_column,
+                        adj_close_column=self.adj_close_column, rebalance_flag=self.rebalance_flag,
+                        risk_model=self.risk_model, risk_threshold=self.risk_threshold, cost_model=self.cost_model,
+                        initial_cash=self.initial_cash, verbose=False, persist=False, use_cache=False,
+                        registry_path=None)
+        config = dict(initial_date=self.initial_date, final_date=self.final_date, block_length=self.block_length,
+                      start_jitter=self.start_jitter, universe_size=self.universe_size, time_column=self.time_column,
+                      company_column=self.company_column, adj_close_column=self.adj_close_column, backtest=backtest)
+        return {'dates': pd.DatetimeIndex(panel.times), 'tickers': panel.tickers[columns],
+                'prices': panel.values[:, columns], 'config': config}
+
+    def run(self, callback: Optional[Callable] = None):
+        """Runs all the paths and returns a MonteCarloResult
+
+        Args:
+            callback (Callable): Called with the summary of each path as soon as its batch completes
+        """
+        if self.data_module is None:
+            self.data_module = self.load_data()
+        source = self.source()
+        # independent streams: path i always gets the i-th child of the seed
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_paths)
+        paths = list(enumerate(seeds))
+        batches = [paths[i:i + self.paths_per_task] for i in range(0, len(paths), self.paths_per_task)]
+        if self.use_processes:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker, initargs=(source,))
+            task = _simulate_paths_in_worker
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            task = lambda batch: _simulate_paths(source, batch)
+        summaries = []
+        with executor:
+            futures = [executor.submit(task, batch) for batch in batches]
+            for future in as_completed(futures):
+                for summary in future.result():
+                    summaries.append(summary)
+                    if callback is not None:
+                        callback(summary)
+        summaries = pd.DataFrame(summaries, columns=['path', 'initial_date', 'universe'] + PATH_METRICS)
+        return MonteCarloResult(summaries.sort_values('path').reset_index(drop=True))
@@ -5,18 +5,127 @@ from scipy.optimize import minimize
 import numpy as np
 
 
+def covariance_matrix(information_set: dict):
+    """Returns the covariance matrix of an information set, built from the factor model if there is no dense one"""
+    if 'covariance_matrix' in information_set:
+        return information_set['covariance_matrix']
+    B = information_set['factor_loadings']
+    return B @ information_set['factor_covariance'] @ B.T + np.diag(information_set['specific_variance'])
+
+def solve_covariance(information_set: dict, b: np.ndarray):
+    """Solves Σx = b. With a factor model (Σ = BFBᵀ + D) this uses the Woodbury identity, in O(N·k²)
+
+    Σ⁻¹ = D⁻¹ - D⁻¹B (F⁻¹ + BᵀD⁻¹B)⁻¹ BᵀD⁻¹
+    """
+    if 'covariance_matrix' in information_set:
+        return np.linalg.solve(information_set['covariance_matrix'], b)
+    B = information_set['factor_loadings']
+    D_inv = 1 / information_set['specific_variance']
+    D_inv_b = D_inv * b
+    D_inv_B = D_inv[:, None] * B
+    capacitance = np.linalg.inv(information_set['factor_covariance']) + B.T @ D_inv_B
+    return D_inv_b - D_inv_B @ np.linalg.solve(capacitance, B.T @ D_inv_b)
+
+def _solve_batch(Sigma: np.ndarray, b: np.ndarray):
+    """Solves Σ[t] x[t] = b[t] for all t at once, rows that cannot be solved are NaN"""
+    try:
+        return np.linalg.solve(Sigma, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # one singular matrix makes the whole batch fail, solve row by row
+        x = np.full(b.shape, np.nan)
+        for t in range(len(b)):
+            try:
+                x[t] = np.linalg.solve(Sigma[t], b[t])
+            except np.linalg.LinAlgError:
+                pass
+        return x
+
+def _normalize_rows(weights: np.ndarray):
+    """Scales each row to sum to one, rows that are not finite become equal weights (the usual fallback)"""
+    weights = weights / weights.sum(axis=-1, keepdims=True)
+    invalid = ~np.isfinite(weights).all(axis=-1)
+    if invalid.any():
+        logging.warning(f"Error computing {invalid.sum()} portfolios of the batch, returning equal weight portfolios")
+        weights[invalid] = 1 / weights.shape[-1]
+    return weights
+
+def _to_portfolio(weights: np.ndarray, companies):
+    return {company: weights[i] for i, company in enumerate(companies)}
+
 class PortfolioStrategy(ABC):
     """ Abstract base class for any portfolio strategy """
     @abstractmethod
     def optimize_portfolio(self, information_set: dict) -> dict[str, float]:
         pass
 
+    @classmethod
+    def optimize_batch(cls, expected_return: np.ndarray = None, covariance_matrix: np.ndarray = None) -> np.ndarray:
+        """Computes the weights of T dates at once.
+
+        Args:
+            expected_return (np.ndarray): T×N expected returns
+            covariance_matrix (np.ndarray): T×N×N covariance matrices
+
+        Returns:
+            np.ndarray: T×N weights
+
+        Strategies with a closed form override this with batched NumPy linear algebra, the others
+        go through optimize_portfolio one date at a time.
+        """
+        stacked = expected_return if expected_return is not None else covariance_matrix
+        T, N = stacked.shape[0], stacked.shape[1]
+        weights = np.empty((T, N))
+        for t in range(T):
+            information_set = {'companies': np.arange(N)}
+            if expected_return is not None:
+                information_set['expected_return'] = expected_return[t]
+            if covariance_matrix is not None:
+                information_set['covariance_matrix'] = covariance_matrix[t]
+            portfolio = cls.optimize_portfolio(information_set)
+            weights[t] = [portfolio[i] for i in range(N)]
+        return weights
+
+def compute_weight_schedule(strategy, information_sets: list):
+    """compute_weight_schedule computes the portfolios of many dates with one vectorized call per universe
+
+    Consecutive information sets with the same companies and a dense covariance matrix are stacked and
+    solved together with optimize_batch, the others go through optimize_portfolio.
+
+    Returns:
+        list: One portfolio dict per information set
+
+    Example:
+        portfolios = compute_weight_schedule(MinimumVarianceStrategy, [info.compute_information(t) for t in dates])
+    """
+    portfolios = [None] * len(information_sets)
+    i = 0
+    while i < len(information_sets):
+        first = information_sets[i]
+        companies = first.get('companies')
+        if companies is None or len(companies) == 0 or 'covariance_matrix' not in first:
+            portfolios[i] = strategy.optimize_portfolio(first)
+            i += 1
+            continue
+        # group the following dates sharing the same universe
+        j = i + 1
+        while (j < len(information_sets) and 'covariance_matrix' in information_sets[j]
+               and np.array_equal(information_sets[j].get('companies'), companies)):
+            j += 1
+        group = information_sets[i:j]
+        # moments stored in single precision are solved in double precision
+        weights = strategy.optimize_batch(np.stack([s['expected_return'] for s in group]).astype(float, copy=False),
+                                          np.stack([s['covariance_matrix'] for s in group]).astype(float, copy=False))
+        for t, information_set in enumerate(group):
+            portfolios[i + t] = _to_portfolio(weights[t], companies)
+        i = j
+    return portfolios
+
 @dataclass
 class RiskAverseStrategy(PortfolioStrategy):
     def optimize_portfolio(information_set):
         try:
             mu = information_set['expected_return']
-            Sigma = information_set['covariance_matrix']
+            Sigma = covariance_matrix(information_set)
             gamma = 1 # risk aversion parameter
             n = len(mu)
             # objective function
@@ -52,21 +161,26 @@ class MinimumVarianceStrategy(PortfolioStrategy):
     def optimize_portfolio(information_set):
         """ Finding the minimum variance portfolio which is the vertex of the parabola (closed form solution)"""
         try:
-            Sigma = information_set['covariance_matrix']
-            n = Sigma.shape[0]
-            ones = np.ones(n)
-            
-            # solve for the weights: w = Σ⁻¹1 / (1ᵀΣ⁻¹1)
-            inv_Sigma = np.linalg.inv(Sigma)
-            weights = inv_Sigma @ ones / (ones.T @ inv_Sigma @ ones)
-            
-            portfolio = {company: weights[i] for i, company in enumerate(information_set['companies'])}
-            return portfolio
+            if 'covariance_matrix' in information_set:
+                weights = MinimumVarianceStrategy.optimize_batch(covariance_matrix=information_set['covariance_matrix'][None])[0]
+            else:
+                # factor model, solved with the Woodbury identity
+                n = len(information_set['companies'])
+                ones = np.ones(n)
+                inv_Sigma_ones = solve_covariance(information_set, ones)
+                weights = inv_Sigma_ones / (ones.T @ inv_Sigma_ones)
+            return _to_portfolio(weights, information_set['companies'])
         except Exception as e:
             logging.warning("Error computing Minimum Variance Portfolio, returning equal weight portfolio")
             logging.warning(e)
             return {k: 1/len(information_set['companies']) for k in information_set['companies']}
 
+    @staticmethod
+    def optimize_batch(expected_return=None, covariance_matrix=None):
+        """ Batched closed form: w = Σ⁻¹1 / (1ᵀΣ⁻¹1) for every date """
+        ones = np.ones(covariance_matrix.shape[:2])
+        return _normalize_rows(_solve_batch(covariance_matrix, ones))
+
 @dataclass 
 class MaximumReturnStrategy(PortfolioStrategy):
     def optimize_portfolio(information_set):
@@ -75,17 +189,21 @@ class MaximumReturnStrategy(PortfolioStrategy):
             mu = information_set['expected_return']
             companies = information_set['companies']
             
-            # find the index of the maximum return, as this asset will get 100% of the weight
-            max_index = np.argmax(mu)
-            
-            portfolio = {company: 0 for company in companies}
-            portfolio[companies[max_index]] = 1.0  # allocate 100% to the max return asset
-            return portfolio
+            # 100% of the weight goes to the asset with the maximum return
+            weights = MaximumReturnStrategy.optimize_batch(expected_return=np.asarray(mu)[None])[0]
+            return {company: 1.0 if weights[i] else 0 for i, company in enumerate(companies)}
         except Exception as e:
             logging.warning("Error computing Maximum Return Portfolio, returning equal weight portfolio")
             logging.warning(e)
             return {k: 1/len(information_set['companies']) for k in information_set['companies']}
 
+    @staticmethod
+    def optimize_batch(expected_return=None, covariance_matrix=None):
+        """ Batched version: one-hot rows on the asset with the highest expected return """
+        weights = np.zeros(expected_return.shape)
+        weights[np.arange(len(expected_return)), np.argmax(expected_return, axis=1)] = 1.0
+        return weights
+
 @dataclass
 class EqualWeightStrategy(PortfolioStrategy):
     def optimize_portfolio(information_set):
@@ -101,12 +219,17 @@ class EqualWeightStrategy(PortfolioStrategy):
             logging.warning(e)
             return {}
 
+    @staticmethod
+    def optimize_batch(expected_return=None, covariance_matrix=None):
+        stacked = expected_return if expected_return is not None else covariance_matrix
+        return np.full(stacked.shape[:2], 1 / stacked.shape[1])
+
 @dataclass
 class EqualRiskStrategy(PortfolioStrategy):
     def optimize_portfolio(information_set):
         """" Weighting each asset so that the risk contributed is equal (also known as risk parity) """
         try:
-            Sigma = information_set['covariance_matrix']
+            Sigma = covariance_matrix(information_set)
             companies = information_set['companies']
             n = len(companies)
             # initially equal weights
@@ -143,14 +266,21 @@ class MaximumSharpeStrategy(PortfolioStrategy):
         try:
             mu = information_set['expected_return']
             mu_excess = mu - risk_free_rate
-            Sigma = information_set['covariance_matrix']
-            n = len(mu)
-            ones = np.ones(n)
-            inv_Sigma = np.linalg.inv(Sigma)
-            weights = inv_Sigma @ mu_excess / (ones.T @ inv_Sigma @ mu_excess)
-            portfolio = {company: weights[i] for i, company in enumerate(information_set['companies'])}
-            return portfolio
+            if 'covariance_matrix' in information_set:
+                weights = MaximumSharpeStrategy.optimize_batch(mu_excess[None], information_set['covariance_matrix'][None])[0]
+            else:
+                # factor model, solved with the Woodbury identity
+                n = len(mu)
+                ones = np.ones(n)
+                inv_Sigma_mu = solve_covariance(information_set, mu_excess)
+                weights = inv_Sigma_mu / (ones.T @ inv_Sigma_mu)
+            return _to_portfolio(weights, information_set['companies'])
         except Exception as e:
             logging.warning("Error computing Maximum Sharpe Portfolio, returning equal weight portfolio")
             logging.warning(e)
             return {k: 1/len(information_set['companies']) for k in information_set['companies']}
+
+    @staticmethod
+    def optimize_batch(expected_return=None, covariance_matrix=None, risk_free_rate=0.0):
+        """ Batched closed form: w = Σ⁻¹(μ - rf) / (1ᵀΣ⁻¹(μ - rf)) for every date """
+        return _normalize_rows(_solve_batch(covariance_matrix, expected_return - risk_free_rate))
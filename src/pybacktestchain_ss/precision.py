@@ -0,0 +1,188 @@
+import dataclasses
+import logging
+import re
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+# share of the memory budget the stored data may take before it is kept in single precision
+DATA_SHARE = 0.5
+# share of what the data leaves that one chunk of dates (or of bars) may take
+CHUNK_SHARE = 0.25
+# share of what the data leaves that the information sets of an information cache may take
+CACHE_SHARE = 0.5
+
+# the plan only ever shrinks the chunks below the defaults of the Backtest
+MAX_STRATEGY_BATCH = 64
+MIN_BAR_CHUNK, MAX_BAR_CHUNK = 256, 65536
+
+UNITS = {'': 1, 'b': 1, 'k': 10**3, 'kb': 10**3, 'm': 10**6, 'mb': 10**6, 'g': 10**9, 'gb': 10**9,
+         't': 10**12, 'tb': 10**12, 'kib': 2**10, 'mib': 2**20, 'gib': 2**30, 'tib': 2**40}
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass(frozen=True)
+class PrecisionPolicy:
+    """ Dtypes of the stored arrays and of the computations on them
+
+    The storage dtype is the one of the price and volume columns of a DataModule, of its bar panels and
+    of the moments kept in the information sets. Returns, means, covariances and the solves of the
+    strategies are computed in the compute dtype, from a float64 copy of the window they need.
+
+    Example:
+        DataModule(df, precision=MIXED_PRECISION)
+    """
+    storage: str = 'float64'
+    compute: str = 'float64'
+
+    def store(self, array):
+        return np.asarray(array).astype(self.storage, copy=False)
+
+    def accumulate(self, array):
+        return np.asarray(array, dtype=self.compute)
+
+    @property
+    def itemsize(self):
+        return np.dtype(self.storage).itemsize
+
+FULL_PRECISION = PrecisionPolicy()
+MIXED_PRECISION = PrecisionPolicy('float32', 'float64') # half the memory, float64 sums
+
+@dataclass
+class MemoryPlan:
+    """ Precision and chunk sizes fitting a backtest in a memory budget, see plan_memory """
+    budget: int
+    precision: PrecisionPolicy
+    strategy_batch_size: int # dates whose portfolios are optimized at once
+    bar_chunk_size: int # bars processed at once on a bar timeline
+    cache_moments: bool # whether the information sets of every date fit in an information cache
+    data_bytes: int # estimated size of the stored data at that precision
+
+@dataclass
+class AccuracyReport:
+    """ A backtest at reduced precision against the same backtest at full precision """
+    weights: pd.DataFrame # per rebalancing date: largest and mean absolute difference of the weights
+    equity: pd.DataFrame # Date, the portfolio value at both precisions and their relative difference
+    data_bytes: tuple # (full, reduced) bytes of the price data
+
+    def summary(self):
+        """The worst differences of the run, as a Series"""
+        full, reduced = self.equity['Full'].to_numpy(), self.equity['Reduced'].to_numpy()
+        returns = np.diff(reduced) / reduced[:-1] - np.diff(full) / full[:-1] if len(full) > 1 else np.zeros(0)
+        return pd.Series({
+            'max_weight_diff': self.weights['max_abs_diff'].max() if len(self.weights) else 0.0,
+            'mean_weight_diff': self.weights['mean_abs_diff'].mean() if len(self.weights) else 0.0,
+            'max_equity_rel_diff': self.equity['rel_diff'].abs().max() if len(self.equity) else 0.0,
+            'final_value_rel_diff': self.equity['rel_diff'].iloc[-1] if len(self.equity) else 0.0,
+            'tracking_error': float(np.std(returns) * np.sqrt(252)) if len(returns) else 0.0,
+            'data_bytes_full': self.data_bytes[0],
+            'data_bytes_reduced': self.data_bytes[1],
+        })
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def precision_policy(spec: Union[PrecisionPolicy, str, None]):
+    """precision_policy turns 'float64', 'float32' (float32 storage, float64 compute) or a policy into a policy"""
+    if spec is None or isinstance(spec, PrecisionPolicy):
+        return spec
+    policies = {'float64': FULL_PRECISION, 'full': FULL_PRECISION, 'float32': MIXED_PRECISION, 'mixed': MIXED_PRECISION}
+    if str(spec).lower() not in policies:
+        raise ValueError(f"Unknown precision {spec}, use 'float64' or 'float32'")
+    return policies[str(spec).lower()]
+
+def parse_bytes(size: Union[int, float, str]):
+    """parse_bytes reads a memory size, a number of bytes or a string like '512MB' or '2GiB'"""
+    if isinstance(size, (int, float, np.integer, np.floating)):
+        return int(size)
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([a-zA-Z]*)\s*', str(size))
+    if match is None or match.group(2).lower() not in UNITS:
+        raise ValueError(f"Cannot read the memory size {size!r}, use e.g. 512MB or 2GiB")
+    return int(float(match.group(1)) * UNITS[match.group(2).lower()])
+
+def plan_memory(budget: Union[int, str], n_rows: int, n_columns: int, n_tickers: int, n_times: int,
+                precision: Optional[PrecisionPolicy] = None):
+    """plan_memory picks the precision and the chunk sizes of a backtest for a memory budget
+
+    The data is the long price columns plus a times × tickers bar panel. It is kept in full precision
+    if it takes at most half the budget, in single precision otherwise (unless a precision is given).
+    The chunks share what the data leaves: a chunk of dates stacks an N×N covariance and its
+    factorization per date, a chunk of bars a few times × tickers arrays.
+
+    Args:
+        budget (int | str): Bytes, or a size like '2GB'
+        n_rows (int): Rows of the long-format price data
+        n_columns (int): Numeric columns read by the backtest (prices, volumes)
+        n_tickers (int): Tickers of the data
+        n_times (int): Distinct dates (or bars) of the data
+
+    Example:
+        plan = plan_memory('1GB', len(df), 2, df['ticker'].nunique(), df['Date'].nunique())
+    """
+    budget = parse_bytes(budget)
+    data_bytes = lambda itemsize: (n_rows * n_columns + n_times * n_tickers) * itemsize
+    if precision is None:
+        precision = FULL_PRECISION if data_bytes(8) <= budget * DATA_SHARE else MIXED_PRECISION
+    stored = data_bytes(precision.itemsize)
+    if stored > budget:
+        logging.warning(f"The price data alone takes {stored} bytes, more than the memory budget of {budget} bytes")
+    free = max(budget - stored, 0)
+    compute = np.dtype(precision.compute).itemsize
+    per_date = 2 * n_tickers * (n_tickers + 1) * compute
+    per_bar = 4 * n_tickers * compute
+    return MemoryPlan(
+        budget=budget,
+        precision=precision,
+        strategy_batch_size=int(np.clip(free * CHUNK_SHARE // max(per_date, 1), 1, MAX_STRATEGY_BATCH)),
+        bar_chunk_size=int(np.clip(free * CHUNK_SHARE // max(per_bar, 1), MIN_BAR_CHUNK, MAX_BAR_CHUNK)),
+        cache_moments=n_times * n_tickers * (n_tickers + 1) * precision.itemsize <= free * CACHE_SHARE,
+        data_bytes=stored,
+    )
+
+def accuracy_report(backtest, precision: Union[PrecisionPolicy, str] = MIXED_PRECISION):
+    """accuracy_report runs a backtest at full and at reduced precision and compares them
+
+    The backtest is copied twice, without persistence, on the same loaded data. The weights are
+    compared at each rebalancing date, and the equity curves at each date.
+
+    Example:
+        accuracy_report(Backtest(initial_date, final_date, universe=tickers), 'float32').summary()
+    """
+    precision = precision_policy(precision)
+    if backtest.data_module is None:
+        backtest.data_module = backtest.load_data()
+    runs = {}
+    for label, policy in (('Full', FULL_PRECISION), ('Reduced', precision)):
+        copy = dataclasses.replace(backtest, precision=policy, memory_budget=None, persist=False, use_cache=False,
+                                   verbose=False, information_cache=None, checkpoint_interval=None,
+                                   data_module=backtest.data_module.with_precision(policy))
+        values, _, _ = copy.run_backtest()
+        runs[label] = copy, values.set_index('Date')['Portfolio value']
+    equity = pd.concat([runs['Full'][1].rename('Full'), runs['Reduced'][1].rename('Reduced')], axis=1)
+    equity['rel_diff'] = equity['Reduced'] / equity['Full'] - 1
+    # the portfolios of both precisions at the rebalancing dates
+    dates = [t for t in pd.date_range(backtest.initial_date, backtest.final_date, freq='D')
+             if t == backtest.initial_date or backtest.rebalance_flag().time_to_rebalance(t)]
+    portfolios = {}
+    for label, (copy, _) in runs.items():
+        info = copy.create_information(copy.data_module)
+        portfolios[label] = info.compute_portfolios([info.compute_information(t) for t in dates])
+    rows = []
+    for t, full, reduced in zip(dates, portfolios['Full'], portfolios['Reduced']):
+        tickers = sorted(set(full) | set(reduced))
+        diff = np.abs(np.array([reduced.get(k, 0.0) for k in tickers], dtype=float)
+                      - np.array([full.get(k, 0.0) for k in tickers], dtype=float))
+        rows.append({'Date': t, 'max_abs_diff': diff.max() if len(diff) else 0.0,
+                     'mean_abs_diff': diff.mean() if len(diff) else 0.0})
+    weights = pd.DataFrame(rows, columns=['Date', 'max_abs_diff', 'mean_abs_diff'])
+    data_bytes = tuple(copy.data_module.memory_usage() for copy, _ in runs.values())
+    return AccuracyReport(weights, equity.reset_index(), data_bytes)
@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _field_file(name: str):
+    """File name of a field, e.g. 'Adj Close' -> 'Adj_Close.npy'"""
+    return re.sub(r'[^0-9A-Za-z]+', '_', name) + '.npy'
+
+def _to_utc_ns(dates):
+    """Converts dates to int64 nanoseconds since the epoch in UTC, naive dates are taken as UTC"""
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    if dates.tz is not None:
+        dates = dates.tz_convert('UTC').tz_localize(None)
+    return dates.as_unit('ns').asi8
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class PriceStore:
+    """ On-disk price store: one memory-mapped dates × tickers array per field, plus a small metadata index
+
+    Opening a store reads only the metadata. The arrays are memory-mapped on first use, so that only the
+    pages of the requested fields and dates are read, and processes opening the same store share them
+    through the page cache.
+
+    Example:
+        store = PriceStore.write(get_stocks_data(tickers, '2000-01-01', '2020-12-31'), 'prices')
+        df = PriceStore('prices').window('2019-01-01', '2020-01-01', fields=['Adj Close'])
+    """
+    path: str
+    meta: dict = field(init=False, repr=False)
+    _arrays: dict = field(init=False, default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.dates = np.load(os.path.join(self.path, 'dates.npy'))
+        self.tickers = np.array(self.meta['tickers'])
+        self._ticker_index = {ticker: i for i, ticker in enumerate(self.meta['tickers'])}
+
+    @classmethod
+    def write(cls, df: pd.DataFrame, path: str, fields: list = None, dtype: str = 'float32',
+              time_column: str = 'Date', company_column: str = 'ticker'):
+        """Writes a long-format price DataFrame (like the output of get_stocks_data) to a store
+
+        Args:
+            df (pd.DataFrame): One row per date and ticker
+            path (str): Folder of the store
+            fields (list): Columns to store, all the numeric ones by default
+            dtype (str): 'float32' or 'float64'
+        """
+        if fields is None:
+            fields = [c for c in df.columns if c not in (time_column, company_column) and pd.api.types.is_numeric_dtype(df[c])]
+        os.makedirs(path, exist_ok=True)
+        times = pd.to_datetime(df[time_column])
+        tz = str(times.dt.tz) if times.dt.tz is not None else None
+        keys = pd.Series(_to_utc_ns(times), index=df.index)
+        dates = np.unique(keys.to_numpy())
+        tickers = sorted(df[company_column].unique())
+        rows = np.searchsorted(dates, keys.to_numpy())
+        columns = pd.Index(tickers).get_indexer(df[company_column])
+        for name in fields:
+            array = np.lib.format.open_memmap(os.path.join(path, _field_file(name)), mode='w+',
+                                              dtype=dtype, shape=(len(dates), len(tickers)))
+            array[:] = np.nan
+            array[rows, columns] = df[name].to_numpy(dtype=dtype)
+            array.flush()
+            del array
+        np.save(os.path.join(path, 'dates.npy'), dates)
+        meta = {'tickers': tickers, 'fields': {name: _field_file(name) for name in fields}, 'dtype': dtype,
+                'tz': tz, 'time_column': time_column, 'company_column': company_column}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return cls(path)
+
+    @property
+    def fields(self):
+        return list(self.meta['fields'])
+
+    def array(self, name: str):
+        """Returns the memory-mapped dates × tickers array of a field (nothing is read until it is sliced)"""
+        if name not in self._arrays:
+            if name not in self.meta['fields']:
+                raise KeyError(f"Field {name} is not in the price store, available fields: {self.fields}")
+            self._arrays[name] = np.load(os.path.join(self.path, self.meta['fields'][name]), mmap_mode='r')
+        return self._arrays[name]
+
+    def date_range(self, start=None, end=None):
+        """Returns the slice of rows with start <= date < end"""
+        lo = 0 if start is None else np.searchsorted(self.dates, _to_utc_ns([start])[0], side='left')
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates, _to_utc_ns([end])[0], side='left')
+        return slice(lo, hi)
+
+    def ticker_positions(self, tickers: list = None, strict: bool = True):
+        """Columns of the tickers, missing tickers raise a KeyError, or are logged and skipped if not strict"""
+        if tickers is None:
+            return np.arange(len(self.tickers))
+        missing = [t for t in tickers if t not in self._ticker_index]
+        if missing and strict:
+            raise KeyError(f"Tickers not in the price store: {missing}")
+        if missing:
+            logging.warning(f"Tickers not in the price store, skipped: {missing}")
+        return np.array([self._ticker_index[t] for t in tickers if t in self._ticker_index], dtype=int)
+
+    def window(self, start=None, end=None, fields: list = None, tickers: list = None, strict: bool = True):
+        """window reads the given fields between start (included) and end (excluded) as a long DataFrame
+
+        The result has the same layout as get_stocks_data, rows where all the fields are missing are dropped.
+        With strict=False the tickers missing from the store are skipped, like the download skips the
+        tickers it cannot find.
+        """
+        fields = fields or self.fields
+        rows = self.date_range(start, end)
+        columns = self.ticker_positions(tickers, strict)
+        dates = pd.DatetimeIndex(self.dates[rows]).tz_localize('UTC')
+        if self.meta['tz'] is not None:
+            dates = dates.tz_convert(self.meta['tz'])
+        else:
+            dates = dates.tz_localize(None)
+        n_dates, n_tickers = len(dates), len(columns)
+        data = {
+            self.meta['time_column']: np.repeat(dates, n_tickers),
+            self.meta['company_column']: np.tile(self.tickers[columns], n_dates),
+        }
+        for name in fields:
+            data[name] = np.asarray(self.array(name)[rows][:, columns]).ravel()
+        df = pd.DataFrame(data)
+        return df[df[fields].notna().any(axis=1)].reset_index(drop=True)
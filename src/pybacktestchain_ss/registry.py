@@ -0,0 +1,302 @@
+import argparse
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass
+
+import pandas as pd
+from pybacktestchain_ss.results_io import results_files, writer_for_path
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+DEFAULT_REGISTRY_PATH = 'backtests/registry.sqlite'
+
+RUN_COLUMNS = ['name', 'strategy', 'information_class', 'initial_date', 'final_date', 'initial_cash',
+               'final_value', 'rebalance_flag', 'risk_model', 'risk_threshold', 'lookback_days',
+               'params', 'file', 'blockchain', 'block_hash', 'created', 'run_id']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    strategy TEXT,
+    information_class TEXT,
+    initial_date TEXT,
+    final_date TEXT,
+    initial_cash REAL,
+    final_value REAL,
+    rebalance_flag TEXT,
+    risk_model TEXT,
+    risk_threshold REAL,
+    lookback_days REAL,
+    params TEXT,
+    file TEXT,
+    blockchain TEXT,
+    block_hash TEXT,
+    created REAL,
+    run_id TEXT
+);
+CREATE TABLE IF NOT EXISTS universe (
+    name TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    PRIMARY KEY (name, ticker)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_strategy ON runs (strategy);
+CREATE INDEX IF NOT EXISTS idx_runs_dates ON runs (initial_date, final_date);
+CREATE INDEX IF NOT EXISTS idx_universe_ticker ON universe (ticker);
+"""
+
+# columns added after the first version of the schema, with their type
+MIGRATIONS = [('run_id', 'TEXT')]
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _name_of(obj):
+    """Returns a readable name for a class, an instance or None"""
+    if obj is None:
+        return None
+    if isinstance(obj, type):
+        return obj.__name__
+    return type(obj).__name__
+
+def _to_iso(date):
+    """Converts a date-like object to 'YYYY-MM-DD' so that dates compare as strings"""
+    if date is None:
+        return None
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class BacktestRegistry:
+    """ Local SQLite index of the backtests, queryable without reading the csv files or the blockchain """
+    path: str = DEFAULT_REGISTRY_PATH
+
+    def __post_init__(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+            for column, kind in MIGRATIONS:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE runs ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_run_id ON runs (run_id)")
+
+    def _connect(self):
+        # short-lived connections so that the registry can be shared by threads and processes
+        return sqlite3.connect(self.path, timeout=30)
+
+    def register(self, name: str, universe: list = None, **run):
+        """Adds (or replaces) a run in the registry.
+
+        Args:
+            name (str): The backtest name
+            universe (list): Tickers of the investment universe
+            **run: Any of the other RUN_COLUMNS, e.g. strategy, initial_date, final_value, block_hash
+
+        Example:
+            registry.register('RedFoxCarpenter', ['AAPL'], strategy='MinimumVarianceStrategy')
+        """
+        unknown = set(run) - set(RUN_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown registry columns: {sorted(unknown)}")
+        row = {column: None for column in RUN_COLUMNS}
+        row.update(run)
+        row['name'] = name
+        row['initial_date'] = _to_iso(row['initial_date'])
+        row['final_date'] = _to_iso(row['final_date'])
+        if isinstance(row['params'], dict):
+            row['params'] = json.dumps(row['params'], default=str, sort_keys=True)
+        if row['created'] is None:
+            row['created'] = time.time()
+        placeholders = ', '.join('?' for _ in RUN_COLUMNS)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"INSERT OR REPLACE INTO runs ({', '.join(RUN_COLUMNS)}) VALUES ({placeholders})",
+                         [row[column] for column in RUN_COLUMNS])
+            conn.execute("DELETE FROM universe WHERE name = ?", (name,))
+            conn.executemany("INSERT OR IGNORE INTO universe (name, ticker) VALUES (?, ?)",
+                             [(name, ticker) for ticker in (universe or [])])
+
+    def register_backtest(self, backtest, final_value: float = None, file: str = None, block_hash: str = None):
+        """Registers a Backtest instance after it has been run"""
+        params = {
+            'universe': list(backtest.universe),
+            'portfolio_strategy': _name_of(backtest.portfolio_strategy),
+            'information_class': _name_of(backtest.information_class),
+            'rebalance_flag': _name_of(backtest.rebalance_flag),
+            'risk_model': _name_of(backtest.risk_model),
+            'risk_threshold': backtest.risk_threshold,
+            's': backtest.s.total_seconds() / 86400,
+            'time_column': backtest.time_column,
+            'company_column': backtest.company_column,
+            'adj_close_column': backtest.adj_close_column,
+            'initial_cash': backtest.initial_cash,
+        }
+        self.register(backtest.backtest_name, list(backtest.universe),
+                      strategy=params['portfolio_strategy'],
+                      information_class=params['information_class'],
+                      initial_date=backtest.initial_date,
+                      final_date=backtest.final_date,
+                      initial_cash=backtest.initial_cash,
+                      final_value=final_value,
+                      rebalance_flag=params['rebalance_flag'],
+                      risk_model=params['risk_model'],
+                      risk_threshold=backtest.risk_threshold,
+                      lookback_days=params['s'],
+                      params=params,
+                      file=file,
+                      blockchain=backtest.name_blockchain,
+                      block_hash=block_hash,
+                      run_id=getattr(backtest, 'run_id', None))
+
+    def query(self, strategy: str = None, ticker: str = None, since=None, until=None,
+              blockchain: str = None, limit: int = None):
+        """Finds the runs matching all the given criteria.
+
+        Args:
+            strategy (str): Strategy name or prefix, e.g. 'MinimumVariance'
+            ticker (str): A ticker that must be part of the universe
+            since: Runs starting on or after this date
+            until: Runs ending on or before this date
+            blockchain (str): Name of the blockchain the run was stored in
+            limit (int): Maximum number of rows
+
+        Returns:
+            pd.DataFrame: One row per run, most recent first
+
+        Example:
+            registry.query(strategy='MinimumVariance', ticker='AAPL', since='2019-01-01')
+        """
+        clauses, args = [], []
+        if strategy is not None:
+            clauses.append("runs.strategy LIKE ?")
+            args.append(f"{strategy}%")
+        if ticker is not None:
+            clauses.append("runs.name IN (SELECT name FROM universe WHERE ticker = ?)")
+            args.append(ticker)
+        if since is not None:
+            clauses.append("runs.initial_date >= ?")
+            args.append(_to_iso(since))
+        if until is not None:
+            clauses.append("runs.final_date <= ?")
+            args.append(_to_iso(until))
+        if blockchain is not None:
+            clauses.append("runs.blockchain = ?")
+            args.append(blockchain)
+        sql = f"SELECT {', '.join(RUN_COLUMNS)} FROM runs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY runs.created DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=args)
+
+    def get(self, name: str):
+        """Returns the registry row of a run as a dict (None if unknown), with its universe"""
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            tickers = [r[0] for r in conn.execute("SELECT ticker FROM universe WHERE name = ? ORDER BY ticker", (name,))]
+        run = dict(row)
+        run['universe'] = tickers
+        return run
+
+    def find_run(self, run_id: str):
+        """Returns the registry row of the run with the given identity (the most recent one), None if unknown"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT name FROM runs WHERE run_id = ? ORDER BY created DESC LIMIT 1", (run_id,)).fetchone()
+        return None if row is None else self.get(row[0])
+
+    def backfill(self, backtests_dir: str = 'backtests', blockchain_dir: str = 'blockchain'):
+        """Indexes the existing transaction logs and blockchain blocks, returns the number of runs indexed.
+
+        Only what can be recovered from the artifacts is filled in: the date range and the tickers
+        come from the transaction log, the hash from the block. Runs already in the registry are kept.
+        """
+        blocks = {}
+        if os.path.isdir(blockchain_dir):
+            for file in sorted(os.listdir(blockchain_dir)):
+                if not file.endswith('.pkl'):
+                    continue
+                try:
+                    with open(os.path.join(blockchain_dir, file), 'rb') as f:
+                        chain = pickle.load(f)
+                    # the headers of the archived blocks too, if the chain was compacted
+                    headers = chain.headers(blockchain_dir)
+                except Exception as e:
+                    logging.warning(f"Could not load blockchain {file}: {e}")
+                    continue
+                for header in headers[1:]:
+                    blocks[header.name_backtest] = (chain.name, header.hash, header.timestamp)
+
+        with closing(self._connect()) as conn:
+            known = {r[0] for r in conn.execute("SELECT name FROM runs")}
+
+        count = 0
+        files = results_files(backtests_dir) if os.path.isdir(backtests_dir) else []
+        for file in files:
+            name = os.path.splitext(os.path.basename(file))[0]
+            if name in known:
+                continue
+            known.add(name)
+            log = writer_for_path(file).read(file)
+            chain_name, block_hash, created = blocks.pop(name, (None, None, None))
+            self.register(name, sorted(log['Ticker'].dropna().astype(str).unique()) if 'Ticker' in log else [],
+                          initial_date=log['Date'].min() if len(log) else None,
+                          final_date=log['Date'].max() if len(log) else None,
+                          file=file,
+                          blockchain=chain_name, block_hash=block_hash, created=created)
+            count += 1
+        # blocks whose csv file is gone are still worth indexing
+        for name, (chain_name, block_hash, created) in blocks.items():
+            if name in known:
+                continue
+            self.register(name, blockchain=chain_name, block_hash=block_hash, created=created)
+            count += 1
+        logging.info(f"Backfilled {count} runs into {self.path}")
+        return count
+
+#---------------------------------------------------------
+# Command line
+#---------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pybacktestchain_ss.registry',
+                                     description='Index and query the stored backtests')
+    parser.add_argument('--db', default=DEFAULT_REGISTRY_PATH, help='Path of the registry database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfill = commands.add_parser('backfill', help='Index the existing backtests/ and blockchain/ artifacts')
+    backfill.add_argument('--backtests', default='backtests')
+    backfill.add_argument('--blockchain', default='blockchain')
+    query = commands.add_parser('query', help='List the runs matching the given criteria')
+    query.add_argument('--strategy')
+    query.add_argument('--ticker')
+    query.add_argument('--since')
+    query.add_argument('--until')
+    query.add_argument('--limit', type=int)
+    args = parser.parse_args(argv)
+
+    registry = BacktestRegistry(args.db)
+    if args.command == 'backfill':
+        print(registry.backfill(args.backtests, args.blockchain))
+    else:
+        runs = registry.query(strategy=args.strategy, ticker=args.ticker, since=args.since,
+                              until=args.until, limit=args.limit)
+        print(runs.drop(columns=['params']).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import importlib
+import os
+
+import pandas as pd
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+CATEGORICAL_COLUMNS = ['Action', 'Ticker']
+INTEGER_COLUMNS = ['Quantity']
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _require_pyarrow(module: str = 'pyarrow'):
+    """Imports pyarrow (or one of its submodules), which is only needed for the binary formats"""
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise ImportError("The parquet and feather formats require pyarrow, install the parquet extra with `pip install pybacktestchain_ss[parquet]`") from e
+
+def normalize_transaction_log(df: pd.DataFrame):
+    """normalize_transaction_log gives the transaction log typed columns
+
+    The broker builds the log row by row, which leaves object columns behind. Dates become datetime64,
+    Action and Ticker become categoricals (dictionary-encoded on disk) and the numbers get numeric dtypes.
+    """
+    df = df.reset_index(drop=True).copy()
+    for column in df.columns:
+        if column == 'Date':
+            df[column] = pd.to_datetime(df[column])
+        elif column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif column in INTEGER_COLUMNS:
+            df[column] = pd.to_numeric(df[column]).astype('int64')
+        elif df[column].dtype == object:
+            try:
+                df[column] = pd.to_numeric(df[column])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+class ResultsWriter(ABC):
+    """ Abstract base class for the formats the transaction logs are stored in """
+    extension: str = ''
+
+    def path(self, name: str, directory: str = 'backtests'):
+        return os.path.join(directory, f"{name}{self.extension}")
+
+    @abstractmethod
+    def write(self, df: pd.DataFrame, name: str, directory: str = 'backtests') -> str:
+        pass
+
+    @abstractmethod
+    def read(self, path: str, columns: list = None) -> pd.DataFrame:
+        pass
+
+@dataclass
+class CSVResultsWriter(ResultsWriter):
+    """ The original text format, kept for compatibility (the pandas index is written too) """
+    extension: str = '.csv'
+
+    def write(self, df: pd.DataFrame, name: str, directory: str = 'backtests'):
+        path = self.path(name, directory)
+        df.to_csv(path)
+        return path
+
+    def read(self, path: str, columns: list = None):
+        df = pd.read_csv(path, index_col=0)
+        return df[columns] if columns is not None else df
+
+@dataclass
+class ParquetResultsWriter(ResultsWriter):
+    """ Compressed columnar format, best for archiving many runs """
+    extension: str = '.parquet'
+    compression: str = 'zstd'
+
+    def write(self, df: pd.DataFrame, name: str, directory: str = 'backtests'):
+        _require_pyarrow()
+        path = self.path(name, directory)
+        normalize_transaction_log(df).to_parquet(path, index=False, compression=self.compression)
+        return path
+
+    def read(self, path: str, columns: list = None):
+        pq = _require_pyarrow('pyarrow.parquet')
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+@dataclass
+class FeatherResultsWriter(ResultsWriter):
+    """ Arrow IPC format, fastest to read back. With compression='uncompressed' reads are zero-copy memory maps """
+    extension: str = '.feather'
+    compression: str = 'lz4'
+
+    def write(self, df: pd.DataFrame, name: str, directory: str = 'backtests'):
+        _require_pyarrow()
+        path = self.path(name, directory)
+        normalize_transaction_log(df).to_feather(path, compression=self.compression)
+        return path
+
+    def read(self, path: str, columns: list = None):
+        feather = _require_pyarrow('pyarrow.feather')
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+RESULTS_WRITERS = {
+    'csv': CSVResultsWriter,
+    'parquet': ParquetResultsWriter,
+    'feather': FeatherResultsWriter,
+}
+
+def get_results_writer(fmt):
+    """Returns a ResultsWriter from a format name ('csv', 'parquet' or 'feather') or a writer instance"""
+    if isinstance(fmt, ResultsWriter):
+        return fmt
+    try:
+        return RESULTS_WRITERS[fmt]()
+    except KeyError:
+        raise ValueError(f"Unknown results format {fmt}, choose from {list(RESULTS_WRITERS)}")
+
+def writer_for_path(path: str):
+    """Returns the ResultsWriter able to read the given file, based on its extension"""
+    extension = os.path.splitext(path)[1]
+    for writer in RESULTS_WRITERS.values():
+        if writer.extension == extension:
+            return writer()
+    raise ValueError(f"No results writer for {path}")
+
+def results_files(directory: str = 'backtests', names: list = None, fmt: str = None):
+    """Lists the stored transaction logs, optionally restricted to some backtest names and one format"""
+    extensions = [RESULTS_WRITERS[fmt].extension] if fmt is not None else [w.extension for w in RESULTS_WRITERS.values()]
+    files = []
+    for file in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file)
+        if extension in extensions and (names is None or name in names):
+            files.append(os.path.join(directory, file))
+    return files
+
+def load_backtests(names: list = None, directory: str = 'backtests', fmt: str = None, columns: list = None, lazy: bool = False):
+    """load_backtests reads many transaction logs at once
+
+    Args:
+        names (list): Backtest names to load, all of them if None
+        directory (str): Folder of the stored results
+        fmt (str): Only load files of this format ('csv', 'parquet' or 'feather')
+        columns (list): Only read these columns
+        lazy (bool): Return a pyarrow dataset that is scanned on demand instead of a DataFrame (binary formats only)
+
+    Returns:
+        pd.DataFrame: The concatenated logs with a 'Backtest' column, or a pyarrow.dataset.Dataset if lazy
+
+    Example:
+        logs = load_backtests(fmt='parquet', columns=['Date', 'Ticker', 'Quantity'])
+    """
+    files = results_files(directory, names, fmt)
+    if lazy:
+        if fmt not in ('parquet', 'feather'):
+            raise ValueError("Lazy scanning needs fmt='parquet' or fmt='feather'")
+        ds = _require_pyarrow('pyarrow.dataset')
+        return ds.dataset(files, format='parquet' if fmt == 'parquet' else 'ipc')
+    dfs = []
+    for path in files:
+        df = writer_for_path(path).read(path, columns)
+        df['Backtest'] = os.path.splitext(os.path.basename(path))[0]
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=(columns or []) + ['Backtest'])
+    data = pd.concat(dfs, ignore_index=True)
+    data['Backtest'] = data['Backtest'].astype('category')
+    return data
@@ -0,0 +1,132 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.blockchain import _write_atomic
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+DEFAULT_CACHE_DIR = 'backtests/runs'
+
+# fields of a Backtest that do not change its results
+NON_RESULT_FIELDS = {'verbose', 'progress_callback', 'progress_interval', 'data_module', 'price_store',
+                     'information_cache', 'persist', 'registry_path', 'results_format', 'strategy_batch_size',
+                     'name_blockchain', 'use_cache', 'cache_dir', 'broker', 'bar_chunk_size', 'checkpoint_interval',
+                     'checkpoint_dir'}
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _package_version():
+    try:
+        return metadata.version('pybacktestchain_ss')
+    except metadata.PackageNotFoundError:
+        return None
+
+def canonical(obj):
+    """canonical turns a configuration value into plain JSON types, the same way on every machine
+
+    Classes are named by their full path, dataclass instances by their class and fields, dates in ISO format
+    and timedeltas in seconds.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, type):
+        return f"{obj.__module__}.{obj.__qualname__}"
+    if isinstance(obj, (datetime, date, pd.Timestamp)):
+        return pd.Timestamp(obj).isoformat()
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, dict):
+        return {str(key): canonical(value) for key, value in sorted(obj.items(), key=lambda item: str(item[0]))}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [canonical(value) for value in obj]
+    if dataclasses.is_dataclass(obj):
+        fields = {f.name: canonical(getattr(obj, f.name)) for f in dataclasses.fields(obj)}
+        return {'class': canonical(type(obj)), 'fields': fields}
+    if callable(obj) and hasattr(obj, '__qualname__'):
+        return f"{obj.__module__}.{obj.__qualname__}"
+    raise TypeError(f"Cannot canonicalize {type(obj).__name__} for the run identity")
+
+def backtest_config(backtest):
+    """Returns the configuration of a Backtest that determines its results, as plain JSON types"""
+    config = {f.name: canonical(getattr(backtest, f.name)) for f in dataclasses.fields(backtest)
+              if f.name not in NON_RESULT_FIELDS}
+    config['version'] = _package_version()
+    return config
+
+def data_fingerprint(df: pd.DataFrame, columns: list = None):
+    """data_fingerprint hashes the content of the price data (values, column names and dtypes)
+
+    Args:
+        df (pd.DataFrame): The price data
+        columns (list): Only hash these columns (the ones the backtest reads), all of them if None
+    """
+    if columns is not None:
+        df = df[[column for column in columns if column in df.columns]]
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(c), str(t)] for c, t in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def run_identity(config: dict, fingerprint: str):
+    """run_identity is the deterministic id of a run: the hash of its configuration and of its data
+
+    Example:
+        run_id = run_identity(backtest_config(backtest), data_fingerprint(data))
+    """
+    payload = json.dumps({'config': config, 'data': fingerprint}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class CachedRun:
+    run_id: str
+    name: str
+    final_value: float
+    portfolio_values: pd.DataFrame
+    initial_portfolio: dict
+    final_portfolio: dict
+    broker_state: dict # cash, positions, entry_prices and transaction_log of the broker at the end of the run
+
+@dataclass
+class RunCache:
+    """ Completed runs by run identity, one pickle per run in backtests/runs """
+    directory: str = DEFAULT_CACHE_DIR
+
+    def path(self, run_id: str):
+        return os.path.join(self.directory, f"{run_id}.pkl")
+
+    def load(self, run_id: str):
+        """Returns the CachedRun of run_id, None if it was never completed"""
+        path = self.path(run_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Could not read the cached run {run_id}: {e}")
+            return None
+
+    def save(self, run: CachedRun):
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(run, self.path(run.run_id))
+        return self.path(run.run_id)
@@ -0,0 +1,488 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+
+from pybacktestchain_ss import broker, data_module, portfolio_strategies, transaction_costs
+from pybacktestchain_ss.broker import Backtest, RebalanceFlag, RiskModel
+from pybacktestchain_ss.data_module import DataModule, Information
+from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy
+from pybacktestchain_ss.registry import BacktestRegistry, DEFAULT_REGISTRY_PATH
+from pybacktestchain_ss.results_io import results_files, writer_for_path
+from pybacktestchain_ss.run_cache import backtest_config
+from pybacktestchain_ss.transaction_costs import CompositeCost, CostModel
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# fields of a request, the other Backtest fields are owned by the service
+REQUEST_FIELDS = {'initial_date', 'final_date', 'universe', 'portfolio_strategy', 'information_class', 's',
+                  'time_column', 'company_column', 'adj_close_column', 'rebalance_flag', 'risk_model',
+                  'risk_threshold', 'initial_cash', 'name_blockchain', 'results_format', 'cost_model', 'use_cache',
+                  'precision', 'memory_budget'}
+
+# request fields naming a class, with the module it is looked up in and the base class it must extend
+CLASS_FIELDS = {
+    'portfolio_strategy': (portfolio_strategies, PortfolioStrategy),
+    'information_class': (data_module, Information),
+    'rebalance_flag': (broker, RebalanceFlag),
+    'risk_model': (broker, RiskModel),
+}
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _resolve_class(name: str, module, base: type):
+    obj = getattr(module, str(name), None)
+    if not (isinstance(obj, type) and issubclass(obj, base)):
+        raise ValueError(f"Unknown {base.__name__} {name}")
+    return obj
+
+def _cost_model(spec):
+    """Builds a cost model from {'model': 'FixedBps', 'bps': 5} or from a list of such dicts"""
+    if isinstance(spec, list):
+        return CompositeCost([_cost_model(s) for s in spec])
+    params = dict(spec)
+    model = _resolve_class(params.pop('model', None), transaction_costs, CostModel)
+    return model(**params)
+
+def backtest_from_request(request: dict, **overrides):
+    """backtest_from_request builds a Backtest from a JSON request
+
+    Classes are given by name, dates as ISO strings and the lookback s in days.
+
+    Example:
+        backtest_from_request({'initial_date': '2019-01-01', 'final_date': '2020-01-01',
+                               'portfolio_strategy': 'MinimumVarianceStrategy', 'cost_model': {'model': 'FixedBps', 'bps': 5}})
+    """
+    unknown = set(request) - REQUEST_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown request fields: {sorted(unknown)}")
+    for required in ('initial_date', 'final_date'):
+        if required not in request:
+            raise ValueError(f"Missing request field {required}")
+    params = dict(request)
+    params['initial_date'] = pd.Timestamp(params['initial_date']).to_pydatetime()
+    params['final_date'] = pd.Timestamp(params['final_date']).to_pydatetime()
+    if 's' in params:
+        params['s'] = timedelta(days=params['s'])
+    for name, (module, base) in CLASS_FIELDS.items():
+        if params.get(name) is not None:
+            params[name] = _resolve_class(params[name], module, base)
+    if params.get('cost_model') is not None:
+        params['cost_model'] = _cost_model(params['cost_model'])
+    params.update(overrides)
+    return Backtest(**params)
+
+def request_key(backtest: Backtest):
+    """Identical requests, however they are written, have the same key"""
+    config = json.dumps(backtest_config(backtest), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(config.encode()).hexdigest()
+
+def _weights(portfolio: dict):
+    return {str(k): float(v) for k, v in (portfolio or {}).items()}
+
+def run_request(request: dict, progress: Callable = None, data_source: Callable = None):
+    """run_request is the default job runner: it runs the backtest of a request and returns its results as JSON types
+
+    Args:
+        request (dict): The backtest request
+        progress (Callable): Called with (dates, values) while the backtest runs
+        data_source (Callable): Replaces get_stocks_data, called with (tickers, start_date, end_date)
+    """
+    backtest = backtest_from_request(request, verbose=False, progress_callback=progress)
+    if data_source is not None:
+        start = (backtest.initial_date - backtest.s).strftime('%Y-%m-%d')
+        backtest.data_module = DataModule(data_source(backtest.universe, start, backtest.final_date.strftime('%Y-%m-%d')))
+    values, initial_portfolio, final_portfolio = backtest.run_backtest()
+    return {
+        'name': backtest.backtest_name,
+        'run_id': backtest.run_id,
+        'final_value': float(values['Portfolio value'].iloc[-1]) if len(values) else None,
+        'portfolio_values': [{'Date': pd.Timestamp(d).isoformat(), 'Portfolio value': float(v)}
+                             for d, v in zip(values['Date'], values['Portfolio value'])],
+        'initial_portfolio': _weights(initial_portfolio),
+        'final_portfolio': _weights(final_portfolio),
+    }
+
+#---------------------------------------------------------
+# HTTP
+#---------------------------------------------------------
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           409: 'Conflict', 500: 'Internal Server Error'}
+
+async def _read_request(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise HTTPError(400, "Empty request")
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    body = None
+    length = int(headers.get('content-length', 0))
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise HTTPError(400, "The body is not valid JSON")
+    url = urlsplit(target)
+    return method.upper(), url.path, dict(parse_qsl(url.query)), body
+
+def _head(status: int, content_type: str = 'application/json', length: int = None):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+async def _respond(writer: asyncio.StreamWriter, status: int, payload):
+    body = json.dumps(payload, default=str).encode()
+    writer.write(_head(status, length=len(body)) + body)
+    await writer.drain()
+
+async def http_request(method: str, path: str, body=None, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                       unix_socket: str = None):
+    """Minimal client of the service, returns (status, payload)
+
+    Example:
+        status, payload = await http_request('POST', '/jobs', {'request': {...}, 'priority': 5})
+    """
+    if unix_socket is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        data = b'' if body is None else json.dumps(body).encode()
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        return status, json.loads(await reader.read())
+    finally:
+        writer.close()
+
+async def stream_events(job_id: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_socket: str = None):
+    """Yields the events of a job (status changes and progress) as they happen, until the job finishes"""
+    if unix_socket is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET /jobs/{job_id}/events HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        if status != 200:
+            raise HTTPError(status, json.loads(await reader.read()).get('error', ''))
+        async for line in reader:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        writer.close()
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class Job:
+    job_id: str
+    request: dict
+    key: str
+    priority: int = 0
+    total_steps: Optional[int] = None
+    status: str = 'queued' # queued, running, done, failed or cancelled
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    progress: dict = field(default_factory=dict)
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    events: list = field(default_factory=list, repr=False)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def summary(self, with_result: bool = False):
+        summary = {'job_id': self.job_id, 'status': self.status, 'priority': self.priority, 'request': self.request,
+                   'submitted': self.submitted, 'started': self.started, 'finished': self.finished,
+                   'progress': self.progress, 'error': self.error}
+        if with_result:
+            summary['result'] = self.result
+        return summary
+
+@dataclass
+class JobServer:
+    """ Asyncio job server running backtests for several users
+
+    Jobs wait in a priority queue (higher priority first, then first come first served) and run in a
+    bounded pool of worker threads. A request identical to a queued or running one joins it instead of
+    running twice. Progress is streamed to any number of subscribers, and the stored results of past runs
+    can be read back from the backtests/ folder.
+
+    Args:
+        max_workers (int): Number of backtests running at the same time
+        runner (Callable): Called with (request, progress) in a worker thread, returns the JSON result, run_request by default
+        data_source (Callable): Replaces get_stocks_data in the default runner, e.g. to serve from a local store
+
+    Example:
+        server = JobServer(max_workers=4)
+        asyncio.run(server.serve_forever(port=8765))
+    """
+    max_workers: int = 2
+    runner: Optional[Callable] = None
+    data_source: Optional[Callable] = None
+    backtests_dir: str = 'backtests'
+    registry_path: str = DEFAULT_REGISTRY_PATH
+
+    def __post_init__(self):
+        self.jobs = {}
+        self._inflight = {} # request key -> job id of the queued and running jobs
+        self._order = itertools.count()
+        self._queue = None
+        self._workers = []
+        self._servers = []
+        if self.runner is None:
+            self.runner = functools.partial(run_request, data_source=self.data_source)
+
+    async def start(self):
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='backtest')
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers, self._servers = [], []
+        # the backtests already running finish in their threads
+        self._executor.shutdown(wait=False)
+
+    def _publish(self, job: Job, event: dict):
+        job.events.append(event)
+        # wake up the subscribers, the next ones wait on a fresh event
+        job.changed.set()
+        job.changed = asyncio.Event()
+
+    def _status(self, job: Job, status: str):
+        job.status = status
+        self._publish(job, {'type': 'status', 'status': status, 'time': time.time()})
+
+    async def submit(self, request: dict, priority: int = 0):
+        """Queues a request, returns (job, deduplicated). Raises ValueError for an invalid request."""
+        await self.start()
+        backtest = backtest_from_request(request, persist=False, verbose=False)
+        key = request_key(backtest)
+        if key in self._inflight:
+            return self.jobs[self._inflight[key]], True
+        job = Job(uuid.uuid4().hex[:12], request, key, priority,
+                  total_steps=(backtest.final_date - backtest.initial_date).days + 1)
+        self.jobs[job.job_id] = job
+        self._inflight[key] = job.job_id
+        self._status(job, 'queued')
+        await self._queue.put((-priority, next(self._order), job.job_id))
+        return job, False
+
+    def cancel(self, job_id: str):
+        """Cancels a queued job, returns False if it is already running or finished"""
+        job = self.jobs[job_id]
+        if job.status != 'queued':
+            return False
+        self._inflight.pop(job.key, None)
+        job.finished = time.time()
+        self._status(job, 'cancelled')
+        return True
+
+    def _on_progress(self, job: Job, step: int, date, value: float):
+        job.progress = {'step': step, 'total': job.total_steps, 'date': pd.Timestamp(date).isoformat(), 'value': value}
+        self._publish(job, {'type': 'progress', **job.progress})
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            if job.status != 'queued':
+                continue
+            job.started = time.time()
+            self._status(job, 'running')
+
+            def progress(dates, values, job=job):
+                # called from the worker thread, the lists keep growing so only the last point is sent
+                self._loop.call_soon_threadsafe(self._on_progress, job, len(dates), dates[-1], float(values[-1]))
+            try:
+                job.result = await self._loop.run_in_executor(self._executor, self.runner, job.request, progress)
+                status = 'done'
+            except Exception as e:
+                logging.exception(f"Job {job.job_id} failed")
+                job.error = f"{type(e).__name__}: {e}"
+                status = 'failed'
+            finally:
+                self._inflight.pop(job.key, None)
+            job.finished = time.time()
+            self._status(job, status)
+
+    async def events(self, job_id: str):
+        """Yields the events of a job from the start, until it finishes"""
+        job = self.jobs[job_id]
+        seen = 0
+        while True:
+            while seen < len(job.events):
+                yield job.events[seen]
+                seen += 1
+            if job.done:
+                return
+            await job.changed.wait()
+
+    async def wait(self, job_id: str):
+        """Waits for a job to finish and returns it"""
+        async for _ in self.events(job_id):
+            pass
+        return self.jobs[job_id]
+
+    def load_result(self, name: str):
+        """Reads the transaction log of a stored run from the backtests/ folder"""
+        files = results_files(self.backtests_dir, names=[name])
+        if not files:
+            return None
+        return json.loads(writer_for_path(files[0]).read(files[0]).to_json(orient='records', date_format='iso'))
+
+    def _job(self, job_id: str):
+        if job_id not in self.jobs:
+            raise HTTPError(404, f"Unknown job {job_id}")
+        return self.jobs[job_id]
+
+    async def _route(self, method: str, path: str, query: dict, body, writer: asyncio.StreamWriter):
+        parts = [p for p in path.split('/') if p]
+        if parts == ['jobs'] and method == 'POST':
+            if not isinstance(body, dict) or not isinstance(body.get('request'), dict):
+                raise HTTPError(400, "Expected a JSON body like {\"request\": {...}, \"priority\": 0}")
+            try:
+                job, deduplicated = await self.submit(body['request'], int(body.get('priority', 0)))
+            except (ValueError, TypeError) as e:
+                raise HTTPError(400, str(e))
+            return await _respond(writer, 202, {'job': job.summary(), 'deduplicated': deduplicated})
+        if parts == ['jobs'] and method == 'GET':
+            return await _respond(writer, 200, [job.summary() for job in self.jobs.values()])
+        if len(parts) == 2 and parts[0] == 'jobs':
+            job = self._job(parts[1])
+            if method == 'GET':
+                return await _respond(writer, 200, job.summary(with_result=True))
+            if method == 'DELETE':
+                if not self.cancel(job.job_id):
+                    raise HTTPError(409, f"Job {job.job_id} is {job.status}, only queued jobs can be cancelled")
+                return await _respond(writer, 200, job.summary())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events' and method == 'GET':
+            job = self._job(parts[1])
+            # newline-delimited JSON, one event per line, the connection closes when the job finishes
+            writer.write(_head(200, 'application/x-ndjson'))
+            async for event in self.events(job.job_id):
+                writer.write(json.dumps(event).encode() + b'\n')
+                await writer.drain()
+            return
+        if len(parts) == 2 and parts[0] == 'results' and method == 'GET':
+            records = self.load_result(parts[1])
+            if records is None:
+                raise HTTPError(404, f"No stored results for {parts[1]}")
+            return await _respond(writer, 200, records)
+        if parts == ['runs'] and method == 'GET':
+            filters = {k: query[k] for k in ('strategy', 'ticker', 'since', 'until', 'blockchain') if k in query}
+            runs = BacktestRegistry(self.registry_path).query(limit=int(query.get('limit', 100)), **filters)
+            return await _respond(writer, 200, json.loads(runs.to_json(orient='records')))
+        raise HTTPError(404 if method in ('GET', 'POST', 'DELETE') else 405, f"No route for {method} {path}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, query, body = await _read_request(reader)
+            await self._route(method, path, query, body, writer)
+        except HTTPError as e:
+            await _respond(writer, e.status, {'error': e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.exception("Error handling a request")
+            await _respond(writer, 500, {'error': f"{type(e).__name__}: {e}"})
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_socket: str = None):
+        """Starts listening on a TCP port (port=0 picks a free one) or on a Unix socket, returns the asyncio server"""
+        await self.start()
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        self._servers.append(server)
+        return server
+
+    async def serve_forever(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_socket: str = None):
+        server = await self.serve(host, port, unix_socket)
+        logging.info(f"Backtest service listening on {unix_socket or f'http://{host}:{server.sockets[0].getsockname()[1]}'}")
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop()
+
+#---------------------------------------------------------
+# Command line
+#---------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pybacktestchain_ss.service',
+                                     description='Run backtests as a shared local service')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--workers', type=int, default=2, help='Number of backtests running at the same time')
+    args = parser.parse_args(argv)
+    server = JobServer(max_workers=args.workers)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
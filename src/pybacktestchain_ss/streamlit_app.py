@@ -1,7 +1,7 @@
 # streamlit_app.py
 import streamlit as st
 from datetime import datetime
-from pybacktestchain_ss.data_module import UNIVERSE_SEC, FirstTwoMoments
+from pybacktestchain_ss.data_module import FirstTwoMoments
 from pybacktestchain_ss.broker import Backtest, StopLoss, ProfitTaking
 from pybacktestchain_ss.portfolio_strategies import (
     RiskAverseStrategy,
@@ -11,21 +11,54 @@ from pybacktestchain_ss.portfolio_strategies import (
     EqualRiskStrategy,
     MaximumSharpeStrategy
 )
+from pybacktestchain_ss.charting import downsample, top_weights
+from pybacktestchain_ss.universe import TickerIndex
 from matplotlib import pyplot as plt
 from datetime import timedelta
+import pandas as pd
+import time
 
 portfolio_values_df = None
 initial_portfolio_comp = {}
 final_portfolio_comp = {}
 
+# maximum number of points sent to a chart, longer series are downsampled (shape-preserving)
+MAX_CHART_POINTS = 800
+# minimum number of seconds between two redraws of the live chart
+LIVE_CHART_REFRESH = 0.5
+# tickers offered by the search box, on top of the ones already selected
+MAX_SEARCH_RESULTS = 50
+DEFAULT_TICKERS = ["AAPL", "MSFT", "WMT", "TSLA", "SNAP"]
+
+# the ticker index is loaded once per server process, not on every rerun
+@st.cache_resource
+def ticker_index():
+    return TickerIndex.open()
+
 # plotting function for portfolio compositions
 def plot_portfolio_pie(portfolio_dict, title="Portfolio"):
+    # grouping the small weights together so that large universes stay readable
+    portfolio_dict = top_weights(portfolio_dict, max_slices=10)
     labels = list(portfolio_dict.keys())
     sizes = list(portfolio_dict.values())
     fig, ax = plt.subplots()
     ax.pie(sizes, labels=labels, autopct="%1.1f%%", startangle=140)
     ax.set_title(title)
     st.pyplot(fig)
+    plt.close(fig)
+
+# plotting function for one or many portfolio value series, drawn into the given placeholder
+def plot_portfolio_values(placeholder, runs, title="Portfolio value over backtest"):
+    fig, ax = plt.subplots()
+    for label, df in runs.items():
+        df = downsample(df, max_points=MAX_CHART_POINTS)
+        ax.plot(df["Date"], df["Portfolio value"], label=label)
+    ax.set_title(title)
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    placeholder.pyplot(fig)
+    plt.close(fig)
 
 st.set_page_config(layout="wide")
 
@@ -39,7 +72,7 @@ def main():
             """
             **Instructions**  
             1) Set the start and end dates for your backtest  
-            2) Select one or more stocks from the drop-down list (includes the whole SEC universe)
+            2) Search the SEC universe by ticker or company name and select one or more stocks
             3) Define an initial cash value
             4) Select a risk model (StopLoss or ProfitTaking or None) and threshold
             5) Choose a portfolio strategy (if the strategy fails to converge, Equal Weight is used as default)  
@@ -56,10 +89,15 @@ def main():
     with col2:
         # 2) Universe selection
         st.subheader("2) Select tickers (investment universe)")
+        query = st.text_input("Search the SEC universe (ticker or company name)")
+        selected = st.session_state.get("selected_tickers", DEFAULT_TICKERS)
+        # only the matches of the search are offered, instead of the ~10k tickers of the SEC universe
+        matches = ticker_index().search(query, limit=MAX_SEARCH_RESULTS) if query else []
         selected_tickers = st.multiselect(
             "Select tickers from the SEC universe",
-            options=sorted(UNIVERSE_SEC),
-            default=["AAPL", "MSFT", "WMT", "TSLA", "SNAP"]
+            options=list(dict.fromkeys(DEFAULT_TICKERS + selected + matches)),
+            default=DEFAULT_TICKERS,
+            key="selected_tickers"
         )
         if not selected_tickers:
             st.warning("No tickers selected. Please pick at least one.")
@@ -123,6 +161,22 @@ def main():
         else:
             # create the Backtest instance
             st.info("Launching backtest. This may take a moment...")
+            with col1:
+                live_chart = st.empty()
+            progress_bar = st.progress(0.0)
+            total_days = (end_date - start_date).days + 1
+            last_draw = [0.0]
+
+            # streaming the partial portfolio values into the chart while the backtest runs
+            def on_progress(dates, values):
+                progress_bar.progress(min(len(dates) / total_days, 1.0))
+                now = time.monotonic()
+                if now - last_draw[0] < LIVE_CHART_REFRESH and len(dates) < total_days:
+                    return
+                last_draw[0] = now
+                partial_df = pd.DataFrame({"Date": dates, "Portfolio value": values})
+                plot_portfolio_values(live_chart, {"Portfolio value": partial_df})
+
             try:
                 # build the actual dates in datetime form
                 start_dt = datetime(start_date.year, start_date.month, start_date.day)
@@ -138,20 +192,22 @@ def main():
                     portfolio_strategy=selected_strategy,
                     s=lookback_timedelta,
                     verbose=False,   # or True, if you want verbose logs in the console
-                    name_blockchain="backtest_streamlit"
+                    name_blockchain="backtest_streamlit",
+                    progress_callback=on_progress
                 )
                 portfolio_values_df, initial_portfolio_comp, final_portfolio_comp = backtest.run_backtest()
+                progress_bar.empty()
                 st.success("Backtest completed! See console/logs for details.")
 
+                # keeping a downsampled copy of every run of the session for the comparison chart
+                label = f"{backtest.backtest_name} ({selected_strategy.__name__})"
+                st.session_state.setdefault("runs", {})[label] = downsample(portfolio_values_df, max_points=MAX_CHART_POINTS)
+
                 with col1:
                 # portfolio value over time plot
-                    fig, ax = plt.subplots()
-                    ax.plot(portfolio_values_df["Date"], portfolio_values_df["Portfolio value"], label="Portfolio value", color="green")
-                    ax.set_title("Portfolio value over backtest")
-                    ax.set_xlabel("Date")
-                    ax.set_ylabel("Value")
-                    ax.legend()
-                    st.pyplot(fig)
+                    plot_portfolio_values(live_chart, {"Portfolio value": portfolio_values_df})
+                    if len(st.session_state["runs"]) > 1:
+                        plot_portfolio_values(st.empty(), st.session_state["runs"], title="Comparison of the runs of this session")
                 with col2:
                 # portfolio initial composition pie
                     if initial_portfolio_comp:
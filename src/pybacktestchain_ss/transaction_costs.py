@@ -0,0 +1,91 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+import numpy as np
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+class CostModel(ABC):
+    """ Abstract base class for the transaction cost models
+
+    A cost model prices all the orders of a rebalancing at once: it receives arrays of signed
+    quantities (positive to buy, negative to sell), fill prices and average daily volumes, and
+    returns the cost of each order in cash, always positive.
+    """
+    requires_volume: bool = False # True if the model needs the traded volumes of the tickers
+
+    @abstractmethod
+    def costs(self, quantities: np.ndarray, prices: np.ndarray, volumes: np.ndarray = None) -> np.ndarray:
+        pass
+
+    def __add__(self, other):
+        return CompositeCost([self, other])
+
+@dataclass
+class NoCost(CostModel):
+    """ Frictionless execution at the close, the original behaviour of the broker """
+
+    def costs(self, quantities, prices, volumes=None):
+        return np.zeros(len(quantities))
+
+@dataclass
+class FixedBps(CostModel):
+    """ Commission proportional to the traded notional, e.g. FixedBps(5) for 5 basis points """
+    bps: float = 5.0
+
+    def costs(self, quantities, prices, volumes=None):
+        return np.abs(quantities) * prices * self.bps * 1e-4
+
+@dataclass
+class SpreadCost(CostModel):
+    """ Crossing the bid-ask spread: each order pays half of the quoted spread (in basis points of the price) """
+    spread_bps: float = 10.0
+
+    def costs(self, quantities, prices, volumes=None):
+        return np.abs(quantities) * prices * self.spread_bps * 0.5e-4
+
+@dataclass
+class SquareRootImpact(CostModel):
+    """ Square-root market impact: the price moves by eta·σ·√(|Q|/V) against the order
+
+    Args:
+        eta (float): Impact coefficient, of the order of 1
+        daily_volatility (float): Daily volatility σ of the traded stocks
+        max_participation (float): Cap on |Q|/V, so that a missing or tiny volume does not blow up the cost
+
+    The volumes V are the average daily volumes of the tickers. Orders of tickers without a volume pay no impact.
+    """
+    eta: float = 1.0
+    daily_volatility: float = 0.02
+    max_participation: float = 1.0
+    requires_volume: bool = field(default=True, init=False)
+
+    def costs(self, quantities, prices, volumes=None):
+        quantities = np.abs(quantities)
+        if volumes is None:
+            return np.zeros(len(quantities))
+        volumes = np.asarray(volumes, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            participation = np.where(volumes > 0, quantities / volumes, 0.0)
+        participation = np.minimum(np.nan_to_num(participation), self.max_participation)
+        return quantities * prices * self.eta * self.daily_volatility * np.sqrt(participation)
+
+@dataclass
+class CompositeCost(CostModel):
+    """ Sum of several cost models, e.g. FixedBps(1) + SpreadCost(5) + SquareRootImpact() """
+    models: list = field(default_factory=list)
+
+    @property
+    def requires_volume(self):
+        return any(model.requires_volume for model in self.models)
+
+    def costs(self, quantities, prices, volumes=None):
+        total = np.zeros(len(quantities))
+        for model in self.models:
+            total += model.costs(quantities, prices, volumes)
+        return total
+
+    def __add__(self, other):
+        return CompositeCost(self.models + [other])
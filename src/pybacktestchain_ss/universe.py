@@ -0,0 +1,302 @@
+import bisect
+import json
+import logging
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.bars import _naive_ns
+from pybacktestchain_ss.blockchain import _write_bytes
+from pybacktestchain_ss.price_store import PriceStore
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+DEFAULT_INDEX_PATH = 'universe/tickers.json'
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _normalize(text: str):
+    # upper case letters and digits only, so that 'brk.b', 'BRK-B' and 'BRK B' are the same key
+    return re.sub(r'[^0-9A-Z]+', '', str(text).upper())
+
+def _trigrams(text: str):
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def restrict_information_set(information_set: dict, companies):
+    """Keeps only the given companies in an information set, dense or factor model
+
+    Example:
+        information_set = restrict_information_set(info.compute_information(t), screen.members(panel, t))
+    """
+    if 'companies' not in information_set:
+        return information_set
+    keep = np.isin(information_set['companies'], np.asarray(companies))
+    restricted = dict(information_set)
+    for key in ('companies', 'expected_return', 'specific_variance', 'factor_loadings'):
+        if key in information_set:
+            restricted[key] = np.asarray(information_set[key])[keep]
+    if 'covariance_matrix' in information_set:
+        restricted['covariance_matrix'] = np.asarray(information_set['covariance_matrix'])[np.ix_(keep, keep)]
+    return restricted
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class TickerIndex:
+    """ Persisted index of the SEC tickers, with prefix and fuzzy search on the tickers and the company names
+
+    The tickers are kept sorted, so a prefix search is a binary search. The words of the company names
+    get their own sorted list, and a trigram index (built on the first fuzzy query) finds the closest
+    tickers and names when there is no exact or prefix match.
+
+    Example:
+        index = TickerIndex.open()
+        index.search('micro')  # ['MSFT', 'MU', ...]
+    """
+    tickers: np.ndarray
+    names: np.ndarray
+    exchanges: np.ndarray
+    _trigram_index: dict = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        order = np.argsort(self.tickers, kind='stable')
+        self.tickers, self.names, self.exchanges = (np.asarray(a, dtype=str)[order] for a in (self.tickers, self.names, self.exchanges))
+        self._keys = [_normalize(ticker) for ticker in self.tickers]
+        self._key_order = sorted(range(len(self._keys)), key=self._keys.__getitem__)
+        self._sorted_keys = [self._keys[i] for i in self._key_order]
+        words = sorted((word, i) for i, name in enumerate(self.names) for word in set(re.findall(r'[0-9A-Z]+', name.upper())))
+        self._words = [word for word, _ in words]
+        self._word_rows = [i for _, i in words]
+
+    @classmethod
+    def build(cls, mapper=None):
+        """Builds the index from sec_cik_mapper (downloads the SEC mapping if no mapper is given)"""
+        if mapper is None:
+            from sec_cik_mapper import StockMapper
+            mapper = StockMapper()
+        tickers = list(mapper.ticker_to_cik)
+        names = getattr(mapper, 'ticker_to_company_name', {})
+        exchanges = getattr(mapper, 'ticker_to_exchange', {})
+        return cls(np.array(tickers, dtype=str), np.array([names.get(t, '') or '' for t in tickers], dtype=str),
+                   np.array([exchanges.get(t, '') or '' for t in tickers], dtype=str))
+
+    def save(self, path: str = DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        index = {'tickers': self.tickers.tolist(), 'names': self.names.tolist(), 'exchanges': self.exchanges.tolist(),
+                 'built': datetime.now().isoformat()}
+        _write_bytes(json.dumps(index).encode(), path)
+        return path
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH):
+        with open(path) as f:
+            index = json.load(f)
+        return cls(np.array(index['tickers'], dtype=str), np.array(index['names'], dtype=str),
+                   np.array(index['exchanges'], dtype=str))
+
+    @classmethod
+    def open(cls, path: str = DEFAULT_INDEX_PATH, mapper=None, rebuild: bool = False):
+        """Loads the persisted index, building and saving it first if it does not exist (or rebuild is True)"""
+        if not rebuild and os.path.exists(path):
+            return cls.load(path)
+        logging.info(f"Building the ticker index in {path}")
+        index = cls.build(mapper)
+        index.save(path)
+        return index
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def name(self, ticker: str):
+        i = np.searchsorted(self.tickers, ticker)
+        return self.names[i] if i < len(self.tickers) and self.tickers[i] == ticker else None
+
+    def _prefix(self, key: str, limit: Optional[int]):
+        # rows of the tickers whose key starts with key, the exact match first
+        lo = bisect.bisect_left(self._sorted_keys, key)
+        hi = bisect.bisect_left(self._sorted_keys, key + '\x7f', lo)
+        return self._key_order[lo:hi if limit is None else min(hi, lo + limit)]
+
+    def prefix(self, prefix: str, limit: Optional[int] = 20):
+        """The tickers starting with prefix (ignoring case and punctuation), in alphabetical order"""
+        return [self.tickers[i] for i in self._prefix(_normalize(prefix), limit)]
+
+    def _name_prefix(self, prefix: str):
+        # rows of the companies with a word of their name starting with prefix
+        lo = bisect.bisect_left(self._words, prefix)
+        hi = bisect.bisect_left(self._words, prefix + '\x7f', lo)
+        return list(dict.fromkeys(self._word_rows[lo:hi]))
+
+    def _fuzzy(self, key: str):
+        # rows sorted by the trigram similarity (Dice) of their ticker, or of their name, with the key
+        if self._trigram_index is None:
+            self._trigram_index = {}
+            for source, texts in (('tickers', self._keys), ('names', [_normalize(name) for name in self.names])):
+                index, sizes = defaultdict(list), np.empty(len(texts))
+                for i, text in enumerate(texts):
+                    trigrams = _trigrams(text) if text else set()
+                    sizes[i] = len(trigrams)
+                    for trigram in trigrams:
+                        index[trigram].append(i)
+                self._trigram_index[source] = ({t: np.array(rows) for t, rows in index.items()}, sizes)
+        query = _trigrams(key)
+        scores = np.zeros(len(self.tickers))
+        for index, sizes in self._trigram_index.values():
+            rows = [index[t] for t in query if t in index]
+            if rows:
+                shared = np.bincount(np.concatenate(rows), minlength=len(scores))
+                scores = np.maximum(scores, 2 * shared / (len(query) + sizes))
+        # a single shared trigram is noise
+        candidates = np.flatnonzero(scores >= 0.3)
+        return candidates[np.argsort(-scores[candidates], kind='stable')].tolist()
+
+    def search(self, query: str, limit: int = 20):
+        """Tickers matching a query: exact ticker, then ticker prefix, then name words, then fuzzy matches"""
+        key = _normalize(query)
+        if not key:
+            return []
+        rows = list(self._prefix(key, limit))
+        words = re.findall(r'[0-9A-Z]+', str(query).upper())
+        if words:
+            # every word of the query must start a word of the name
+            matches = set(self._name_prefix(words[0]))
+            for word in words[1:]:
+                matches &= set(self._name_prefix(word))
+            rows.extend(sorted(matches, key=lambda i: (len(self.names[i]), self.tickers[i])))
+        if len(dict.fromkeys(rows)) < limit:
+            rows.extend(self._fuzzy(key))
+        return [self.tickers[i] for i in list(dict.fromkeys(rows))[:limit]]
+
+@dataclass
+class ScreenPanel:
+    """ Prefix sums of a price panel (and of its dollar volumes) to screen a universe at any date in O(tickers)
+
+    Built once from the cached price data, then each screen date costs a few binary searches and
+    vectorized operations over the tickers, whatever the length of the lookback.
+    """
+    times: np.ndarray # int64 ns, naive wall-clock time, like BarPanel
+    tickers: np.ndarray
+    prices: np.ndarray # times × tickers, NaN where there is no price
+    volumes: Optional[np.ndarray] = None
+
+    def __post_init__(self):
+        valid = ~np.isnan(self.prices)
+        n = len(self.tickers)
+        self._history = np.vstack([np.zeros((1, n), dtype=np.int32), np.cumsum(valid, axis=0, dtype=np.int32)])
+        # row of the last price at or before each row, -1 before the first one
+        self._last = np.maximum.accumulate(np.where(valid, np.arange(len(self.times))[:, None], -1), axis=0)
+        if self.volumes is not None:
+            dollar_volume = self.prices * self.volumes
+            traded = ~np.isnan(dollar_volume)
+            self._dollar_volume = np.vstack([np.zeros((1, n)), np.cumsum(np.where(traded, dollar_volume, 0.0), axis=0)])
+            self._traded = np.vstack([np.zeros((1, n), dtype=np.int32), np.cumsum(traded, axis=0, dtype=np.int32)])
+
+    @classmethod
+    def from_data_module(cls, data_module, time_column: str = 'Date', company_column: str = 'ticker',
+                         price_column: str = 'Adj Close', volume_column: Optional[str] = 'Volume'):
+        prices = data_module.bar_panel(time_column, company_column, price_column)
+        volumes = None
+        if volume_column is not None and volume_column in data_module.data.columns:
+            volumes = np.asarray(data_module.bar_panel(time_column, company_column, volume_column).values, dtype=float)
+        # the prefix sums are taken in double precision, whatever the precision of the data
+        return cls(prices.times, prices.tickers, np.asarray(prices.values, dtype=float), volumes)
+
+    @classmethod
+    def from_store(cls, path: str, start=None, end=None, price_field: str = 'Adj Close',
+                   volume_field: Optional[str] = 'Volume', tickers: list = None, strict: bool = False):
+        """Reads the screen data from a PriceStore, without going through a long DataFrame, skipping missing tickers"""
+        store = PriceStore(path)
+        rows, columns = store.date_range(start, end), store.ticker_positions(tickers, strict)
+        times = pd.DatetimeIndex(store.dates[rows]).tz_localize('UTC')
+        if store.meta['tz'] is not None:
+            times = times.tz_convert(store.meta['tz'])
+        volumes = None
+        if volume_field is not None and volume_field in store.fields:
+            volumes = np.asarray(store.array(volume_field)[rows][:, columns], dtype=float)
+        return cls(_naive_ns(times), store.tickers[columns], np.asarray(store.array(price_field)[rows][:, columns], dtype=float),
+                   volumes)
+
+    def row(self, t):
+        """Number of rows strictly before t: a screen at t only sees rows[:row(t)]"""
+        return int(np.searchsorted(self.times, _naive_ns([t])[0], side='left'))
+
+@dataclass
+class UniverseScreen:
+    """ Point-in-time universe screen: the tickers tradable at a date, from the data known before it
+
+    A ticker passes when it has enough prices in the lookback, a recent price above the floor and enough
+    average dollar volume. Screened at each rebalancing date, tickers enter when they list and leave when
+    they stop trading, so a backtest on a screened universe does not only hold the survivors.
+
+    Example:
+        screen = UniverseScreen(min_history=200, min_price=5, min_dollar_volume=1e6, top_n=500)
+        backtest = Backtest(..., universe=index.tickers.tolist(), universe_screen=screen)
+    """
+    lookback: timedelta = timedelta(days=360)
+    min_history: int = 0 # prices in the lookback
+    min_price: float = 0.0 # floor of the last price
+    min_dollar_volume: float = 0.0 # floor of the average price × volume
+    volume_window: int = 20 # rows the dollar volume is averaged over
+    max_stale: Optional[timedelta] = timedelta(days=7) # the last price must be this recent, None for no limit
+    top_n: Optional[int] = None # then keep only the top_n by average dollar volume
+
+    @property
+    def requires_volume(self):
+        return self.min_dollar_volume > 0 or self.top_n is not None
+
+    def dollar_volume(self, panel: ScreenPanel, row: int):
+        """Average dollar volume over the volume_window rows before row, NaN without a traded row"""
+        if panel.volumes is None:
+            raise ValueError("The screen needs volumes, the screen panel has none")
+        lo = max(row - self.volume_window, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (panel._dollar_volume[row] - panel._dollar_volume[lo]) / (panel._traded[row] - panel._traded[lo])
+
+    def mask(self, panel: ScreenPanel, t):
+        """Boolean mask over panel.tickers of the tickers passing the screen at t"""
+        row = panel.row(t)
+        t_ns = _naive_ns([t])[0]
+        lo = int(np.searchsorted(panel.times, t_ns - pd.Timedelta(self.lookback).value, side='left'))
+        history = panel._history[row] - panel._history[lo]
+        passing = history >= max(self.min_history, 1)
+        if row == 0:
+            return passing
+        last = panel._last[row - 1]
+        columns = np.arange(len(panel.tickers))
+        last_price = np.where(last >= 0, panel.prices[np.maximum(last, 0), columns], np.nan)
+        with np.errstate(invalid='ignore'):
+            passing &= last_price >= self.min_price
+        if self.max_stale is not None:
+            passing &= (last >= 0) & (t_ns - panel.times[np.maximum(last, 0)] <= pd.Timedelta(self.max_stale).value)
+        if self.requires_volume:
+            dollar_volume = self.dollar_volume(panel, row)
+            with np.errstate(invalid='ignore'):
+                passing &= dollar_volume >= self.min_dollar_volume
+            if self.top_n is not None and passing.sum() > self.top_n:
+                ranked = np.where(passing, dollar_volume, -np.inf)
+                top = np.argpartition(-ranked, self.top_n - 1)[:self.top_n]
+                passing = np.zeros_like(passing)
+                passing[top] = True
+        return passing
+
+    def members(self, panel: ScreenPanel, t):
+        """The tickers passing the screen at t"""
+        return panel.tickers[self.mask(panel, t)]
+
+    def evaluate(self, panel: ScreenPanel, dates):
+        """The screen at many dates (e.g. the rebalancing dates) as a dates × tickers boolean DataFrame"""
+        return pd.DataFrame(np.array([self.mask(panel, t) for t in dates]).reshape(len(dates), len(panel.tickers)),
+                            index=pd.DatetimeIndex(dates), columns=panel.tickers)
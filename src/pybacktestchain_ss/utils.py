@@ -17,8 +17,15 @@ colors = [
 ]
 
 # Function to generate a random name
-def generate_random_name():
-    animal = random.choice(animals)
-    profession = random.choice(professions)
-    color = random.choice(colors)
+def generate_random_name(seed=None):
+    """Returns a name like 'RedFoxCarpenter', always the same one for a given seed (e.g. a run identity)"""
+    rng = random if seed is None else random.Random(seed)
+    animal = rng.choice(animals)
+    profession = rng.choice(professions)
+    color = rng.choice(colors)
     return f"{color}{animal}{profession}"
+
+def run_name(run_id: str, id_length: int = 12):
+    """Returns the name of a run, e.g. 'RedFoxCarpenter-3f2a9c01b7de': its friendly name followed by the start of
+    its identity, since the 8000 friendly names alone collide after a few hundred runs"""
+    return f"{generate_random_name(seed=run_id)}-{run_id[:id_length]}"
@@ -0,0 +1,163 @@
+from dataclasses import dataclass
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def _naive_dates(dates):
+    # same convention as Information.slice_data for timezone-naive dates: aware dates keep their wall time
+    if not pd.api.types.is_datetime64_any_dtype(getattr(dates, 'dtype', None)):
+        dates = pd.to_datetime(dates)
+    dates = pd.DatetimeIndex(dates)
+    return dates.tz_localize(None) if dates.tz is not None else dates
+
+def mark_to_market(transaction_log: pd.DataFrame, prices, initial_cash: float):
+    """mark_to_market values a backtest over all its dates at once from its transaction log
+
+    The holdings are the cumulative sum of the signed trades (a dates × tickers matrix), the cash is the
+    last cash balance of the log on each date, and the value is cash + holdings × prices. The trades of a
+    date are done before it is valued, like in run_backtest, and trades between two dates count from the
+    next one (e.g. intraday trades valued at the end of the day).
+
+    Args:
+        transaction_log (pd.DataFrame): The log of the broker (Date, Action, Ticker, Quantity, Cash)
+        prices (PriceMatrix): The prices of every date of the backtest
+        initial_cash (float): Cash before the first trade
+
+    Returns:
+        Valuation: The portfolio value, per-ticker exposures, cash and drawdown series
+
+    Example:
+        valuation = mark_to_market(backtest.broker.get_transaction_log(), info.price_matrix(dates), 1000000)
+    """
+    n_dates, n_tickers = prices.values.shape
+    holdings = np.zeros((n_dates, n_tickers))
+    cash = np.full(n_dates, np.nan)
+    log = transaction_log
+    if len(log):
+        rows = np.searchsorted(prices.dates, _naive_dates(log['Date']).as_unit('ns').asi8, side='left')
+        signs = np.where(log['Action'].astype(str).to_numpy() == 'SELL', -1.0, 1.0)
+        columns = np.array([prices.column(ticker) for ticker in log['Ticker']])
+        valid = rows < n_dates
+        np.add.at(holdings, (rows[valid], columns[valid]), signs[valid] * log['Quantity'].to_numpy(dtype=float)[valid])
+        # the log is in time order, the last trade of a date gives its closing cash balance
+        rows, balances = rows[valid], log['Cash'].to_numpy(dtype=float)[valid]
+        last = np.r_[rows[1:] != rows[:-1], True]
+        cash[rows[last]] = balances[last]
+    holdings = np.cumsum(holdings, axis=0)
+    cash = pd.Series(cash).ffill().fillna(initial_cash).to_numpy()
+    exposures = np.where(holdings != 0, holdings * prices.values, 0.0)
+    values = cash + exposures.sum(axis=1)
+    return Valuation(pd.DatetimeIndex(prices.dates), prices.tickers, holdings, exposures, cash, values)
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class PriceMatrix:
+    """ Prices of many dates as a dates × tickers array, the vectorized equivalent of Information.get_prices
+
+    Row i holds the prices the portfolio would trade at on dates[i]: the last price of each ticker strictly
+    before the date, within the lookback window. Tickers without a price are NaN.
+    """
+    dates: np.ndarray # datetime64[ns], naive
+    tickers: np.ndarray
+    values: np.ndarray
+
+    def __post_init__(self):
+        self._columns = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    @classmethod
+    def from_data(cls, data: pd.DataFrame, dates, window: timedelta, time_column: str = 'Date',
+                  company_column: str = 'ticker', price_column: str = 'Adj Close'):
+        """Builds the prices of all the dates with one pivot and a binary search, instead of one slice per date"""
+        dates = _naive_dates(dates).as_unit('ns')
+        data = data[[time_column, company_column, price_column]].copy()
+        data[time_column] = _naive_dates(data[time_column])
+        observed = data.pivot_table(index=time_column, columns=company_column, values=price_column,
+                                    aggfunc='last', dropna=False).sort_index()
+        tickers = observed.columns.to_numpy()
+        times = pd.DatetimeIndex(observed.index).as_unit('ns').asi8
+        # last price of each ticker up to each observation, and the time it was observed
+        last_price = observed.ffill().to_numpy(dtype=float)
+        last_time = pd.DataFrame(np.where(observed.notna(), times[:, None], np.nan)).ffill().to_numpy()
+        # last observation strictly before each date
+        rows = np.searchsorted(times, dates.asi8, side='left') - 1
+        values = np.full((len(dates), len(tickers)), np.nan)
+        has_row = rows >= 0
+        values[has_row] = last_price[rows[has_row]]
+        observed_at = np.full(values.shape, np.nan)
+        observed_at[has_row] = last_time[rows[has_row]]
+        start = (dates - pd.Timedelta(window)).asi8[:, None]
+        values[~(observed_at >= start)] = np.nan
+        return cls(dates.to_numpy(), tickers, values)
+
+    @classmethod
+    def from_dicts(cls, dates, prices: list):
+        """Builds the matrix from one {ticker: price} dict per date (e.g. cached get_prices results)"""
+        tickers = np.array(sorted({ticker for p in prices for ticker in p}), dtype=object)
+        columns = {ticker: i for i, ticker in enumerate(tickers)}
+        values = np.full((len(prices), len(tickers)), np.nan)
+        for i, p in enumerate(prices):
+            for ticker, price in p.items():
+                values[i, columns[ticker]] = price
+        return cls(_naive_dates(dates).as_unit('ns').to_numpy(), tickers, values)
+
+    def column(self, ticker):
+        return self._columns[ticker]
+
+    def prices_at(self, i: int):
+        """The {ticker: price} dict of row i, as returned by Information.get_prices"""
+        row = self.values[i]
+        return {ticker: row[j] for j, ticker in enumerate(self.tickers) if not np.isnan(row[j])}
+
+    def value_at(self, i: int, cash: float, positions: dict):
+        """Value of a broker's positions on row i, O(number of positions)"""
+        row = self.values[i]
+        value = cash
+        for ticker, position in positions.items():
+            value += position.quantity * row[self._columns[ticker]]
+        return value
+
+@dataclass
+class Valuation:
+    """ Daily valuation of a backtest, computed in one pass from its transaction log """
+    dates: pd.DatetimeIndex
+    tickers: np.ndarray
+    holdings: np.ndarray # dates × tickers number of shares
+    exposure_values: np.ndarray # dates × tickers market value of the holdings
+    cash_values: np.ndarray
+    portfolio_values: np.ndarray
+
+    @property
+    def values(self):
+        return pd.Series(self.portfolio_values, index=self.dates, name='Portfolio value')
+
+    @property
+    def exposures(self):
+        """Market value of each position, one column per ticker"""
+        return pd.DataFrame(self.exposure_values, index=self.dates, columns=self.tickers)
+
+    @property
+    def weights(self):
+        return self.exposures.div(self.portfolio_values, axis=0)
+
+    @property
+    def cash(self):
+        return pd.Series(self.cash_values, index=self.dates, name='Cash')
+
+    @property
+    def drawdown(self):
+        """Relative distance of the value to its running maximum, 0 at new highs"""
+        values = self.portfolio_values
+        return pd.Series(values / np.maximum.accumulate(values) - 1, index=self.dates, name='Drawdown')
+
+    @property
+    def portfolio_values_df(self):
+        """The two-column frame returned by run_backtest"""
+        return pd.DataFrame({"Date": self.dates, "Portfolio value": self.portfolio_values})
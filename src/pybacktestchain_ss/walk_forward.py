@@ -0,0 +1,229 @@
+import copy
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional, Type
+
+import numpy as np
+import pandas as pd
+
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments, Information, get_stocks_data
+from pybacktestchain_ss.broker import Backtest, EndOfMonth, RiskModel
+from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy, RiskAverseStrategy
+from pybacktestchain_ss.transaction_costs import CostModel
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def make_folds(initial_date: datetime, final_date: datetime, train: timedelta, test: timedelta,
+               step: Optional[timedelta] = None, anchored: bool = False):
+    """make_folds splits a period into rolling-origin train/test folds
+
+    Args:
+        initial_date (datetime): Start of the first training window
+        final_date (datetime): No test window goes beyond this date
+        train (timedelta): Length of the training window (the lookback of the information set)
+        test (timedelta): Length of each out-of-sample window
+        step (timedelta): Distance between two consecutive origins, defaults to test (no overlap)
+        anchored (bool): If True the training windows all start at initial_date (expanding window)
+
+    Returns:
+        list: The Fold objects, ordered by origin
+
+    Example:
+        folds = make_folds(datetime(2015, 1, 1), datetime(2020, 1, 1), timedelta(days=360), timedelta(days=90))
+    """
+    step = step or test
+    folds = []
+    origin = initial_date + train
+    while origin + test <= final_date:
+        train_start = initial_date if anchored else origin - train
+        folds.append(Fold(train_start, origin, origin + test))
+        origin += step
+    return folds
+
+def stitch_equity_curves(folds: list, fold_values: list, initial_cash: float):
+    """stitch_equity_curves chains the out-of-sample returns of the folds into a single curve
+
+    When test windows overlap, each fold is only used until the next fold starts.
+    """
+    returns = []
+    for i, (fold, values) in enumerate(zip(folds, fold_values)):
+        series = values.set_index('Date')['Portfolio value']
+        # every fold starts with the initial cash
+        fold_returns = series / np.r_[initial_cash, series.to_numpy()[:-1]] - 1
+        if i + 1 < len(folds):
+            fold_returns = fold_returns[fold_returns.index < folds[i + 1].test_start]
+        returns.append(fold_returns)
+    if not returns:
+        return pd.DataFrame(columns=['Date', 'Portfolio value'])
+    returns = pd.concat(returns)
+    stitched = initial_cash * (1 + returns).cumprod()
+    return pd.DataFrame({'Date': stitched.index, 'Portfolio value': stitched.to_numpy()})
+
+def _compute_information(backtest: Backtest, data_module: DataModule, dates: list):
+    """The information sets and prices of the window of a fold at some dates"""
+    info = backtest.create_information(data_module)
+    return [(info.compute_information(t), info.get_prices(t)) for t in dates]
+
+def _run_fold(backtest: Backtest):
+    # top-level so that it can be sent to worker processes
+    portfolio_values_df, _, _ = backtest.run_backtest()
+    return portfolio_values_df
+
+_WORKER_DATA = None
+
+def _init_worker(data_module: DataModule):
+    global _WORKER_DATA
+    _WORKER_DATA = data_module
+
+def _compute_information_in_worker(task: tuple):
+    # top-level so that it can be sent to worker processes, the data was sent once by _init_worker
+    backtest, dates = task
+    return _compute_information(backtest, _WORKER_DATA, dates)
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class Fold:
+    train_start: datetime
+    test_start: datetime
+    test_end: datetime
+
+    @property
+    def train(self):
+        return self.test_start - self.train_start
+
+@dataclass
+class WalkForwardResult:
+    folds: list
+    fold_values: list # one portfolio_values_df per fold
+    stitched: pd.DataFrame # out-of-sample equity curve of all the folds chained together
+
+@dataclass
+class WalkForward:
+    """ Walk-forward evaluation: the data is loaded once and every fold is a Backtest on top of it """
+    initial_date: datetime
+    final_date: datetime
+    train: timedelta = timedelta(days=360)
+    test: timedelta = timedelta(days=90)
+    step: Optional[timedelta] = None
+    anchored: bool = False
+    universe: list = field(default_factory=lambda: \
+                           ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'META', 'TSLA', 'NVDA', 'INTC', 'CSCO', 'NFLX'])
+    portfolio_strategy: PortfolioStrategy = field(default_factory=lambda: RiskAverseStrategy)
+    information_class : Type[Information] = FirstTwoMoments
+    time_column: str = 'Date'
+    company_column: str = 'ticker'
+    adj_close_column: str = 'Adj Close'
+    rebalance_flag: type = EndOfMonth
+    risk_model: Optional[Type[RiskModel]] = None
+    risk_threshold: float = 0.1
+    cost_model: Optional[CostModel] = None
+    initial_cash: int = 1000000
+    name_blockchain: str = 'backtest'
+    persist: bool = False # True to store every fold like a regular backtest
+    max_workers: Optional[int] = None
+    use_processes: bool = False # folds in worker processes instead of threads
+    data_module: Optional[DataModule] = None
+    verbose: bool = False
+
+    def folds(self):
+        return make_folds(self.initial_date, self.final_date, self.train, self.test, self.step, self.anchored)
+
+    def load_data(self):
+        """Downloads the whole span once, shared by all the folds"""
+        logging.info(f"Retrieving price data for universe from {self.initial_date} to {self.final_date}")
+        df = get_stocks_data(self.universe, self.initial_date.strftime('%Y-%m-%d'), self.final_date.strftime('%Y-%m-%d'))
+        return DataModule(df, self.time_column)
+
+    def make_backtest(self, fold: Fold, information_cache: dict):
+        return Backtest(initial_date=fold.test_start,
+                        # the last day belongs to the next fold
+                        final_date=fold.test_end - timedelta(days=1),
+                        universe=self.universe,
+                        portfolio_strategy=self.portfolio_strategy,
+                        information_class=self.information_class,
+                        s=fold.train,
+                        time_column=self.time_column,
+                        company_column=self.company_column,
+                        adj_close_column=self.adj_close_column,
+                        rebalance_flag=self.rebalance_flag,
+                        risk_model=self.risk_model,
+                        risk_threshold=self.risk_threshold,
+                        cost_model=self.cost_model,
+                        initial_cash=self.initial_cash,
+                        name_blockchain=self.name_blockchain,
+                        verbose=self.verbose,
+                        data_module=self.data_module,
+                        information_cache=information_cache,
+                        persist=self.persist,
+                        # the folds may run on a stripped data module, their data fingerprint would be meaningless
+                        use_cache=False)
+
+    def precompute_information(self, backtests: list, executor=None):
+        """Computes the information sets of every date once, overlapping folds share them
+
+        The distinct dates of each window are split in chunks computed across the executor (in order
+        without one), and the results merged into the information cache shared by the folds.
+        """
+        cache = backtests[0].information_cache if backtests else {}
+        pending = {} # window -> (a fold of that window, {key: date missing from the cache})
+        for backtest in backtests:
+            for t in pd.date_range(start=backtest.initial_date, end=backtest.final_date, freq='D'):
+                key = backtest.information_key(t)
+                if key not in cache:
+                    pending.setdefault(backtest.s, (backtest, {}))[1].setdefault(key, t)
+        n_chunks = self.max_workers or os.cpu_count() or 1
+        chunks = []
+        for backtest, dates in pending.values():
+            # the tasks carry the fold without its data, the data module is shared or sent once per process
+            template = copy.copy(backtest)
+            template.data_module, template.information_cache = None, None
+            keys = list(dates)
+            size = -(-len(keys) // n_chunks)
+            chunks += [(template, keys[i:i + size], [dates[key] for key in keys[i:i + size]])
+                       for i in range(0, len(keys), size)]
+        tasks = [(template, chunk_dates) for template, _, chunk_dates in chunks]
+        if isinstance(executor, ProcessPoolExecutor):
+            results = executor.map(_compute_information_in_worker, tasks)
+        else:
+            results = (executor.map if executor is not None else map)(
+                lambda task: _compute_information(task[0], self.data_module, task[1]), tasks)
+        for (_, keys, _), values in zip(chunks, results):
+            cache.update(zip(keys, values))
+        logging.info(f"Precomputed {len(cache)} information sets for {len(backtests)} folds in {len(chunks)} chunks")
+        return cache
+
+    def run(self):
+        """Runs all the folds and returns a WalkForwardResult"""
+        if self.data_module is None:
+            self.data_module = self.load_data()
+        folds = self.folds()
+        if not folds:
+            raise ValueError("The period is too short for a single train/test fold")
+        information_cache = {}
+        backtests = [self.make_backtest(fold, information_cache) for fold in folds]
+        if self.use_processes:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                           initargs=(self.data_module,))
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        with executor:
+            self.precompute_information(backtests, executor)
+            if self.use_processes:
+                # each process only receives the information sets of its own fold, the prices are not needed anymore
+                for backtest in backtests:
+                    dates = pd.date_range(start=backtest.initial_date, end=backtest.final_date, freq='D')
+                    keys = [backtest.information_key(t) for t in dates]
+                    backtest.information_cache = {key: information_cache[key] for key in keys}
+                    backtest.data_module = DataModule(self.data_module.data.iloc[:0], self.data_module.time_column,
+                                                      self.data_module.precision)
+            fold_values = list(executor.map(_run_fold, backtests))
+        stitched = stitch_equity_curves(folds, fold_values, self.initial_cash)
+        return WalkForwardResult(folds, fold_values, stitched)
@@ -0,0 +1,434 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import pandas as pd
+
+from pybacktestchain_ss.blockchain import chain_lock, load_blob, store_blob
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.service import _weights, backtest_from_request
+
+#---------------------------------------------------------
+# Constants
+#---------------------------------------------------------
+
+DEFAULT_QUEUE_PATH = 'backtests/queue.db'
+DEFAULT_DATA_FOLDER = 'backtests/data' # content-addressed price data shared by the workers
+DEFAULT_LEASE = 300.0 # seconds a worker owns a job without renewing its lease
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 5.0 # seconds before the first retry of a failed job, doubled at each attempt
+
+# a job is queued, claimed by a worker (possibly ahead of time), running, then done or failed
+STATUSES = ('queued', 'claimed', 'running', 'done', 'failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    available_at REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority);
+CREATE INDEX IF NOT EXISTS idx_jobs_worker ON jobs (worker, status);
+"""
+
+#---------------------------------------------------------
+# Functions
+#---------------------------------------------------------
+
+def job_id(payload: dict):
+    """The same payload always gets the same id, so that submitting a sweep twice does not run it twice"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()[:32]
+
+def default_worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+def store_data(df: pd.DataFrame, folder: str = DEFAULT_DATA_FOLDER):
+    """store_data saves price data in the shared content-addressed store and returns its digest
+
+    Example:
+        digest = store_data(get_stocks_data(['AAPL', 'MSFT'], '2018-01-01', '2020-01-01'))
+    """
+    return store_blob(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), folder)
+
+def load_data(digest: str, folder: str = DEFAULT_DATA_FOLDER):
+    """load_data reads price data back from the shared store, checking that it is the data of the digest"""
+    return pickle.loads(load_blob(digest, folder))
+
+def submit_sweep(queue, requests: list, data: pd.DataFrame = None, data_folder: str = DEFAULT_DATA_FOLDER,
+                 priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+    """submit_sweep puts one job per backtest request, all reading the same price data, and returns the job ids
+
+    The data is stored once in the shared store and the jobs only carry its digest. Without data, each
+    worker downloads the prices of its requests.
+
+    Example:
+        ids = submit_sweep(SQLiteQueue(), [{'initial_date': '2019-01-01', 'final_date': '2020-01-01', 'risk_threshold': t}
+                                           for t in (0.05, 0.1, 0.2)], data=df)
+    """
+    digest = store_data(data, data_folder) if data is not None else None
+    return queue.put_many([{'request': request, 'data': digest} for request in requests], priority, max_attempts)
+
+def commit(backtest, values: pd.DataFrame, initial_portfolio: dict, final_portfolio: dict):
+    """commit stores the results of a backtest run without persistence, and can be repeated safely
+
+    The results file and the registry row are keyed by the backtest name, which derives from the run
+    identity, so writing them again replaces them with the same content. The block is only added if the
+    chain does not hold it already. The whole commit holds the lock of the chain, so that two workers
+    finishing the same job do not write the same files at once.
+    """
+    final_value = float(values['Portfolio value'].iloc[-1]) if len(values) else float(backtest.broker.cash)
+    backtest.broker.initialize_blockchain(backtest.name_blockchain)
+    with chain_lock(backtest.name_blockchain):
+        block = backtest.store_results(final_value, once=True)
+        backtest.cache_results(final_value, values, initial_portfolio, final_portfolio)
+    return {
+        'name': backtest.backtest_name,
+        'run_id': backtest.run_id,
+        'final_value': final_value,
+        'block_hash': block.hash,
+        'initial_portfolio': _weights(initial_portfolio),
+        'final_portfolio': _weights(final_portfolio),
+    }
+
+#---------------------------------------------------------
+# Classes
+#---------------------------------------------------------
+
+@dataclass
+class Job:
+    id: str
+    payload: dict
+    attempts: int = 0
+    priority: int = 0
+
+class WorkQueue(ABC):
+    """ Abstract base class of the queue backends the sweeps are dispatched through
+
+    A worker claims jobs under a lease, starts them one by one, renews the lease while a job runs and
+    completes or fails it. A job whose lease expires (its worker died or hangs) is claimed again by
+    another worker, and a failed one is retried until it has used its attempts.
+    """
+
+    def put(self, payload: dict, priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        return self.put_many([payload], priority, max_attempts)[0]
+
+    @abstractmethod
+    def put_many(self, payloads: list, priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> list:
+        pass
+
+    @abstractmethod
+    def claim(self, worker: str, n: int = 1, lease: float = DEFAULT_LEASE) -> list:
+        pass
+
+    @abstractmethod
+    def start(self, job_id: str, worker: str, lease: float = DEFAULT_LEASE) -> bool:
+        pass
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker: str, lease: float = DEFAULT_LEASE) -> bool:
+        pass
+
+    @abstractmethod
+    def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        pass
+
+    @abstractmethod
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        pass
+
+    @abstractmethod
+    def counts(self) -> dict:
+        pass
+
+    @abstractmethod
+    def results(self) -> dict:
+        pass
+
+    def pending(self):
+        """Number of jobs that are not done or failed yet"""
+        counts = self.counts()
+        return counts['queued'] + counts['claimed'] + counts['running']
+
+    def wait(self, timeout: float = None, poll_interval: float = 0.5):
+        """Blocks until all the jobs are done or failed, returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+@dataclass
+class SQLiteQueue(WorkQueue):
+    """ Default queue backend: a SQLite file, shared by the workers of a host or of nodes sharing a folder
+
+    Claims run in an immediate transaction, so that two workers never claim the same job. Jobs are taken
+    by priority, then in submission order. A worker with no job to claim steals half of the jobs claimed
+    ahead of time by the busiest other worker, from the end of its backlog.
+
+    Example:
+        queue = SQLiteQueue('backtests/queue.db')
+        submit_sweep(queue, requests, data=df)
+        Worker(queue).run(idle_timeout=5)
+    """
+    path: str = DEFAULT_QUEUE_PATH
+    retry_delay: float = DEFAULT_RETRY_DELAY
+
+    def __post_init__(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # short-lived connections, like the registry, and transactions handled explicitly
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def put_many(self, payloads: list, priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """Adds jobs, those already in the queue (same payload) are left as they are, returns their ids"""
+        now, ids = time.time(), [job_id(payload) for payload in payloads]
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO jobs (id, payload, priority, max_attempts, created, updated) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             [(id_, json.dumps(payload, default=str), priority, max_attempts, now, now)
+                              for id_, payload in zip(ids, payloads)])
+        return ids
+
+    def claim(self, worker: str, n: int = 1, lease: float = DEFAULT_LEASE):
+        """Claims up to n jobs for a worker: queued ones, ones whose lease expired, else stolen ones"""
+        now = time.time()
+        with self._transaction() as conn:
+            # the jobs that timed out on their last attempt are given up
+            conn.execute("UPDATE jobs SET status = 'failed', worker = NULL, lease_until = NULL, updated = ?, "
+                         "error = 'lease expired' WHERE status = 'running' AND lease_until < ? "
+                         "AND attempts >= max_attempts", (now, now))
+            rows = conn.execute("SELECT id FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                                "OR (status IN ('claimed', 'running') AND lease_until < ?) "
+                                "ORDER BY priority DESC, rowid LIMIT ?", (now, now, n)).fetchall()
+            if not rows:
+                rows = self._steal(conn, worker, n)
+            ids = [row[0] for row in rows]
+            conn.executemany("UPDATE jobs SET status = 'claimed', worker = ?, lease_until = ?, updated = ? WHERE id = ?",
+                             [(worker, now + lease, now, id_) for id_ in ids])
+            jobs = [conn.execute("SELECT id, payload, attempts, priority FROM jobs WHERE id = ?", (id_,)).fetchone()
+                    for id_ in ids]
+        return [Job(id_, json.loads(payload), attempts, priority) for id_, payload, attempts, priority in jobs]
+
+    def _steal(self, conn, worker: str, n: int):
+        victim = conn.execute("SELECT worker, COUNT(*) FROM jobs WHERE status = 'claimed' AND worker != ? "
+                              "GROUP BY worker ORDER BY COUNT(*) DESC LIMIT 1", (worker,)).fetchone()
+        if victim is None:
+            return []
+        # the victim works through its backlog from the front, the thief takes from the back
+        return conn.execute("SELECT id FROM jobs WHERE status = 'claimed' AND worker = ? "
+                            "ORDER BY priority, rowid DESC LIMIT ?",
+                            (victim[0], min(n, max(victim[1] // 2, 1)))).fetchall()
+
+    def start(self, job_id: str, worker: str, lease: float = DEFAULT_LEASE):
+        """Starts a claimed job, False if it was stolen or reclaimed in the meantime"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                                  "updated = ? WHERE id = ? AND worker = ? AND status = 'claimed'",
+                                  (now + lease, now, job_id, worker))
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id: str, worker: str, lease: float = DEFAULT_LEASE):
+        """Renews the lease of a job, False if the worker does not own it anymore"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? "
+                                  "AND status IN ('claimed', 'running')", (now + lease, now, job_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker: str, result: dict):
+        """Marks a job done with its result, the first worker to finish it wins, returns False for the others"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'done', worker = ?, lease_until = NULL, result = ?, "
+                                  "error = NULL, updated = ? WHERE id = ? AND status != 'done'",
+                                  (worker, json.dumps(result, default=str), now, job_id))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker: str, error: str):
+        """Queues a failed job again after a delay growing with its attempts, or fails it for good"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                "worker = NULL, lease_until = NULL, error = ?, updated = ?, "
+                "available_at = ? + ? * (1 << MAX(attempts - 1, 0)) WHERE id = ? AND worker = ? AND status = 'running'",
+                (error, now, now, self.retry_delay, job_id, worker))
+        return cursor.rowcount == 1
+
+    def counts(self):
+        """Number of jobs in each status"""
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+    def results(self):
+        """Results of the done jobs, by job id"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT id, result FROM jobs WHERE status = 'done'").fetchall()
+        return {id_: json.loads(result) for id_, result in rows}
+
+    def job(self, job_id: str):
+        """The row of a job as a dict, None if there is no such job"""
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else dict(row)
+
+class _Heartbeat:
+    """ Renews the lease of a job from a background thread while it runs """
+
+    def __init__(self, queue: WorkQueue, job_id: str, worker: str, lease: float):
+        self.queue, self.job_id, self.worker, self.lease = queue, job_id, worker, lease
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker, self.lease):
+                    return
+            except sqlite3.Error as e:
+                logging.warning(f"Could not renew the lease of job {self.job_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+@dataclass
+class Worker:
+    """ Pulls jobs from a queue and runs them until there are none left
+
+    The price data is read from the shared content-addressed store and stays loaded across the jobs
+    of the same data. The results go through commit, so that a job run twice (after a lease expired,
+    or by a thief and its victim) stores them once.
+
+    Args:
+        queue (WorkQueue): Where the jobs come from
+        prefetch (int): Jobs claimed at once, the ones not started yet can be stolen by idle workers
+        runner (Callable): Called with (payload, worker) instead of run_job, returns the JSON result
+
+    Example:
+        Worker(SQLiteQueue('/shared/sweep/queue.db'), data_folder='/shared/sweep/data').run(idle_timeout=60)
+    """
+    queue: WorkQueue
+    name: str = field(default_factory=default_worker_name)
+    lease: float = DEFAULT_LEASE
+    prefetch: int = 1
+    data_folder: str = DEFAULT_DATA_FOLDER
+    poll_interval: float = 0.5
+    runner: Optional[Callable] = None
+
+    def __post_init__(self):
+        self._claimed = deque()
+        self._data = {} # digest -> DataModule of the last data used
+
+    def data_module(self, digest: str):
+        if digest not in self._data:
+            # one data set at a time: a sweep shares its data, keeping older ones would only hold memory
+            self._data = {digest: DataModule(load_data(digest, self.data_folder))}
+        return self._data[digest]
+
+    def run_job(self, payload: dict):
+        """Runs the backtest of a job and commits its results"""
+        overrides = {'verbose': False, 'persist': False, 'use_cache': False}
+        if payload.get('data') is not None:
+            overrides['data_module'] = self.data_module(payload['data'])
+        backtest = backtest_from_request(payload['request'], **overrides)
+        values, initial_portfolio, final_portfolio = backtest.run_backtest()
+        return commit(backtest, values, initial_portfolio, final_portfolio)
+
+    def step(self):
+        """Runs the next job, returns False if there was none to run"""
+        if not self._claimed:
+            self._claimed.extend(self.queue.claim(self.name, self.prefetch, self.lease))
+        while self._claimed:
+            job = self._claimed.popleft()
+            if not self.queue.start(job.id, self.name, self.lease):
+                logging.info(f"Job {job.id} was taken over by another worker")
+                continue
+            try:
+                with _Heartbeat(self.queue, job.id, self.name, self.lease):
+                    result = self.run_job(job.payload) if self.runner is None else self.runner(job.payload, self)
+            except Exception as e:
+                logging.warning(f"Job {job.id} failed on attempt {job.attempts + 1}: {e!r}")
+                self.queue.fail(job.id, self.name, repr(e))
+            else:
+                self.queue.complete(job.id, self.name, result)
+            return True
+        return False
+
+    def run(self, max_jobs: int = None, idle_timeout: float = None):
+        """Runs jobs until max_jobs ran, or no job came for idle_timeout seconds, returns the number that ran"""
+        ran, idle_since = 0, time.monotonic()
+        while max_jobs is None or ran < max_jobs:
+            if self.step():
+                ran, idle_since = ran + 1, time.monotonic()
+            elif idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                break
+            else:
+                time.sleep(self.poll_interval)
+        return ran
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pybacktestchain_ss.work_queue',
+                                     description='Run the backtests of a shared work queue')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help='Path of the SQLite queue')
+    parser.add_argument('--data', default=DEFAULT_DATA_FOLDER, help='Folder of the shared price data')
+    parser.add_argument('--prefetch', type=int, default=1, help='Jobs claimed at once')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE, help='Seconds before an unrenewed job is retried')
+    parser.add_argument('--idle-timeout', type=float, default=None, help='Stop after this many seconds without jobs')
+    args = parser.parse_args(argv)
+    worker = Worker(SQLiteQueue(args.queue), lease=args.lease, prefetch=args.prefetch, data_folder=args.data)
+    try:
+        ran = worker.run(idle_timeout=args.idle_timeout)
+        logging.info(f"Worker {worker.name} ran {ran} jobs")
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
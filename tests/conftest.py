@@ -0,0 +1,23 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+def random_walk_prices(tickers=("AAPL", "MSFT", "WMT"), start="2018-06-01", end="2019-06-01", seed=0,
+                       drift=0.0005, volatility=0.02, tz=None):
+    """Long-format daily prices (Date, ticker, Adj Close): one geometric random walk from 100 per ticker
+
+    drift is the daily drift of every ticker, or a sequence with one drift per ticker.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, end, tz=tz)
+    drifts = np.broadcast_to(drift, len(tickers))
+    dfs = []
+    for ticker, mu in zip(tickers, drifts):
+        close = 100 * np.exp(np.cumsum(rng.normal(mu, volatility, len(dates))))
+        dfs.append(pd.DataFrame({"Date": dates, "ticker": ticker, "Adj Close": close}))
+    return pd.concat(dfs, ignore_index=True)
+
+@pytest.fixture
+def make_prices():
+    """The random_walk_prices factory, e.g. make_prices(tickers=("AAPL", "IBM"), seed=1)"""
+    return random_walk_prices
@@ -0,0 +1,90 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.analytics import RunPanel, compute_metrics, rolling_metrics, traded_notional
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.broker import Backtest, Broker
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+def make_curves(n_runs=5, seed=0):
+    rng = np.random.default_rng(seed)
+    runs = {}
+    for i in range(n_runs):
+        # runs of different lengths, some on other dates
+        dates = pd.bdate_range("2020-01-01", periods=200 + 20 * i)[5 * i:]
+        values = 1e6 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+        runs[f"run{i}"] = (pd.DataFrame({"Date": dates, "Portfolio value": values}), None)
+    return runs
+
+def test_metrics_match_one_run_at_a_time():
+    runs = make_curves()
+    panel = RunPanel.from_runs(runs, periods_per_year=252)
+    metrics = compute_metrics(panel)
+    for name, (df, _) in runs.items():
+        values = df.set_index("Date")["Portfolio value"]
+        returns = values.pct_change().dropna()
+        row = metrics.loc[name]
+        assert row["total_return"] == pytest.approx(values.iloc[-1] / values.iloc[0] - 1)
+        assert row["volatility"] == pytest.approx(returns.std() * np.sqrt(252))
+        assert row["sharpe"] == pytest.approx(returns.mean() / returns.std() * np.sqrt(252))
+        assert row["max_drawdown"] == pytest.approx((values / values.cummax() - 1).min())
+        assert row["start"] == values.index[0] and row["end"] == values.index[-1]
+    rolling = panel.rolling(20)
+    values = runs["run2"][0].set_index("Date")["Portfolio value"]
+    returns = values.pct_change()
+    np.testing.assert_allclose(rolling["volatility"]["run2"].loc[values.index],
+                               returns.rolling(19).std() * np.sqrt(252), rtol=1e-8)
+    np.testing.assert_allclose(rolling["drawdown"]["run2"].loc[values.index],
+                               values / values.rolling(20).max() - 1)
+    np.testing.assert_allclose(rolling["return"]["run2"].loc[values.index], values.pct_change(19))
+
+def test_rolling_window_edges():
+    panel = RunPanel.from_runs(make_curves(), periods_per_year=252)
+    for window in (0, 1):
+        with pytest.raises(ValueError, match="at least 2"):
+            rolling_metrics(panel, window)
+    # a window of two values has one return: a return and a drawdown, but no volatility
+    rolling = panel.rolling(2)
+    assert rolling["volatility"].isna().all().all() and rolling["return"].notna().any().all()
+
+def test_drawdown_durations():
+    dates = pd.date_range("2024-01-01", periods=8, freq="D")
+    values = [100, 110, 105, 100, 111, 108, 109, 107]
+    panel = RunPanel.from_runs({"a": (pd.DataFrame({"Date": dates, "Portfolio value": values}), None)})
+    assert panel.periods_per_year == pytest.approx(365.25)
+    assert list(panel.drawdown_durations[0] / pd.Timedelta(days=1).value) == [0, 0, 1, 2, 0, 1, 2, 3]
+    metrics = panel.metrics().loc["a"]
+    assert metrics["max_drawdown_duration"] == metrics["current_drawdown_duration"] == pd.Timedelta(days=3)
+    assert metrics["max_drawdown"] == pytest.approx(100 / 110 - 1)
+
+def test_turnover():
+    dates = pd.date_range("2024-01-01", periods=4, freq="D")
+    broker = Broker(cash=1000, verbose=False)
+    broker.buy("AAPL", 5, 100.0, dates[0])
+    broker.sell("AAPL", 5, 110.0, dates[2] - timedelta(hours=1))
+    log = broker.get_transaction_log()
+    assert list(traded_notional(log, dates)) == [500.0, 0.0, 550.0, 0.0]
+    panel = RunPanel.from_runs({"a": (pd.DataFrame({"Date": dates, "Portfolio value": [1000.0, 1050, 1050, 1050]}), log)},
+                               periods_per_year=3)
+    metrics = panel.metrics().loc["a"]
+    assert metrics["n_trades"] == 2
+    assert metrics["turnover"] == pytest.approx(1050 / np.mean([1000.0, 1050, 1050, 1050]))
+
+def test_backtest_performance(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices()
+    names = []
+    for days in (90, 120):
+        backtest = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 4, 1),
+                            universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                            s=timedelta(days=days), verbose=False, registry_path=None, data_module=DataModule(data))
+        values, _, _ = backtest.run_backtest()
+        names.append(backtest.backtest_name)
+        performance = backtest.performance()
+        assert performance["final_value"] == pytest.approx(values["Portfolio value"].iloc[-1])
+        assert performance["n_trades"] == len(backtest.broker.get_transaction_log())
+    # in bulk over the stored runs
+    metrics = RunPanel.from_cache().metrics()
+    assert sorted(metrics.index) == sorted(names)
+    assert metrics.loc[names[-1], "sharpe"] == pytest.approx(performance["sharpe"])
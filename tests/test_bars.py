@@ -0,0 +1,109 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.bars import fetch_interval, interval_to_timedelta, resample_bars
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.broker import Backtest, Broker, RebalanceFlag
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+def make_minute_data(days=3, tickers=("AAPL", "MSFT", "WMT"), seed=0):
+    """Synthetic minute bars of the regular session, 390 bars a day"""
+    rng = np.random.default_rng(seed)
+    times = pd.DatetimeIndex(np.concatenate([
+        pd.date_range(day + pd.Timedelta(hours=9, minutes=30), periods=390, freq="min")
+        for day in pd.bdate_range("2024-01-02", periods=days)]))
+    dfs = []
+    for ticker in tickers:
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(times))))
+        dfs.append(pd.DataFrame({"Date": times, "ticker": ticker, "Adj Close": close,
+                                 "Volume": rng.integers(100, 1000, len(times))}))
+    return pd.concat(dfs, ignore_index=True)
+
+class EveryDay(RebalanceFlag):
+    def time_to_rebalance(self, t: datetime):
+        return True
+
+def test_intervals():
+    assert interval_to_timedelta("15m") == pd.Timedelta(minutes=15)
+    assert interval_to_timedelta("1h") == pd.Timedelta(hours=1)
+    assert fetch_interval("1m") == "1m"
+    assert fetch_interval("10m") == "5m"
+    assert fetch_interval("4h") == "60m"
+    with pytest.raises(ValueError):
+        interval_to_timedelta("1 fortnight")
+
+def test_resample_bars():
+    data = make_minute_data(days=1, tickers=("AAPL",))
+    bars = resample_bars(data, "15m")
+    assert len(bars) == 26
+    assert bars.columns.tolist() == data.columns.tolist()
+    first = data.iloc[:15]
+    assert bars["Adj Close"].iloc[0] == first["Adj Close"].iloc[-1]
+    assert bars["Volume"].iloc[0] == first["Volume"].sum()
+    assert bars["Date"].iloc[1] == pd.Timestamp("2024-01-02 09:45")
+
+def test_bar_panel_matches_information():
+    data = make_minute_data()
+    data = data.drop(index=data.sample(frac=0.05, random_state=0).index)
+    info = FirstTwoMoments(s=timedelta(days=1), data_module=DataModule(data), adj_close_column="Adj Close")
+    panel = info.bar_panel()
+    assert panel is info.data_module.bar_panel("Date", "ticker", "Adj Close")
+    for i in (1, 100, 390, 391, 700):
+        t = pd.Timestamp(panel.times[i])
+        assert panel.prices_at(i) == pytest.approx(info.get_prices(t))
+    start, stop = panel.range("2024-01-03", "2024-01-03 23:59")
+    assert stop - start == 390 and pd.Timestamp(panel.times[start]) == pd.Timestamp("2024-01-03 09:30")
+
+def test_information_at_bar_matches_compute_information():
+    info = FirstTwoMoments(s=timedelta(minutes=45), data_module=DataModule(make_minute_data()), adj_close_column="Adj Close")
+    panel = info.bar_panel()
+    for i in (200, 390, 500):
+        expected = info.compute_information(pd.Timestamp(panel.times[i]))
+        information_set = info.compute_information_at_bar(i)
+        assert list(information_set["companies"]) == list(expected["companies"])
+        np.testing.assert_allclose(information_set["expected_return"], expected["expected_return"])
+        np.testing.assert_allclose(information_set["covariance_matrix"], expected["covariance_matrix"])
+    # a window in bars instead of a period
+    info.window_bars = 30
+    t = pd.Timestamp(panel.times[500])
+    assert len(info.slice_data(t)) == 30 * 3
+    np.testing.assert_allclose(info.compute_information_at_bar(500)["covariance_matrix"],
+                               info.compute_information(t)["covariance_matrix"])
+
+def test_rebalance_mask():
+    times = pd.DatetimeIndex(make_minute_data(days=5, tickers=("AAPL",))["Date"])
+    mask = EveryDay().rebalance_mask(times)
+    assert mask.sum() == 5
+    assert list(times[mask].time) == [pd.Timestamp("09:30").time()] * 5
+
+def test_bar_backtest_matches_reference(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = make_minute_data()
+    backtest = Backtest(initial_date=datetime(2024, 1, 2, 12), final_date=datetime(2024, 1, 4, 16),
+                        universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                        information_class=FirstTwoMoments, s=timedelta(hours=2), rebalance_flag=EveryDay,
+                        interval="1m", bar_chunk_size=100, verbose=False, persist=False,
+                        data_module=DataModule(data.copy()))
+    values, initial_portfolio, final_portfolio = backtest.run_backtest()
+    # reference: the pandas information sets and a valuation bar by bar
+    info = FirstTwoMoments(s=timedelta(hours=2), data_module=DataModule(data.copy()), adj_close_column="Adj Close",
+                           portfolio_strategy=MinimumVarianceStrategy)
+    panel = info.bar_panel()
+    start, stop = panel.range(backtest.initial_date, backtest.final_date)
+    broker = Broker(cash=backtest.initial_cash, verbose=False)
+    expected, previous_day = [], None
+    for i in range(start, stop):
+        t = pd.Timestamp(panel.times[i])
+        if t.normalize() != previous_day:
+            portfolio = info.compute_portfolio(info.compute_information(t))
+            broker.execute_portfolio(portfolio, info.get_prices(t), t)
+            previous_day = t.normalize()
+        prices = panel.filled[i - 1]
+        expected.append(broker.cash + sum(p.quantity * prices[panel.column(ticker)] for ticker, p in broker.positions.items()))
+    assert len(values) == stop - start == 390 * 2 + 240
+    np.testing.assert_allclose(values["Portfolio value"], expected, rtol=1e-12)
+    assert final_portfolio == pytest.approx(portfolio)
+    # one valuation row per day, the last bar of each day
+    assert len(backtest.valuation.dates) == 3
+    np.testing.assert_allclose(backtest.valuation.portfolio_values, values.groupby(values["Date"].dt.normalize())["Portfolio value"].last())
@@ -1,6 +1,5 @@
 import pytest
 import os
-import time
 from pybacktestchain.blockchain import Block, Blockchain, load_blockchain, remove_blockchain
 import hashlib
 
@@ -91,4 +90,183 @@ def test_blockchain_to_string(test_blockchain):
     test_blockchain.add_block(name="Block 1", data="Data 1")
     blockchain_str = str(test_blockchain)
     assert "Block 1" in blockchain_str
-    assert "Genesis Block" in blockchain_str
\ No newline at end of file
+    assert "Genesis Block" in blockchain_str
+
+# Compact results payloads of pybacktestchain_ss
+import pandas as pd
+from datetime import datetime
+from pybacktestchain_ss.blockchain import (
+    encode_trades,
+    merkle_root,
+    merkle_proof,
+    verify_merkle_proof,
+    results_payload,
+    parse_payload,
+    load_results,
+)
+
+@pytest.fixture
+def transaction_log():
+    return pd.DataFrame({
+        "Date": [datetime(2019, 1, 31), datetime(2019, 1, 31), datetime(2019, 2, 28)],
+        "Action": ["BUY", "BUY", "SELL"],
+        "Ticker": ["AAPL", "MSFT", "AAPL"],
+        "Quantity": [10, 5, 10],
+        "Price": [39.45888137817383, 100.1, 41.935035705566406],
+        "Cash": [605.41, 104.91, 524.26],
+    })
+
+def test_merkle_proofs(transaction_log):
+    _, records = encode_trades(transaction_log)
+    root = merkle_root(records)
+    for i, record in enumerate(records):
+        assert verify_merkle_proof(record, merkle_proof(records, i), root)
+    # a modified trade does not verify
+    assert not verify_merkle_proof(records[0] + b"x", merkle_proof(records, 0), root)
+
+def test_results_payload(transaction_log, tmp_path):
+    folder = str(tmp_path / "blobs")
+    data = results_payload(transaction_log, folder)
+    payload = parse_payload(data)
+    assert payload["n"] == 3
+    # the block only holds a short digest, whatever the size of the log
+    assert len(data) < 200
+    assert parse_payload("Data 1") is None
+
+    block = Block(name_backtest="RedFoxCarpenter", data=data, previous_hash="0")
+    log = load_results(block, folder)
+    assert log["Ticker"].tolist() == ["AAPL", "MSFT", "AAPL"]
+    assert log["Price"].tolist() == transaction_log["Price"].tolist()
+    assert log["Date"].tolist() == transaction_log["Date"].tolist()
+
+def test_results_payload_tampering(transaction_log, tmp_path):
+    folder = str(tmp_path / "blobs")
+    block = Block(name_backtest="RedFoxCarpenter", data=results_payload(transaction_log, folder), previous_hash="0")
+    blob = os.path.join(folder, parse_payload(block.data)["blob"] + ".bin")
+    with open(blob, "ab") as f:
+        f.write(b"tampered")
+    with pytest.raises(ValueError):
+        load_results(block, folder)
+
+
+# Concurrent writers on the chain store of pybacktestchain_ss
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pybacktestchain_ss.blockchain import open_blockchain, load_blockchain as load_blockchain_ss
+
+def _append_blocks(args):
+    writer, n_blocks = args
+    blockchain = open_blockchain("stress")
+    for i in range(n_blocks):
+        blockchain.add_block(f"writer{writer}-block{i}", f"data {writer} {i}")
+    return n_blocks
+
+@pytest.mark.parametrize("executor", [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_concurrent_writers(tmp_path, monkeypatch, executor):
+    monkeypatch.chdir(tmp_path)
+    n_writers, n_blocks = 8, 15
+    with executor(max_workers=n_writers) as pool:
+        assert sum(pool.map(_append_blocks, [(w, n_blocks) for w in range(n_writers)])) == n_writers * n_blocks
+
+    blockchain = load_blockchain_ss("stress")
+    # no block was lost and the links are intact
+    assert len(blockchain.chain) == 1 + n_writers * n_blocks
+    assert blockchain.is_valid()
+    names = {block.name_backtest for block in blockchain.chain[1:]}
+    assert names == {f"writer{w}-block{i}" for w in range(n_writers) for i in range(n_blocks)}
+
+def test_add_blocks_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = open_blockchain("batch")
+    stale = load_blockchain_ss("batch")
+    blocks = blockchain.add_blocks([(f"Block {i}", f"Data {i}") for i in range(5)])
+    assert [b.name_backtest for b in blocks] == [f"Block {i}" for i in range(5)]
+    # a writer holding an outdated copy is rebased on the stored tip instead of overwriting it
+    stale.add_block("Late block", "Late data")
+    stored = load_blockchain_ss("batch")
+    assert len(stored.chain) == 7
+    assert stored.chain[-1].previous_hash == blocks[-1].hash
+    assert stored.is_valid()
+
+# Snapshots and archive compaction of pybacktestchain_ss
+import json
+import pickle
+from pybacktestchain_ss.blockchain import read_snapshot
+
+def test_compaction_keeps_the_links(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = open_blockchain("long")
+    blockchain.snapshot_interval = 10
+    for i in range(5):
+        blockchain.add_blocks([(f"Block {i}-{j}", f"Data {i} {j}") for j in range(7)])
+    stored = load_blockchain_ss("long")
+    # only the recent blocks are left in the chain file, the others are in signed archive segments
+    assert stored.height == 36 and len(stored.chain) <= 10
+    assert stored.chain[0].previous_hash == stored.base_hash == read_snapshot("long")["tip"]
+    assert stored.is_valid() and stored.verify_full()
+    headers = stored.headers()
+    assert [h.height for h in headers] == list(range(36))
+    assert [h.name_backtest for h in headers[1:]] == [f"Block {i}-{j}" for i in range(5) for j in range(7)]
+    assert all(h.previous_hash == p.hash for p, h in zip(headers, headers[1:]))
+    # appending after a reload goes on from the tip
+    stored.add_block("Last", "Last data")
+    assert load_blockchain_ss("long").chain[-1].previous_hash == headers[-1].hash
+
+def test_open_does_not_grow_with_history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = open_blockchain("history")
+    blockchain.snapshot_interval = 50
+    for i in range(20):
+        blockchain.add_blocks([(f"Block {i}-{j}", "x" * 1000) for j in range(50)])
+    assert os.path.getsize("blockchain/history.pkl") < 51 * 2000
+    assert open_blockchain("history").height == 1001
+
+def test_tampered_archive_fails_full_verification(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = open_blockchain("tamper")
+    blockchain.add_blocks([(f"Block {i}", f"Data {i}") for i in range(10)])
+    blockchain.compact()
+    assert blockchain.verify_full()
+    archive = tmp_path / "blockchain" / "tamper.archive"
+    blocks_file = next(archive.glob("*.blocks.pkl"))
+    original = blocks_file.read_bytes()
+    blocks = pickle.loads(original)
+    blocks[3].data = "Forged data"
+    blocks_file.write_bytes(pickle.dumps(blocks))
+    assert not load_blockchain_ss("tamper").verify_full()
+    # the recent blocks alone still check out, the archive is only read on demand
+    assert load_blockchain_ss("tamper").is_valid()
+    blocks_file.write_bytes(original)
+    assert load_blockchain_ss("tamper").verify_full()
+
+def test_forged_snapshot_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = open_blockchain("forged")
+    blockchain.add_blocks([(f"Block {i}", f"Data {i}") for i in range(4)])
+    blockchain.compact()
+    path = tmp_path / "blockchain" / "forged.snapshot.json"
+    snapshot = json.loads(path.read_text())
+    snapshot["height"] += 1
+    path.write_text(json.dumps(snapshot))
+    with pytest.raises(ValueError):
+        open_blockchain("forged")
+
+def test_interrupted_compaction_and_legacy_chains(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = open_blockchain("legacy")
+    blockchain.add_blocks([(f"Block {i}", f"Data {i}") for i in range(6)])
+    # a chain pickled before compaction existed has no base fields in its state
+    state = dict(blockchain.__dict__)
+    for key in ("base_height", "base_hash", "snapshot_interval"):
+        del blockchain.__dict__[key]
+    with open("blockchain/legacy.pkl", "wb") as f:
+        pickle.dump(blockchain, f)
+    blockchain.__dict__.update(state)
+    legacy = load_blockchain_ss("legacy")
+    assert legacy.height == 7 and legacy.verify_full()
+    # a crash after the snapshot was written but before the chain file: the archived blocks are dropped on read
+    full_chain = open("blockchain/legacy.pkl", "rb").read()
+    legacy.compact(keep=2)
+    open("blockchain/legacy.pkl", "wb").write(full_chain)
+    reconciled = load_blockchain_ss("legacy")
+    assert (reconciled.base_height, len(reconciled.chain)) == (5, 2)
+    assert reconciled.verify_full()
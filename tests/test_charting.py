@@ -0,0 +1,39 @@
+import pytest
+import numpy as np
+import pandas as pd
+from pybacktestchain_ss.charting import lttb_indices, minmax_indices, downsample, top_weights
+
+@pytest.fixture
+def long_series():
+    dates = pd.date_range(start="2000-01-01", periods=10000, freq="D")
+    values = 1e6 + np.cumsum(np.sin(np.arange(10000) / 50.0) * 1000)
+    # a single sharp drawdown that a naive decimation would miss
+    values[5003] -= 50000
+    return pd.DataFrame({"Date": dates, "Portfolio value": values})
+
+def test_lttb_keeps_endpoints(long_series):
+    idx = lttb_indices(long_series["Date"].to_numpy(), long_series["Portfolio value"].to_numpy(), 500)
+    assert len(idx) == 500
+    assert idx[0] == 0 and idx[-1] == len(long_series) - 1
+    assert np.all(np.diff(idx) > 0)
+
+def test_minmax_keeps_extremes(long_series):
+    idx = minmax_indices(long_series["Portfolio value"].to_numpy(), 100)
+    assert len(idx) <= 202
+    assert 5003 in idx
+
+def test_downsample(long_series):
+    small = downsample(long_series, max_points=300)
+    assert len(small) == 300
+    assert small["Portfolio value"].min() == long_series["Portfolio value"].min()
+    # short series are returned untouched
+    assert len(downsample(long_series.head(10), max_points=300)) == 10
+    with pytest.raises(ValueError):
+        downsample(long_series, max_points=300, method="unknown")
+
+def test_top_weights():
+    portfolio = {f"T{i}": 1 / 20 for i in range(20)}
+    grouped = top_weights(portfolio, max_slices=5)
+    assert len(grouped) == 5
+    assert grouped["Other"] == pytest.approx(16 / 20)
+    assert sum(grouped.values()) == pytest.approx(1.0)
@@ -0,0 +1,86 @@
+import pytest
+import os
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.broker import Backtest, EndOfMonth
+from pybacktestchain_ss.checkpoint import CheckpointStore
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+TICKERS = ("AAPL", "MSFT", "WMT", "IBM")
+
+def make_backtest(final_date, data, **kwargs):
+    return Backtest(initial_date=datetime(2019, 1, 1), final_date=final_date, universe=list(TICKERS),
+                    portfolio_strategy=MinimumVarianceStrategy, s=timedelta(days=120), strategy_batch_size=16,
+                    verbose=False, persist=False, data_module=DataModule(data), **kwargs)
+
+@pytest.fixture
+def count_information(monkeypatch):
+    """Counts the information sets computed, i.e. the dates actually simulated"""
+    calls = []
+    compute_information = FirstTwoMoments.compute_information
+    def counted(self, t):
+        calls.append(t)
+        return compute_information(self, t)
+    monkeypatch.setattr(FirstTwoMoments, "compute_information", counted)
+    return calls
+
+def test_extend_matches_full_run(tmp_path, monkeypatch, count_information, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(TICKERS)
+    full_run = make_backtest(datetime(2019, 5, 20), data)
+    expected, _, expected_final = full_run.run_backtest()
+
+    backtest = make_backtest(datetime(2019, 3, 1), data[data["Date"] <= "2019-03-01"], checkpoint_interval=20)
+    backtest.run_backtest()
+    count_information.clear()
+    values, _, final = backtest.extend(datetime(2019, 5, 20), DataModule(data))
+    # only the new dates were simulated
+    assert min(count_information) == pd.Timestamp("2019-03-02") and len(count_information) == 80
+    pd.testing.assert_frame_equal(values, expected)
+    pd.testing.assert_frame_equal(backtest.broker.get_transaction_log(), full_run.broker.get_transaction_log())
+    assert final == expected_final
+
+def test_resume_after_crash(tmp_path, monkeypatch, count_information, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(TICKERS)
+    expected, _, _ = make_backtest(datetime(2019, 5, 1), data).run_backtest()
+    time_to_rebalance = EndOfMonth.time_to_rebalance
+    def crash(self, t):
+        if t >= pd.Timestamp("2019-04-10"):
+            raise RuntimeError("crash")
+        return time_to_rebalance(self, t)
+    monkeypatch.setattr(EndOfMonth, "time_to_rebalance", crash)
+    with pytest.raises(RuntimeError):
+        make_backtest(datetime(2019, 5, 1), data, checkpoint_interval=30).run_backtest()
+    monkeypatch.setattr(EndOfMonth, "time_to_rebalance", time_to_rebalance)
+    count_information.clear()
+    backtest = make_backtest(datetime(2019, 5, 1), data, checkpoint_interval=30)
+    values, _, _ = backtest.run_backtest()
+    # resumed from the checkpoint after 96 dates (a multiple of the batch size past the interval)
+    assert min(count_information) == pd.Timestamp("2019-04-07")
+    pd.testing.assert_frame_equal(values, expected)
+
+def test_checkpoint_not_used_on_other_data(tmp_path, monkeypatch, count_information, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(TICKERS)
+    make_backtest(datetime(2019, 3, 1), data, checkpoint_interval=20).run_backtest()
+    # the history before the checkpoint changed (e.g. new adjusted prices), the run starts over
+    changed = make_prices(TICKERS, seed=1)
+    count_information.clear()
+    values, _, _ = make_backtest(datetime(2019, 4, 1), changed, checkpoint_interval=20).run_backtest()
+    assert min(count_information) == pd.Timestamp("2019-01-01")
+    expected, _, _ = make_backtest(datetime(2019, 4, 1), changed).run_backtest()
+    pd.testing.assert_frame_equal(values, expected)
+
+def test_ledger_is_appended(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    backtest = make_backtest(datetime(2019, 5, 1), make_prices(TICKERS), checkpoint_interval=16)
+    backtest.run_backtest()
+    checkpoint, frames = CheckpointStore().load(backtest.lineage)
+    assert checkpoint.next_index == 121 and checkpoint.date == pd.Timestamp("2019-05-01")
+    # one ledger frame per checkpoint with trades, together the whole transaction log
+    assert len(frames) > 1
+    pd.testing.assert_frame_equal(pd.concat(frames), backtest.broker.get_transaction_log())
+    assert checkpoint.ledger_offset == os.path.getsize(CheckpointStore().ledger_path(backtest.lineage))
+    assert dict(zip(checkpoint.tickers, checkpoint.quantities)) == {t: p.quantity for t, p in backtest.broker.positions.items()}
@@ -0,0 +1,122 @@
+import pytest
+import json
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.cli import BatchRunner, expand_config, load_config, main, read_prices
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+from pybacktestchain_ss.price_store import PriceStore
+from pybacktestchain_ss.service import backtest_from_request
+
+
+TOML = """
+persist = false
+
+[data]
+file = "prices.csv"
+
+[defaults]
+universe = ["AAPL", "MSFT", "WMT"]
+s = 90
+initial_date = 2019-01-01
+final_date = 2019-05-01
+
+[[backtests]]
+label = "minvar"
+portfolio_strategy = "MinimumVarianceStrategy"
+
+[[backtests]]
+label = "risk-averse"
+portfolio_strategy = "RiskAverseStrategy"
+"""
+
+YAML = """
+persist: false
+data: {file: prices.csv}
+defaults: {universe: [AAPL, MSFT, WMT], s: 90}
+backtests:
+  - {label: minvar, initial_date: 2019-01-01, final_date: 2019-05-01, portfolio_strategy: MinimumVarianceStrategy}
+  - {label: bad, initial_date: 2019-01-01, final_date: 2019-05-01, universe: [NOPE]}
+"""
+
+def load_config_text(tmp_path, text, name="batch.toml"):
+    (tmp_path / name).write_text(text)
+    return load_config(str(tmp_path / name))
+
+def test_formats_expand_to_the_same_requests(tmp_path):
+    (tmp_path / "batch.toml").write_text(TOML)
+    config = load_config(str(tmp_path / "batch.toml"))
+    (tmp_path / "batch.json").write_text(json.dumps(config, default=str))
+    requests = expand_config(config)
+    assert [label for label, _ in requests] == ["minvar", "risk-averse"]
+    assert requests[1][1]["s"] == 90 and requests[1][1]["portfolio_strategy"] == "RiskAverseStrategy"
+    assert expand_config(load_config(str(tmp_path / "batch.json")))[0][1]["initial_date"] == "2019-01-01"
+    (tmp_path / "bad.json").write_text(json.dumps({"backtest": []}))
+    with pytest.raises(ValueError):
+        load_config(str(tmp_path / "bad.json"))
+
+def test_batch_loads_once_and_shares_information(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(start="2018-09-01")
+    data.to_csv("prices.csv", index=False)
+    calls = []
+    compute_information = FirstTwoMoments.compute_information
+    def counted(self, t):
+        calls.append(t)
+        return compute_information(self, t)
+    monkeypatch.setattr(FirstTwoMoments, "compute_information", counted)
+    runner = BatchRunner(expand_config(load_config_text(tmp_path, TOML)), {"file": "prices.csv"}, persist=False)
+    records = runner.run()
+    # the second strategy reuses the information sets of the first
+    assert len(calls) == len(set(calls)) and all(r["status"] == "done" for r in records)
+    expected, _, _ = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 5, 1),
+                              universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                              s=timedelta(days=90), verbose=False, persist=False,
+                              data_module=DataModule(data)).run_backtest()
+    assert records[0]["final_value"] == pytest.approx(expected["Portfolio value"].iloc[-1])
+    assert {"sharpe", "max_drawdown", "run_id"} <= set(records[0])
+
+@pytest.mark.parametrize("order", [("float64", "float32"), ("float32", "float64")])
+def test_each_precision_has_its_own_information(tmp_path, monkeypatch, order, make_prices):
+    monkeypatch.chdir(tmp_path)
+    make_prices(start="2018-09-01").to_csv("prices.csv", index=False)
+    defaults = load_config_text(tmp_path, TOML)["defaults"]
+    requests = [(precision, {**defaults, "portfolio_strategy": "MinimumVarianceStrategy", "precision": precision})
+                for precision in order]
+    runner = BatchRunner(requests, {"file": "prices.csv"}, persist=False)
+    records = {record["label"]: record for record in runner.run()}
+    for label, backtest in runner.backtests:
+        assert backtest.data_module.data["Adj Close"].dtype == label
+        expected, _, _ = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 5, 1),
+                                  universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                                  s=timedelta(days=90), verbose=False, persist=False, precision=label,
+                                  data_module=DataModule(read_prices("prices.csv"))).run_backtest()
+        assert records[label]["final_value"] == pytest.approx(expected["Portfolio value"].iloc[-1], rel=1e-12)
+    assert records["float32"]["final_value"] != records["float64"]["final_value"]
+
+def test_run_id_does_not_depend_on_the_batch(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    PriceStore.write(make_prices(start="2018-01-01"), "store")
+    request = {**load_config_text(tmp_path, TOML)["defaults"], "portfolio_strategy": "MinimumVarianceStrategy"}
+    # an earlier window and another order of the universe in the same batch
+    other = {**request, "initial_date": "2018-09-01", "universe": ["WMT", "AAPL", "MSFT"]}
+    alone = BatchRunner([("a", request)], {"price_store": "store"}, persist=False).run()[0]
+    batched = BatchRunner([("other", other), ("a", request)], {"price_store": "store"}, persist=False).run()[1]
+    interactive = backtest_from_request(request, verbose=False, persist=False)
+    interactive.price_store = "store"
+    interactive.run_backtest()
+    assert alone["run_id"] == batched["run_id"] == interactive.run_id
+    assert alone["final_value"] == batched["final_value"]
+
+def test_main_writes_records_and_reports_failures(tmp_path, monkeypatch, make_prices):
+    pytest.importorskip("yaml")
+    monkeypatch.chdir(tmp_path)
+    make_prices(start="2018-09-01").to_csv("prices.csv", index=False)
+    (tmp_path / "batch.yaml").write_text(YAML)
+    assert main(["batch.yaml", "-o", "out.jsonl"]) == 1
+    records = [json.loads(line) for line in open("out.jsonl")]
+    assert [(r["label"], r["status"]) for r in records] == [("minvar", "done"), ("bad", "failed")]
+    (tmp_path / "batch.toml").write_text(TOML)
+    assert main(["batch.toml", "-o", "out.csv"]) == 0
+    assert list(pd.read_csv("out.csv")["label"]) == ["minvar", "risk-averse"]
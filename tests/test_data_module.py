@@ -45,3 +45,78 @@ def test_information_get_prices():
     info = Information(s=timedelta(days=3), data_module=module)
     prices = info.get_prices(datetime(2024, 1, 6))
     assert prices == {"AAPL": 153}  # Should return last price for AAPL
+
+
+# Factor model information set of pybacktestchain_ss
+import numpy as np
+from pybacktestchain_ss.data_module import DataModule as DataModuleSS, FactorMoments
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+def make_factor_data(n_tickers=300, n_days=250, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2023-01-01", periods=n_days)
+    factors = rng.normal(0, 0.01, (n_days, 2))
+    loadings = rng.normal(1, 0.3, (2, n_tickers))
+    returns = factors @ loadings + rng.normal(0, 0.01, (n_days, n_tickers))
+    prices = 100 * np.exp(np.cumsum(returns, axis=0))
+    tickers = [f"T{i:04d}" for i in range(n_tickers)]
+    data = pd.DataFrame({
+        "Date": np.repeat(dates, n_tickers),
+        "ticker": np.tile(tickers, n_days),
+        "Close": prices.ravel(),
+    })
+    # every ticker misses some days, so that dropping incomplete dates would leave nothing
+    return data.sample(frac=0.97, random_state=seed).sort_values(["Date", "ticker"])
+
+def test_factor_moments_missing_data():
+    data = make_factor_data()
+    info = FactorMoments(s=timedelta(days=400), data_module=DataModuleSS(data), n_factors=2,
+                         portfolio_strategy=MinimumVarianceStrategy)
+    information_set = info.compute_information(datetime(2024, 6, 1))
+    assert len(information_set["companies"]) == 300
+    assert information_set["factor_loadings"].shape == (300, 2)
+    assert (information_set["specific_variance"] > 0).all()
+    # the two factors explain most of the common variance
+    common = (information_set["factor_loadings"] ** 2).sum(axis=1)
+    assert np.median(common / (common + information_set["specific_variance"])) > 0.3
+
+    portfolio = info.compute_portfolio(information_set)
+    assert sum(portfolio.values()) == pytest.approx(1.0)
+
+def test_data_module_from_store(tmp_path):
+    from pybacktestchain_ss.price_store import PriceStore
+    data = make_factor_data(n_tickers=5, n_days=40)
+    PriceStore.write(data, str(tmp_path / "store"), dtype="float64")
+    module = DataModuleSS.from_store(str(tmp_path / "store"), "2023-01-10", "2023-02-01", fields=["Close"], tickers=["T0001", "T0003"])
+    assert set(module.data["ticker"]) == {"T0001", "T0003"}
+    assert module.data["Date"].min() >= pd.Timestamp("2023-01-10")
+    assert module.data["Date"].max() < pd.Timestamp("2023-02-01")
+    info = Information(s=timedelta(days=30), data_module=module)
+    expected = data[(data["ticker"] == "T0001") & (data["Date"] < "2023-02-01")]["Close"].iloc[-1]
+    assert info.get_prices(datetime(2023, 2, 1))["T0001"] == expected
+
+# Timestamps normalized once by the DataModule of pybacktestchain_ss
+from pybacktestchain_ss.data_module import Information as InformationSS
+
+def test_data_module_timezones():
+    data = pd.DataFrame({
+        "Date": pd.date_range("2024-01-01 09:30", periods=6, freq="h", tz="America/New_York"),
+        "ticker": "AAPL",
+        "Close": [150.0, 152, 148, 151, 153, 154],
+    }).iloc[::-1]
+    module = DataModuleSS(data)
+    # sorted by time, stored as UTC nanoseconds, the input left untouched
+    assert module.data["Close"].tolist() == [150.0, 152, 148, 151, 153, 154]
+    assert module.times()[0] == pd.Timestamp("2024-01-01 14:30", tz="UTC").value
+    assert data["Close"].iloc[0] == 154
+    info = InformationSS(s=timedelta(hours=2), data_module=module)
+    # a naive date is a wall-clock time of the data, an aware one is converted
+    naive = info.slice_data(datetime(2024, 1, 1, 12, 30))
+    aware = info.slice_data(pd.Timestamp("2024-01-01 17:30", tz="UTC"))
+    assert naive["Close"].tolist() == aware["Close"].tolist() == [152, 148]
+    assert str(module.data["Date"].dt.tz) == "America/New_York"
+    # the data cannot be written to, slices can
+    with pytest.raises(ValueError):
+        module.data.loc[0, "Close"] = 0.0
+    naive["Close"] = 0.0
+    assert module.data["Close"].iloc[1] == 152
@@ -0,0 +1,104 @@
+import pytest
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.frontier import FrontierBacktest, critical_line, efficient_frontier, frontier_portfolios, frontier_weights, _solve_gamma
+from pybacktestchain_ss.portfolio_strategies import PortfolioStrategy, RiskAverseStrategy
+
+TICKERS, DRIFTS = ("AAPL", "MSFT", "WMT", "IBM"), (0.001, 0.0008, 0.0002, 0.0)
+
+def random_problem(rng, n):
+    A = rng.normal(size=(n + 5, n))
+    return rng.normal(0, 1e-3, n), A.T @ A / (n + 5) * 1e-4
+
+def test_frontier_matches_independent_solves():
+    rng = np.random.default_rng(0)
+    gammas = np.array([0.5, 1, 2, 5, 10, 100, 1000])
+    for n in (2, 5, 12, 25):
+        mu, Sigma = random_problem(rng, n)
+        weights = frontier_weights(mu, Sigma, gammas)
+        assert weights.shape == (len(gammas), n)
+        assert weights.sum(axis=1) == pytest.approx(np.ones(len(gammas)))
+        assert weights.min() >= 0
+        for gamma, w in zip(gammas, weights):
+            objective = lambda x: -x @ mu + gamma / 2 * x @ Sigma @ x
+            x = _solve_gamma(mu, Sigma, gamma, np.ones(n) / n)
+            assert objective(w) <= objective(x) + 1e-9 * abs(objective(x))
+
+def test_frontier_path():
+    mu, Sigma = random_problem(np.random.default_rng(1), 10)
+    segments = critical_line(mu, Sigma)
+    # from the asset with the highest expected return to the minimum variance portfolio
+    assert segments[0][2].sum() == 1 and segments[0][2][np.argmax(mu)]
+    assert [s[0] for s in segments[1:]] == [s[1] for s in segments[:-1]]
+    assert segments[-1][1] == 0.0
+    # the gammas are given in any order, zero is the maximum return portfolio
+    weights = frontier_weights(mu, Sigma, [10, 0, 1])
+    assert weights[1] == pytest.approx(np.eye(10)[np.argmax(mu)])
+    assert weights[0] == pytest.approx(frontier_weights(mu, Sigma, [10])[0])
+
+def test_matches_risk_averse_strategy():
+    mu, Sigma = random_problem(np.random.default_rng(2), 6)
+    # a scale where the default tolerance of SciPy is accurate enough, and the solution is not a corner
+    mu, Sigma = mu * 100, Sigma * 1000
+    information_set = {"expected_return": mu, "covariance_matrix": Sigma, "companies": np.array(list("ABCDEF"))}
+    expected = RiskAverseStrategy.optimize_portfolio(information_set)
+    portfolio = frontier_portfolios(information_set, [1])[0]
+    assert list(portfolio) == list(expected)
+    assert list(portfolio.values()) == pytest.approx(list(expected.values()), abs=1e-4)
+    assert sum(weight > 0.01 for weight in portfolio.values()) > 1
+    frontier = efficient_frontier(information_set, [1, 10, 100])
+    assert frontier["volatility"].is_monotonic_decreasing and frontier["expected_return"].is_monotonic_decreasing
+
+def test_tied_highest_expected_returns(caplog):
+    rng = np.random.default_rng(3)
+    gammas = np.array([0, 0.5, 1, 5, 100])
+    for n, tied in ((4, 2), (8, 3), (12, 4)):
+        mu, Sigma = random_problem(rng, n)
+        mu[rng.choice(n, tied, replace=False)] = mu.max() + 1e-4
+        with caplog.at_level(logging.INFO):
+            weights = frontier_weights(mu, Sigma, gammas)
+        # the path starts from the minimum variance portfolio of the tied assets, no fallback to SciPy
+        assert "Critical line failed" not in caplog.text
+        assert weights[0][mu < mu.max()].sum() == 0 and weights[0].sum() == pytest.approx(1)
+        for gamma, w in zip(gammas[1:], weights[1:]):
+            objective = lambda x: -x @ mu + gamma / 2 * x @ Sigma @ x
+            x = _solve_gamma(mu, Sigma, gamma, np.ones(n) / n)
+            assert objective(w) <= objective(x) + 1e-9 * abs(objective(x))
+
+def test_singular_covariance_falls_back():
+    mu = np.array([1e-3, 1e-3, 5e-4])
+    Sigma = np.ones((3, 3)) * 1e-4
+    weights = frontier_weights(mu, Sigma, [1, 10])
+    assert weights.sum(axis=1) == pytest.approx([1, 1])
+
+class Gamma2Strategy(PortfolioStrategy):
+    def optimize_portfolio(information_set):
+        return frontier_portfolios(information_set, [2])[0]
+
+def test_frontier_backtest_matches_separate_backtests(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(TICKERS, drift=DRIFTS)
+    params = dict(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 5, 1), universe=list(TICKERS),
+                  s=timedelta(days=120), verbose=False, persist=False)
+    backtest = FrontierBacktest(gammas=[1, 2, 50], data_module=DataModule(data), **params)
+    values, initial_portfolio, final_portfolio = backtest.run_backtest()
+    assert list(values.columns) == ["Date", "gamma=1", "gamma=2", "gamma=50", "Portfolio value"]
+    reference = Backtest(portfolio_strategy=Gamma2Strategy, data_module=DataModule(data), **params)
+    expected, _, _ = reference.run_backtest()
+    np.testing.assert_allclose(values["gamma=2"], expected["Portfolio value"])
+    pd.testing.assert_frame_equal(backtest.brokers[2].get_transaction_log(), reference.broker.get_transaction_log())
+    # one equity curve per gamma
+    metrics = backtest.performance()
+    assert list(metrics.index) == ["gamma=1", "gamma=2", "gamma=50"]
+    assert metrics.loc["gamma=50", "volatility"] < metrics.loc["gamma=1", "volatility"]
+
+def test_frontier_backtest_rejects_checkpoints(make_prices):
+    backtest = FrontierBacktest(gammas=[1, 2], data_module=DataModule(make_prices(TICKERS)),
+                                initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 5, 1),
+                                universe=list(TICKERS), verbose=False, persist=False, checkpoint_interval=20)
+    with pytest.raises(ValueError, match="checkpoint"):
+        backtest.run_backtest()
@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.montecarlo import MonteCarlo, block_bootstrap, bootstrap_prices
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+
+TICKERS = ("AAPL", "MSFT", "WMT", "IBM")
+
+def make_simulation(data, **kwargs):
+    params = dict(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 4, 1), n_paths=6,
+                  universe=list(TICKERS), portfolio_strategy=MinimumVarianceStrategy,
+                  s=timedelta(days=120), use_processes=False, paths_per_task=2, data_module=DataModule(data))
+    params.update(kwargs)
+    return MonteCarlo(**params)
+
+def test_block_bootstrap():
+    returns = np.arange(100.0)[:, None] * np.ones((1, 3))
+    resampled = block_bootstrap(returns, np.random.default_rng(0), 10)
+    assert resampled.shape == returns.shape
+    # whole rows in blocks of 10 consecutive dates
+    assert (resampled[:, 0] == resampled[:, 2]).all()
+    assert (np.diff(resampled[:10, 0]) == 1).all()
+
+def test_bootstrap_prices():
+    prices = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, (50, 2)), axis=0))
+    prices[:5, 1] = np.nan
+    resampled = bootstrap_prices(prices, np.random.default_rng(1), 5)
+    assert resampled[0, 0] == pytest.approx(prices[0, 0])
+    assert resampled[5, 1] == pytest.approx(prices[5, 1])
+    assert np.isnan(resampled[:5, 1]).all() and not np.isnan(resampled[5:]).any()
+
+def test_paths_without_resampling_match_the_backtest(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(TICKERS)
+    result = make_simulation(data, block_length=None, n_paths=2).run()
+    backtest = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 4, 1),
+                        universe=list(TICKERS), portfolio_strategy=MinimumVarianceStrategy,
+                        s=timedelta(days=120), verbose=False, persist=False, data_module=DataModule(data))
+    values, _, _ = backtest.run_backtest()
+    assert result.summaries["final_value"].tolist() == pytest.approx([values["Portfolio value"].iloc[-1]] * 2)
+
+def test_paths_are_reproducible(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(TICKERS)
+    streamed = []
+    kwargs = dict(universe_size=3, start_jitter=timedelta(days=10))
+    threads = make_simulation(data, **kwargs).run(callback=streamed.append)
+    processes = make_simulation(data, use_processes=True, max_workers=2, **kwargs).run()
+    assert len(streamed) == 6
+    pd.testing.assert_frame_equal(threads.summaries, processes.summaries)
+    summaries = threads.summaries
+    assert summaries["path"].tolist() == list(range(6))
+    assert summaries["universe"].str.count(",").eq(2).all()
+    assert summaries["final_value"].nunique() == 6
+    assert (abs(summaries["initial_date"] - datetime(2019, 1, 1)) <= timedelta(days=10)).all()
+    distribution = threads.distribution()
+    assert distribution.loc["sharpe", "mean"] == pytest.approx(summaries["sharpe"].mean())
+    assert 0 <= threads.p_value("sharpe", summaries["sharpe"].median()) <= 1
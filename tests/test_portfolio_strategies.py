@@ -6,7 +6,8 @@ from pybacktestchain_ss.portfolio_strategies import (
     MaximumReturnStrategy,
     EqualWeightStrategy,
     EqualRiskStrategy,
-    MaximumSharpeStrategy
+    MaximumSharpeStrategy,
+    compute_weight_schedule,
 )
 
 @pytest.fixture
@@ -80,3 +81,73 @@ def test_maximum_sharpe_strategy(mock_information_set):
     assert set(portfolio.keys()) == set(mock_information_set["companies"])
     sum_weights = sum(portfolio.values())
     assert sum_weights == pytest.approx(1.0, 0.01)
+
+@pytest.fixture
+def factor_information_set():
+    rng = np.random.default_rng(0)
+    n, k = 50, 3
+    return {
+        "expected_return": rng.normal(0.001, 0.0005, n),
+        "factor_loadings": rng.normal(0, 0.01, (n, k)),
+        "factor_covariance": np.eye(k),
+        "specific_variance": rng.uniform(1e-4, 4e-4, n),
+        "companies": np.array([f"T{i}" for i in range(n)]),
+    }
+
+def test_solve_covariance_woodbury(factor_information_set):
+    from pybacktestchain_ss.portfolio_strategies import covariance_matrix, solve_covariance
+    Sigma = covariance_matrix(factor_information_set)
+    b = np.arange(50, dtype=float)
+    np.testing.assert_allclose(solve_covariance(factor_information_set, b), np.linalg.solve(Sigma, b), rtol=1e-8)
+
+@pytest.mark.parametrize("strategy", [MinimumVarianceStrategy, MaximumSharpeStrategy, RiskAverseStrategy])
+def test_strategies_with_factor_model(factor_information_set, strategy):
+    from pybacktestchain_ss.portfolio_strategies import covariance_matrix
+    dense = dict(factor_information_set, covariance_matrix=covariance_matrix(factor_information_set))
+    portfolio = strategy.optimize_portfolio(factor_information_set)
+    expected = strategy.optimize_portfolio(dense)
+    assert sum(portfolio.values()) == pytest.approx(1.0, 0.01)
+    for company in expected:
+        assert portfolio[company] == pytest.approx(expected[company], abs=1e-4)
+
+def make_information_sets(n_dates, n_assets, seed=0):
+    rng = np.random.default_rng(seed)
+    sets = []
+    for _ in range(n_dates):
+        A = rng.normal(size=(n_assets * 2, n_assets))
+        sets.append({"expected_return": rng.normal(0.001, 0.01, n_assets),
+                     "covariance_matrix": A.T @ A / 100,
+                     "companies": np.array([f"T{i}" for i in range(n_assets)])})
+    return sets
+
+@pytest.mark.parametrize("strategy", [MinimumVarianceStrategy, MaximumSharpeStrategy, MaximumReturnStrategy,
+                                      EqualWeightStrategy, RiskAverseStrategy])
+def test_optimize_batch_matches_single_dates(strategy):
+    sets = make_information_sets(6, 4)
+    weights = strategy.optimize_batch(np.stack([s["expected_return"] for s in sets]),
+                                      np.stack([s["covariance_matrix"] for s in sets]))
+    assert weights.shape == (6, 4)
+    for t, information_set in enumerate(sets):
+        portfolio = strategy.optimize_portfolio(information_set)
+        expected = [portfolio[c] for c in information_set["companies"]]
+        assert np.allclose(weights[t], expected, atol=1e-6)
+
+def test_optimize_batch_singular_rows():
+    sets = make_information_sets(3, 3)
+    covariance = np.stack([s["covariance_matrix"] for s in sets])
+    covariance[1] = 0.0
+    weights = MinimumVarianceStrategy.optimize_batch(covariance_matrix=covariance)
+    # the singular date falls back to equal weights, the others are still solved
+    assert np.allclose(weights[1], 1 / 3)
+    assert np.allclose(weights[0], list(MinimumVarianceStrategy.optimize_portfolio(sets[0]).values()))
+
+def test_compute_weight_schedule():
+    sets = make_information_sets(4, 3) + make_information_sets(2, 5, seed=1)
+    sets.insert(2, {"expected_return": np.array([]), "covariance_matrix": np.empty((0, 0)), "companies": np.array([])})
+    portfolios = compute_weight_schedule(MinimumVarianceStrategy, sets)
+    assert len(portfolios) == 7
+    assert portfolios[2] == {}
+    for information_set, portfolio in zip(sets, portfolios):
+        assert list(portfolio) == list(information_set["companies"])
+        expected = MinimumVarianceStrategy.optimize_portfolio(information_set)
+        assert np.allclose(list(portfolio.values()), list(expected.values()))
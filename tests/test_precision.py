@@ -0,0 +1,67 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+from pybacktestchain_ss.precision import (FULL_PRECISION, MIXED_PRECISION, accuracy_report, parse_bytes,
+                                          plan_memory, precision_policy)
+
+TICKERS = tuple(f"T{i}" for i in range(8))
+
+@pytest.fixture
+def data(make_prices):
+    return make_prices(TICKERS, drift=3e-4, volatility=0.015)
+
+def make_backtest(data, **kwargs):
+    return Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 6, 1), universe=list(TICKERS),
+                    portfolio_strategy=MinimumVarianceStrategy, s=timedelta(days=180), verbose=False,
+                    persist=False, data_module=DataModule(data), **kwargs)
+
+def test_single_precision_storage_with_double_precision_sums(data):
+    full, mixed = DataModule(data), DataModule(data, precision="float32")
+    assert mixed.precision == MIXED_PRECISION and mixed.data["Adj Close"].dtype == np.float32
+    assert not mixed.data["Adj Close"].to_numpy().flags.writeable
+    assert mixed.bar_panel().values.dtype == np.float32
+    assert full.bar_panel().values.dtype == np.float64
+    assert mixed.memory_usage() == full.memory_usage() // 2
+    assert full.with_precision(None) is full
+    t = pd.Timestamp("2019-03-01")
+    information = lambda data_module, **kwargs: FirstTwoMoments(s=timedelta(days=180), data_module=data_module,
+                                                                 adj_close_column="Adj Close", **kwargs)
+    i = full.bar_panel().index(t)
+    for expected, info in ((information(full).compute_information(t), information(mixed).compute_information(t)),
+                           (information(full).compute_information_at_bar(i), information(mixed).compute_information_at_bar(i))):
+        assert info["covariance_matrix"].dtype == np.float32
+        np.testing.assert_allclose(info["covariance_matrix"], expected["covariance_matrix"], rtol=1e-4)
+
+def test_memory_plan():
+    assert parse_bytes("512MB") == 512 * 10**6 and parse_bytes("2GiB") == 2 * 2**30 and parse_bytes(1000) == 1000
+    with pytest.raises(ValueError):
+        parse_bytes("lots")
+    with pytest.raises(ValueError):
+        precision_policy("float16")
+    roomy = plan_memory("1GB", 10_000, 1, 20, 500)
+    assert roomy.precision == FULL_PRECISION and roomy.strategy_batch_size == 64 and roomy.cache_moments
+    # 4M rows of float64 prices take more than half of 48MB: stored in float32, smaller chunks
+    tight = plan_memory("48MB", 4_000_000, 1, 2000, 2000)
+    assert tight.precision == MIXED_PRECISION and tight.data_bytes == 4 * (4_000_000 + 2000 * 2000)
+    assert tight.strategy_batch_size < 64 and tight.bar_chunk_size < 65536 and not tight.cache_moments
+    assert plan_memory("48MB", 4_000_000, 1, 2000, 2000, FULL_PRECISION).precision == FULL_PRECISION
+
+def test_memory_budget_sets_the_precision_of_a_run(data):
+    full = make_backtest(data)
+    full.run_backtest()
+    budgeted = make_backtest(data, memory_budget=2 * data["Adj Close"].nbytes, information_cache={})
+    values, _, _ = budgeted.run_backtest()
+    assert budgeted.precision == MIXED_PRECISION and budgeted.data_module.data["Adj Close"].dtype == np.float32
+    assert budgeted.run_id != full.run_id
+    assert values["Portfolio value"].iloc[-1] == pytest.approx(full.valuation.portfolio_values[-1], rel=1e-6)
+
+def test_accuracy_report(data):
+    report = accuracy_report(make_backtest(data), "float32")
+    summary = report.summary()
+    assert len(report.weights) == 6 and summary["max_weight_diff"] < 1e-5
+    assert summary["max_equity_rel_diff"] < 1e-6
+    assert summary["data_bytes_reduced"] < summary["data_bytes_full"]
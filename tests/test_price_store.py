@@ -0,0 +1,76 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.portfolio_strategies import EqualWeightStrategy
+from pybacktestchain_ss.precision import MIXED_PRECISION
+from pybacktestchain_ss.price_store import PriceStore
+
+@pytest.fixture
+def prices():
+    dates = pd.bdate_range("2019-01-01", periods=30, tz="America/New_York")
+    dfs = []
+    for i, ticker in enumerate(["AAPL", "MSFT", "WMT"]):
+        close = 100.0 + i + np.arange(30)
+        dfs.append(pd.DataFrame({"Date": dates, "Open": close, "Close": close, "Adj Close": close * 0.99,
+                                 "Volume": 1e6 + np.arange(30), "ticker": ticker}))
+    data = pd.concat(dfs, ignore_index=True)
+    # WMT has no price on the first day
+    return data[~((data["ticker"] == "WMT") & (data["Date"] == dates[0]))]
+
+def test_write_and_open(prices, tmp_path):
+    store = PriceStore.write(prices, str(tmp_path / "store"), dtype="float64")
+    assert store.fields == ["Open", "Close", "Adj Close", "Volume"]
+    reopened = PriceStore(str(tmp_path / "store"))
+    assert list(reopened.tickers) == ["AAPL", "MSFT", "WMT"]
+    array = reopened.array("Close")
+    assert isinstance(array, np.memmap)
+    assert array.shape == (30, 3)
+    assert np.isnan(array[0, 2])
+
+def test_window(prices, tmp_path):
+    store = PriceStore.write(prices, str(tmp_path / "store"), fields=["Adj Close", "Volume"])
+    window = store.window("2019-01-01", "2019-01-08", fields=["Adj Close"], tickers=["AAPL", "WMT"])
+    assert list(window.columns) == ["Date", "ticker", "Adj Close"]
+    # 5 business days, WMT misses the first one
+    assert len(window) == 9
+    assert str(window["Date"].dt.tz) == "America/New_York"
+    assert window["Adj Close"].dtype == np.float32
+    expected = prices[(prices["ticker"] == "AAPL")].iloc[:5]["Adj Close"].to_numpy()
+    np.testing.assert_allclose(window[window["ticker"] == "AAPL"]["Adj Close"], expected, rtol=1e-6)
+
+def test_missing_fields_and_tickers(prices, tmp_path):
+    store = PriceStore.write(prices, str(tmp_path / "store"), fields=["Close"])
+    with pytest.raises(KeyError):
+        store.array("Volume")
+    with pytest.raises(KeyError):
+        store.window(tickers=["TSLA"])
+
+def test_missing_tickers_are_skipped_like_the_download(prices, tmp_path, caplog):
+    store = PriceStore.write(prices, str(tmp_path / "store"), fields=["Adj Close"])
+    assert set(store.window(tickers=["AAPL", "TSLA"], strict=False)["ticker"]) == {"AAPL"}
+    assert "TSLA" in caplog.text
+    assert set(DataModule.from_store(store.path, tickers=["TSLA", "WMT"]).data["ticker"]) == {"WMT"}
+    with pytest.raises(KeyError):
+        DataModule.from_store(store.path, tickers=["TSLA", "WMT"], strict=True)
+    # a backtest on the store runs on the tickers it has
+    backtest = Backtest(initial_date=datetime(2019, 1, 20), final_date=datetime(2019, 2, 8), s=timedelta(days=15),
+                        universe=["AAPL", "MSFT", "TSLA"], portfolio_strategy=EqualWeightStrategy,
+                        price_store=store.path, verbose=False, persist=False)
+    values, _, final = backtest.run_backtest()
+    assert len(values) and set(backtest.data_module.data["ticker"]) == {"AAPL", "MSFT"}
+
+def test_float32_store_is_summed_in_float64(prices, tmp_path):
+    store = PriceStore.write(prices, str(tmp_path / "store"), fields=["Adj Close"])
+    module = DataModule.from_store(store.path)
+    assert module.precision == MIXED_PRECISION and module.data["Adj Close"].dtype == np.float32
+    full = PriceStore.write(prices, str(tmp_path / "full"), fields=["Adj Close"], dtype="float64")
+    assert DataModule.from_store(full.path).precision is None
+    # the information sets of the store are not cached as float64 ones
+    backtest = Backtest(initial_date=datetime(2019, 1, 20), final_date=datetime(2019, 2, 8), s=timedelta(days=15),
+                        universe=["AAPL", "MSFT"], portfolio_strategy=EqualWeightStrategy, price_store=store.path,
+                        verbose=False, persist=False, information_cache={})
+    backtest.run_backtest()
+    assert {key[2] for key in backtest.information_cache} == {"float32"}
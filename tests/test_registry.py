@@ -0,0 +1,75 @@
+import pytest
+import os
+import sqlite3
+import pandas as pd
+from pybacktestchain_ss.registry import BacktestRegistry, main
+from pybacktestchain_ss.blockchain import Blockchain
+
+@pytest.fixture
+def registry(tmp_path):
+    return BacktestRegistry(str(tmp_path / "registry.sqlite"))
+
+def test_register_and_get(registry):
+    registry.register("RedFoxCarpenter", ["AAPL", "MSFT"], strategy="MinimumVarianceStrategy",
+                      initial_date="2019-01-01", final_date="2020-01-01", final_value=1.1e6,
+                      params={"s": 360})
+    run = registry.get("RedFoxCarpenter")
+    assert run["strategy"] == "MinimumVarianceStrategy"
+    assert run["universe"] == ["AAPL", "MSFT"]
+    assert run["final_value"] == 1.1e6
+    assert registry.get("Unknown") is None
+    with pytest.raises(ValueError):
+        registry.register("RedFoxCarpenter", unknown_column=1)
+
+def test_query(registry):
+    registry.register("A", ["AAPL", "MSFT"], strategy="MinimumVarianceStrategy", initial_date="2019-01-01", final_date="2020-01-01")
+    registry.register("B", ["MSFT"], strategy="MinimumVarianceStrategy", initial_date="2019-06-01", final_date="2020-01-01")
+    registry.register("C", ["AAPL"], strategy="EqualWeightStrategy", initial_date="2019-01-01", final_date="2020-01-01")
+    registry.register("D", ["AAPL"], strategy="MinimumVarianceStrategy", initial_date="2018-01-01", final_date="2019-01-01")
+
+    runs = registry.query(strategy="MinimumVariance", ticker="AAPL", since="2019-01-01")
+    assert list(runs["name"]) == ["A"]
+    assert set(registry.query(ticker="AAPL")["name"]) == {"A", "C", "D"}
+    assert set(registry.query(until="2019-12-31")["name"]) == {"D"}
+    assert len(registry.query(limit=2)) == 2
+
+def test_backfill(registry, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("backtests")
+    os.makedirs("blockchain")
+    log = pd.DataFrame({"Date": ["2019-01-31", "2019-02-28"], "Action": ["BUY", "SELL"],
+                        "Ticker": ["AAPL", "AAPL"], "Quantity": [10, 10], "Price": [39.4, 41.9], "Cash": [606.0, 1025.0]})
+    log.to_csv("backtests/RedFoxCarpenter.csv")
+    chain = Blockchain("backtest")
+    chain.add_block("RedFoxCarpenter", log.to_string())
+    chain.add_block("BlueWolfSoldier", "")
+    # the archived blocks of a compacted chain are indexed too
+    chain.compact()
+
+    assert registry.backfill("backtests", "blockchain") == 2
+    run = registry.get("RedFoxCarpenter")
+    assert run["universe"] == ["AAPL"]
+    assert run["initial_date"] == "2019-01-31"
+    assert run["block_hash"] == chain.headers()[1].hash
+    assert registry.get("BlueWolfSoldier")["blockchain"] == "backtest"
+    # already indexed runs are skipped
+    assert registry.backfill("backtests", "blockchain") == 0
+
+def test_command_line(registry, capsys):
+    registry.register("A", ["AAPL"], strategy="EqualWeightStrategy")
+    main(["--db", registry.path, "query", "--ticker", "AAPL"])
+    assert "EqualWeightStrategy" in capsys.readouterr().out
+
+def test_migrate_old_registry(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE runs (name TEXT PRIMARY KEY, strategy TEXT, information_class TEXT, initial_date TEXT, "
+                     "final_date TEXT, initial_cash REAL, final_value REAL, rebalance_flag TEXT, risk_model TEXT, "
+                     "risk_threshold REAL, lookback_days REAL, params TEXT, file TEXT, blockchain TEXT, "
+                     "block_hash TEXT, created REAL)")
+        conn.execute("INSERT INTO runs (name, strategy) VALUES ('A', 'EqualWeightStrategy')")
+    registry = BacktestRegistry(path)
+    assert registry.get("A")["run_id"] is None
+    registry.register("B", ["AAPL"], run_id="0123abcd")
+    assert registry.find_run("0123abcd")["name"] == "B"
+    assert registry.find_run("unknown") is None
@@ -0,0 +1,70 @@
+import pytest
+import pandas as pd
+from datetime import datetime
+from pybacktestchain_ss.results_io import (
+    get_results_writer,
+    load_backtests,
+    normalize_transaction_log,
+    CSVResultsWriter,
+)
+
+@pytest.fixture
+def transaction_log():
+    # built like Broker.log_transaction does, one row at a time
+    rows = [
+        {"Date": datetime(2019, 1, 31), "Action": "BUY", "Ticker": "AAPL", "Quantity": 10, "Price": 39.45888137817383, "Cash": 605.41},
+        {"Date": datetime(2019, 2, 28), "Action": "SELL", "Ticker": "AAPL", "Quantity": 10, "Price": 41.935035705566406, "Cash": 1024.76},
+        {"Date": datetime(2019, 2, 28), "Action": "BUY", "Ticker": "MSFT", "Quantity": 5, "Price": 100.1, "Cash": 524.26},
+    ]
+    return pd.concat([pd.DataFrame([row], dtype=object) for row in rows], ignore_index=True)
+
+def test_normalize_transaction_log(transaction_log):
+    df = normalize_transaction_log(transaction_log)
+    assert isinstance(df["Ticker"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["Action"].dtype, pd.CategoricalDtype)
+    assert df["Quantity"].dtype == "int64"
+    assert df["Price"].dtype == "float64"
+    assert pd.api.types.is_datetime64_any_dtype(df["Date"])
+
+def test_csv_round_trip(transaction_log, tmp_path):
+    writer = get_results_writer("csv")
+    path = writer.write(transaction_log, "RedFoxCarpenter", str(tmp_path))
+    assert path.endswith("RedFoxCarpenter.csv")
+    # same layout as before: the pandas index is the first column
+    assert open(path).readline().startswith(",Date,Action")
+    assert len(writer.read(path)) == 3
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_binary_round_trip(transaction_log, tmp_path, fmt):
+    pytest.importorskip("pyarrow")
+    writer = get_results_writer(fmt)
+    path = writer.write(transaction_log, "RedFoxCarpenter", str(tmp_path))
+    df = writer.read(path)
+    # floats are stored exactly, unlike the text round trip
+    assert df["Price"].tolist() == transaction_log["Price"].tolist()
+    assert df["Ticker"].astype(str).tolist() == ["AAPL", "AAPL", "MSFT"]
+    assert df["Quantity"].dtype == "int64"
+
+def test_load_backtests(transaction_log, tmp_path):
+    pytest.importorskip("pyarrow")
+    get_results_writer("parquet").write(transaction_log, "A", str(tmp_path))
+    get_results_writer("parquet").write(transaction_log, "B", str(tmp_path))
+    get_results_writer("csv").write(transaction_log, "C", str(tmp_path))
+
+    logs = load_backtests(directory=str(tmp_path))
+    assert len(logs) == 9
+    assert set(logs["Backtest"]) == {"A", "B", "C"}
+
+    logs = load_backtests(names=["A"], directory=str(tmp_path), fmt="parquet", columns=["Ticker", "Quantity"])
+    assert list(logs.columns) == ["Ticker", "Quantity", "Backtest"]
+
+    dataset = load_backtests(directory=str(tmp_path), fmt="parquet", lazy=True)
+    assert dataset.count_rows() == 6
+    with pytest.raises(ValueError):
+        load_backtests(directory=str(tmp_path), fmt="csv", lazy=True)
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        get_results_writer("xlsx")
+    writer = CSVResultsWriter()
+    assert get_results_writer(writer) is writer
@@ -0,0 +1,80 @@
+import pytest
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.broker import Backtest, StopLoss
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy, EqualWeightStrategy
+from pybacktestchain_ss.registry import BacktestRegistry
+from pybacktestchain_ss.run_cache import RunCache, backtest_config, canonical, data_fingerprint, run_identity
+from pybacktestchain_ss.transaction_costs import FixedBps
+from pybacktestchain_ss.utils import generate_random_name, run_name
+
+
+def make_backtest(data, **kwargs):
+    params = dict(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 4, 1), universe=["AAPL", "MSFT", "WMT"],
+                  portfolio_strategy=MinimumVarianceStrategy, s=timedelta(days=120), verbose=False,
+                  risk_model=StopLoss, data_module=DataModule(data.copy()))
+    params.update(kwargs)
+    return Backtest(**params)
+
+def test_generate_random_name_seed():
+    assert generate_random_name(seed="abc") == generate_random_name(seed="abc")
+    assert generate_random_name(seed="abc") != generate_random_name(seed="abd")
+
+def test_run_names_are_unique():
+    run_ids = [run_identity({"run": i}, "data") for i in range(1000)]
+    # the friendly names alone collide, the names of the runs do not
+    assert len({generate_random_name(seed=run_id) for run_id in run_ids}) < len(run_ids)
+    assert len({run_name(run_id) for run_id in run_ids}) == len(run_ids)
+    assert run_name(run_ids[0]).startswith(generate_random_name(seed=run_ids[0]))
+
+def test_canonical():
+    assert canonical(timedelta(days=1)) == 86400
+    assert canonical(datetime(2019, 1, 1)) == "2019-01-01T00:00:00"
+    assert canonical(MinimumVarianceStrategy) == "pybacktestchain_ss.portfolio_strategies.MinimumVarianceStrategy"
+    assert canonical(FixedBps(5)) == {"class": "pybacktestchain_ss.transaction_costs.FixedBps", "fields": {"bps": 5.0}}
+    with pytest.raises(TypeError):
+        canonical(object())
+
+def test_run_identity(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices()
+    config = backtest_config(make_backtest(data, persist=False))
+    # the fields that do not change the results are left out
+    assert "verbose" not in config and "data_module" not in config
+    assert backtest_config(make_backtest(data, persist=False, verbose=True)) == config
+    assert backtest_config(make_backtest(data, persist=False, cost_model=FixedBps(5))) != config
+
+    fingerprint = data_fingerprint(data)
+    assert data_fingerprint(data.copy()) == fingerprint
+    assert data_fingerprint(make_prices(seed=1)) != fingerprint
+    assert run_identity(config, fingerprint) == run_identity(dict(config), fingerprint)
+    assert run_identity(config, fingerprint) != run_identity(config, data_fingerprint(make_prices(seed=1)))
+
+def test_cached_run(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices()
+    first = make_backtest(data)
+    values, initial, final = first.run_backtest()
+    assert RunCache().load(first.run_id) is not None
+    assert first.backtest_name == run_name(first.run_id)
+    assert BacktestRegistry().find_run(first.run_id)["name"] == first.backtest_name
+
+    second = make_backtest(data)
+    # a cached run does not compute anything
+    monkeypatch.setattr(second, "information_at", lambda info, t: pytest.fail("the run was not cached"))
+    cached_values, cached_initial, cached_final = second.run_backtest()
+    assert second.run_id == first.run_id
+    assert second.backtest_name == first.backtest_name
+    pd.testing.assert_frame_equal(cached_values, values)
+    assert cached_final == final
+    assert second.broker.cash == first.broker.cash
+    assert len(second.broker.get_transaction_log()) == len(first.broker.get_transaction_log())
+
+    # other data or another configuration is another run
+    other = make_backtest(make_prices(seed=1))
+    other.run_backtest()
+    assert other.run_id != first.run_id
+    equal_weight = make_backtest(data, portfolio_strategy=EqualWeightStrategy)
+    equal_weight.run_backtest()
+    assert equal_weight.run_id not in (first.run_id, other.run_id)
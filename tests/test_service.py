@@ -0,0 +1,127 @@
+import pytest
+import asyncio
+import threading
+import pandas as pd
+from pybacktestchain_ss.service import JobServer, backtest_from_request, http_request, stream_events
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+from pybacktestchain_ss.transaction_costs import CompositeCost
+
+REQUEST = {"initial_date": "2019-01-01", "final_date": "2019-03-01", "universe": ["AAPL", "MSFT", "WMT"],
+           "portfolio_strategy": "MinimumVarianceStrategy", "s": 120}
+
+class FakeRunner:
+    """ Records the order of the runs, each run waits until it is released """
+    def __init__(self, block=False):
+        self.calls = []
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, request, progress):
+        self.calls.append(request["portfolio_strategy"])
+        self.release.wait(5)
+        for step in range(1, 4):
+            progress([pd.Timestamp("2019-01-01")] * step, [100.0 * step] * step)
+        if request.get("initial_cash") == -1:
+            raise ValueError("no cash")
+        return {"final_value": 300.0}
+
+def test_backtest_from_request():
+    backtest = backtest_from_request({**REQUEST, "cost_model": [{"model": "FixedBps", "bps": 5}, {"model": "SpreadCost"}]},
+                                     persist=False)
+    assert backtest.portfolio_strategy is MinimumVarianceStrategy
+    assert backtest.s.days == 120
+    assert isinstance(backtest.cost_model, CompositeCost)
+    with pytest.raises(ValueError):
+        backtest_from_request({**REQUEST, "portfolio_strategy": "os"}, persist=False)
+    with pytest.raises(ValueError):
+        backtest_from_request({**REQUEST, "data_module": None}, persist=False)
+    with pytest.raises(ValueError):
+        backtest_from_request({"final_date": "2019-03-01"}, persist=False)
+
+def test_priorities_and_deduplication():
+    async def scenario():
+        runner = FakeRunner(block=True)
+        server = JobServer(max_workers=1, runner=runner)
+        first, _ = await server.submit({**REQUEST, "portfolio_strategy": "EqualWeightStrategy"})
+        await asyncio.sleep(0.05) # the only worker picks up the first job
+        low, _ = await server.submit({**REQUEST, "portfolio_strategy": "MaximumReturnStrategy"}, priority=0)
+        high, _ = await server.submit(REQUEST, priority=10)
+        # the same request written differently joins the queued job
+        same, deduplicated = await server.submit({**REQUEST, "s": 120.0, "rebalance_flag": "EndOfMonth"})
+        assert deduplicated and same is high
+        runner.release.set()
+        for job in (first, low, high):
+            await server.wait(job.job_id)
+        await server.stop()
+        return runner.calls, [first, low, high]
+
+    calls, jobs = asyncio.run(scenario())
+    assert calls == ["EqualWeightStrategy", "MinimumVarianceStrategy", "MaximumReturnStrategy"]
+    assert all(job.status == "done" and job.result == {"final_value": 300.0} for job in jobs)
+
+def test_progress_failure_and_cancel():
+    async def scenario():
+        server = JobServer(max_workers=1, runner=FakeRunner(block=True))
+        job, _ = await server.submit(REQUEST)
+        failing, _ = await server.submit({**REQUEST, "initial_cash": -1})
+        cancelled, _ = await server.submit({**REQUEST, "initial_cash": 10})
+        assert server.cancel(cancelled.job_id)
+        server.runner.release.set()
+        events = [event async for event in server.events(job.job_id)]
+        await server.wait(failing.job_id)
+        await server.stop()
+        return events, failing, cancelled
+
+    events, failing, cancelled = asyncio.run(scenario())
+    assert [e["status"] for e in events if e["type"] == "status"] == ["queued", "running", "done"]
+    assert [e["value"] for e in events if e["type"] == "progress"] == [100.0, 200.0, 300.0]
+    assert events[1]["type"] == "status"
+    assert failing.status == "failed" and "no cash" in failing.error
+    assert cancelled.status == "cancelled"
+
+def test_http_service(tmp_path, monkeypatch, make_prices):
+    # a real backtest on fake data, over HTTP
+    monkeypatch.chdir(tmp_path)
+    fake_data = lambda tickers, start_date, end_date: make_prices(tickers, start_date, end_date, drift=0.0)
+
+    async def scenario():
+        server = JobServer(max_workers=2, data_source=fake_data)
+        tcp = await server.serve(port=0)
+        port = tcp.sockets[0].getsockname()[1]
+        status, payload = await http_request("POST", "/jobs", {"request": REQUEST, "priority": 1}, port=port)
+        assert status == 202
+        job_id = payload["job"]["job_id"]
+        events = [event async for event in stream_events(job_id, port=port)]
+        status, job = await http_request("GET", f"/jobs/{job_id}", port=port)
+        log_status, log = await http_request("GET", f"/results/{job['result']['name']}", port=port)
+        bad_status, _ = await http_request("POST", "/jobs", {"request": {"initial_date": "2019-01-01"}}, port=port)
+        missing_status, _ = await http_request("GET", "/jobs/unknown", port=port)
+        runs_status, runs = await http_request("GET", "/runs?strategy=MinimumVariance", port=port)
+        await server.stop()
+        return events, job, (log_status, log), bad_status, missing_status, runs
+
+    events, job, (log_status, log), bad_status, missing_status, runs = asyncio.run(scenario())
+    assert events[-1]["type"] == "status" and events[-1]["status"] == "done"
+    assert any(e["type"] == "progress" for e in events)
+    assert job["status"] == "done"
+    assert job["result"]["final_value"] == job["result"]["portfolio_values"][-1]["Portfolio value"]
+    assert log_status == 200 and log[0]["Action"] == "BUY"
+    assert bad_status == 400
+    assert missing_status == 404
+    assert [run["name"] for run in runs] == [job["result"]["name"]]
+
+def test_unix_socket(tmp_path):
+    async def scenario():
+        server = JobServer(runner=FakeRunner())
+        path = str(tmp_path / "service.sock")
+        await server.serve(unix_socket=path)
+        status, payload = await http_request("POST", "/jobs", {"request": REQUEST}, unix_socket=path)
+        await server.wait(payload["job"]["job_id"])
+        status, jobs = await http_request("GET", "/jobs", unix_socket=path)
+        await server.stop()
+        return status, jobs
+
+    status, jobs = asyncio.run(scenario())
+    assert status == 200
+    assert [job["status"] for job in jobs] == ["done"]
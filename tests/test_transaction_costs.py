@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+from datetime import datetime
+from pybacktestchain_ss.broker import Broker
+from pybacktestchain_ss.transaction_costs import (
+    FixedBps,
+    SpreadCost,
+    SquareRootImpact,
+    CompositeCost,
+    NoCost,
+)
+
+def test_cost_models():
+    quantities = np.array([100, -50, 0])
+    prices = np.array([10.0, 20.0, 30.0])
+    assert np.allclose(FixedBps(10).costs(quantities, prices), [1.0, 1.0, 0.0])
+    assert np.allclose(SpreadCost(20).costs(quantities, prices), [1.0, 1.0, 0.0])
+    assert np.allclose(NoCost().costs(quantities, prices), 0.0)
+
+def test_square_root_impact():
+    model = SquareRootImpact(eta=1.0, daily_volatility=0.02)
+    assert model.requires_volume
+    costs = model.costs(np.array([100, 400, 100]), np.array([10.0, 10.0, 10.0]), np.array([10000, 10000, np.nan]))
+    # four times the shares cost eight times as much, no volume means no impact
+    assert costs[0] == pytest.approx(1000 * 0.02 * 0.1)
+    assert costs[1] == pytest.approx(8 * costs[0])
+    assert costs[2] == 0
+    assert np.allclose(model.costs(np.array([100]), np.array([10.0])), 0.0)
+
+def test_composite_cost():
+    model = FixedBps(10) + SpreadCost(20) + SquareRootImpact()
+    assert isinstance(model, CompositeCost)
+    assert len(model.models) == 3
+    assert model.requires_volume
+    assert not (FixedBps(1) + SpreadCost(1)).requires_volume
+    assert np.allclose(model.costs(np.array([100]), np.array([10.0])), [2.0])
+
+def test_execute_portfolio_with_costs():
+    date = datetime(2024, 1, 31)
+    prices = {"AAPL": 100.0, "MSFT": 50.0}
+    frictionless = Broker(cash=10000, verbose=False)
+    frictionless.execute_portfolio({"AAPL": 0.5, "MSFT": 0.5}, prices, date)
+    broker = Broker(cash=10000, verbose=False, cost_model=FixedBps(100))
+    broker.execute_portfolio({"AAPL": 0.5, "MSFT": 0.5}, prices, date)
+
+    log = broker.get_transaction_log()
+    assert list(log["Cost"]) == pytest.approx([50.0, 49.0])
+    assert broker.get_portfolio_value(prices) == pytest.approx(frictionless.get_portfolio_value(prices) - log["Cost"].sum())
+    # the costs of the last order do not fit in the cash anymore, so it buys fewer shares
+    assert broker.positions["MSFT"].quantity == 98
+    assert frictionless.positions["MSFT"].quantity == 100
+    assert broker.cash >= 0
+
+    # selling pays the cost out of the proceeds
+    broker.execute_portfolio({"AAPL": 0.0, "MSFT": 0.5}, prices, date)
+    assert log["Cost"].sum() < broker.get_transaction_log()["Cost"].sum()
+    assert "AAPL" not in broker.positions
+
+def test_execute_portfolio_impact_uses_volumes():
+    date = datetime(2024, 1, 31)
+    broker = Broker(cash=10000, verbose=False, cost_model=SquareRootImpact())
+    broker.execute_portfolio({"AAPL": 1.0}, {"AAPL": 100.0}, date)
+    assert broker.get_transaction_log()["Cost"].sum() == 0
+    broker = Broker(cash=10000, verbose=False, cost_model=SquareRootImpact())
+    broker.execute_portfolio({"AAPL": 1.0}, {"AAPL": 100.0}, date, volumes={"AAPL": 1000.0})
+    assert broker.get_transaction_log()["Cost"].sum() > 0
@@ -0,0 +1,89 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.broker import Backtest, EndOfMonth
+from pybacktestchain_ss.portfolio_strategies import EqualWeightStrategy
+from pybacktestchain_ss.universe import ScreenPanel, TickerIndex, UniverseScreen, restrict_information_set
+
+class Mapper:
+    ticker_to_cik = {"AAPL": 1, "MSFT": 2, "MU": 3, "BRK-B": 4, "AA": 5, "AAL": 6}
+    ticker_to_company_name = {"AAPL": "Apple Inc.", "MSFT": "MICROSOFT CORP", "MU": "MICRON TECHNOLOGY INC",
+                              "BRK-B": "BERKSHIRE HATHAWAY INC", "AA": "Alcoa Corp", "AAL": "American Airlines Group Inc."}
+
+# ticker, first and last trading day, starting price and daily volume
+LISTINGS = (("AAPL", None, None, 100, 1e6), ("MSFT", None, None, 100, 2e6), ("NEW", "2019-01-15", None, 50, 1e6),
+            ("OLD", None, "2019-03-01", 80, 1e6), ("PENNY", None, None, 0.5, 1e8), ("THIN", None, None, 100, 10))
+
+@pytest.fixture
+def data(make_prices):
+    """Daily prices and volumes: NEW lists in 2019, OLD stops trading in March 2019, PENNY trades under $1"""
+    prices = make_prices([ticker for ticker, *_ in LISTINGS], drift=0.0, volatility=0.01)
+    dfs = []
+    for ticker, start, end, price, volume in LISTINGS:
+        df = prices[prices["ticker"] == ticker]
+        df = df[(df["Date"] >= (start or df["Date"].min())) & (df["Date"] <= (end or df["Date"].max()))]
+        dfs.append(df.assign(**{"Adj Close": df["Adj Close"] * price / 100, "Volume": volume}))
+    return pd.concat(dfs, ignore_index=True)
+
+def test_ticker_index(tmp_path):
+    path = str(tmp_path / "tickers.json")
+    index = TickerIndex.open(path, mapper=Mapper())
+    # persisted, the second open does not need the mapper
+    assert TickerIndex.open(path).tickers.tolist() == sorted(Mapper.ticker_to_cik)
+    assert index.prefix("aa") == ["AA", "AAL", "AAPL"]
+    assert index.search("AA")[0] == "AA"
+    assert index.search("brk.b") == ["BRK-B"]
+    assert index.search("micro") == ["MSFT", "MU"]
+    assert index.search("american air") == ["AAL"]
+    # typos are found by the trigram similarity
+    assert index.search("mircosoft")[0] == "MSFT"
+    assert index.search("appl")[0] == "AAPL"
+    assert index.search("zzzz") == [] and index.search("") == []
+    assert index.name("MU") == "MICRON TECHNOLOGY INC"
+
+def test_screen_is_point_in_time(data):
+    panel = ScreenPanel.from_data_module(DataModule(data))
+    screen = UniverseScreen(lookback=timedelta(days=90), min_history=40, min_price=1, min_dollar_volume=1e5)
+    assert list(screen.members(panel, datetime(2019, 1, 31))) == ["AAPL", "MSFT", "OLD"]
+    # NEW has enough history in April, OLD stopped trading in March
+    assert list(screen.members(panel, datetime(2019, 4, 30))) == ["AAPL", "MSFT", "NEW"]
+    # the screen only uses the data strictly before the date
+    t = pd.Timestamp("2019-04-30")
+    window = data[(data["Date"] >= t - timedelta(days=90)) & (data["Date"] < t)]
+    history = window.groupby("ticker").size()
+    last = window.groupby("ticker")["Adj Close"].last()
+    dollar_volume = (window["Adj Close"] * window["Volume"]).groupby(window["ticker"]).apply(lambda v: v.tail(20).mean())
+    stale = t - window.groupby("ticker")["Date"].last() > timedelta(days=7)
+    expected = history.index[(history >= 40) & (last >= 1) & (dollar_volume >= 1e5) & ~stale]
+    assert list(screen.members(panel, t)) == list(expected)
+    # the most traded names only
+    top = UniverseScreen(lookback=timedelta(days=90), top_n=2)
+    assert sorted(top.members(panel, t)) == ["AAPL", "MSFT"]
+    frame = screen.evaluate(panel, pd.bdate_range("2019-01-01", "2019-06-01", freq="BME"))
+    assert frame.shape == (5, 6) and frame.loc["2019-05-31", "NEW"] and not frame.loc["2019-01-31", "NEW"]
+
+def test_restrict_information_set():
+    information_set = {"companies": np.array(["A", "B", "C"]), "expected_return": np.array([1.0, 2.0, 3.0]),
+                       "covariance_matrix": np.arange(9.0).reshape(3, 3)}
+    restricted = restrict_information_set(information_set, ["C", "A"])
+    assert restricted["companies"].tolist() == ["A", "C"]
+    assert restricted["expected_return"].tolist() == [1.0, 3.0]
+    assert restricted["covariance_matrix"].tolist() == [[0.0, 2.0], [6.0, 8.0]]
+
+def test_backtest_on_screened_universe(tmp_path, monkeypatch, data):
+    monkeypatch.chdir(tmp_path)
+    screen = UniverseScreen(lookback=timedelta(days=90), min_history=40, min_price=1, min_dollar_volume=1e5)
+    backtest = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 6, 1),
+                        universe=["AAPL", "MSFT", "NEW", "OLD", "PENNY", "THIN"], portfolio_strategy=EqualWeightStrategy,
+                        s=timedelta(days=90), rebalance_flag=EndOfMonth, universe_screen=screen, verbose=False,
+                        persist=False, data_module=DataModule(data))
+    backtest.run_backtest()
+    log = backtest.broker.get_transaction_log()
+    bought = log[log["Action"] == "BUY"].groupby("Ticker")["Date"].min()
+    assert set(bought.index) == {"AAPL", "MSFT", "NEW", "OLD"}
+    assert bought["NEW"] > pd.Timestamp("2019-03-01")
+    # OLD is sold once it stops passing the screen
+    assert "OLD" not in backtest.broker.positions
+    assert (log[log["Ticker"] == "OLD"]["Action"] == "SELL").any()
@@ -0,0 +1,73 @@
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.broker import Backtest, Broker, StopLoss
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+from pybacktestchain_ss.valuation import PriceMatrix, mark_to_market
+
+@pytest.fixture
+def data(make_prices):
+    """Random walks with gaps, and a ticker that only starts trading during the backtest, and stops before its end"""
+    prices = make_prices(tz="America/New_York")
+    dfs = [df.sample(frac=0.9, random_state=0).sort_values("Date") for _, df in prices.groupby("ticker", sort=False)]
+    late = pd.bdate_range("2019-02-01", "2019-03-15", tz="America/New_York")
+    dfs.append(pd.DataFrame({"Date": late, "ticker": "NEW", "Adj Close": np.linspace(10, 20, len(late))}))
+    return pd.concat(dfs, ignore_index=True)
+
+def test_price_matrix_matches_get_prices(data):
+    info = FirstTwoMoments(s=timedelta(days=30), data_module=DataModule(data), adj_close_column="Adj Close")
+    dates = pd.date_range("2019-01-01", "2019-05-01", freq="D")
+    matrix = info.price_matrix(dates)
+    for i, t in enumerate(dates):
+        assert matrix.prices_at(i) == info.get_prices(t)
+    cached = PriceMatrix.from_dicts(dates, [info.get_prices(t) for t in dates])
+    assert list(cached.tickers) == list(matrix.tickers)
+    np.testing.assert_array_equal(cached.values, matrix.values)
+
+def test_mark_to_market():
+    dates = pd.date_range("2024-01-01", periods=4, freq="D")
+    prices = PriceMatrix(dates.to_numpy(), np.array(["AAPL", "MSFT"]),
+                         np.array([[100.0, 50.0], [110.0, 50.0], [90.0, 55.0], [95.0, np.nan]]))
+    broker = Broker(cash=1000, verbose=False)
+    broker.buy("AAPL", 5, 100.0, dates[0])
+    broker.buy("MSFT", 4, 50.0, dates[0])
+    broker.sell("MSFT", 4, 55.0, dates[2])
+    valuation = mark_to_market(broker.get_transaction_log(), prices, 1000)
+    assert list(valuation.portfolio_values) == [1000.0, 1050.0, 970.0, 995.0]
+    assert list(valuation.cash) == [300.0, 300.0, 520.0, 520.0]
+    assert list(valuation.exposures["MSFT"]) == [200.0, 200.0, 0.0, 0.0]
+    assert valuation.drawdown.iloc[2] == pytest.approx(970 / 1050 - 1)
+    assert valuation.drawdown.max() == 0
+    assert valuation.portfolio_values_df.columns.tolist() == ["Date", "Portfolio value"]
+    assert prices.value_at(1, broker.cash, broker.positions) == 520 + 5 * 110
+
+def test_backtest_valuation(tmp_path, monkeypatch, data):
+    monkeypatch.chdir(tmp_path)
+    backtest = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 4, 1),
+                        universe=["AAPL", "MSFT", "WMT", "NEW"], portfolio_strategy=MinimumVarianceStrategy,
+                        s=timedelta(days=120), verbose=False, risk_model=StopLoss, persist=False,
+                        data_module=DataModule(data.copy()))
+    streamed = []
+    backtest.progress_callback = lambda dates, values: streamed.append(list(values))
+    values, _, _ = backtest.run_backtest()
+    valuation = backtest.valuation
+
+    # the same values as marking the broker to market day by day with get_prices
+    info = backtest.create_information(DataModule(data.copy()))
+    broker = Broker(cash=backtest.initial_cash, verbose=False)
+    log = backtest.broker.get_transaction_log()
+    expected = []
+    for t in values["Date"]:
+        for trade in log[log["Date"] == t].itertuples():
+            if trade.Action == "BUY":
+                broker.buy(trade.Ticker, trade.Quantity, trade.Price, t)
+            else:
+                broker.sell(trade.Ticker, trade.Quantity, trade.Price, t)
+        expected.append(broker.get_portfolio_value(info.get_prices(t)))
+    np.testing.assert_allclose(values["Portfolio value"], expected, rtol=1e-12)
+    np.testing.assert_allclose(valuation.exposures.sum(axis=1) + valuation.cash, valuation.values, rtol=1e-12)
+    # the streamed values are the same as the final ones
+    np.testing.assert_allclose(streamed[-2], values["Portfolio value"][:len(streamed[-2])], rtol=1e-12)
+    assert (valuation.drawdown <= 0).all()
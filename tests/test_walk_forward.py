@@ -0,0 +1,82 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.data_module import DataModule, FirstTwoMoments
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.portfolio_strategies import EqualWeightStrategy, MinimumVarianceStrategy
+from pybacktestchain_ss.walk_forward import WalkForward, make_folds, stitch_equity_curves
+
+
+def test_make_folds():
+    folds = make_folds(datetime(2019, 1, 1), datetime(2020, 1, 1), timedelta(days=180), timedelta(days=30))
+    assert len(folds) == 6
+    assert all(fold.train == timedelta(days=180) for fold in folds)
+    assert folds[1].test_start == folds[0].test_end
+    anchored = make_folds(datetime(2019, 1, 1), datetime(2020, 1, 1), timedelta(days=180), timedelta(days=30), anchored=True)
+    assert all(fold.train_start == datetime(2019, 1, 1) for fold in anchored)
+    overlapping = make_folds(datetime(2019, 1, 1), datetime(2020, 1, 1), timedelta(days=180), timedelta(days=60), step=timedelta(days=30))
+    assert overlapping[0].test_end > overlapping[1].test_start
+
+def test_stitch_equity_curves():
+    folds = make_folds(datetime(2019, 1, 1), datetime(2019, 1, 8), timedelta(days=1), timedelta(days=3))
+    values = [pd.DataFrame({"Date": pd.date_range(fold.test_start, periods=3), "Portfolio value": [110.0, 121.0, 121.0]}) for fold in folds]
+    stitched = stitch_equity_curves(folds, values, 100)
+    assert len(stitched) == 6
+    assert stitched["Portfolio value"].iloc[-1] == pytest.approx(100 * 1.21 ** 2)
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_walk_forward_matches_single_backtests(tmp_path, monkeypatch, use_processes, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data_module = DataModule(make_prices(start="2018-01-01", end="2020-01-01"))
+    walk_forward = WalkForward(initial_date=datetime(2018, 6, 1), final_date=datetime(2019, 6, 1),
+                               train=timedelta(days=120), test=timedelta(days=60), step=timedelta(days=30),
+                               universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                               data_module=data_module, use_processes=use_processes, max_workers=2)
+    result = walk_forward.run()
+    assert len(result.fold_values) == len(result.folds) > 1
+    assert not result.stitched["Portfolio value"].isna().any()
+
+    # every fold gives the same curve as a standalone backtest on the same window
+    fold = result.folds[1]
+    backtest = Backtest(initial_date=fold.test_start, final_date=fold.test_end - timedelta(days=1),
+                        universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                        s=fold.train, data_module=data_module, persist=False, verbose=False)
+    expected, _, _ = backtest.run_backtest()
+    pd.testing.assert_frame_equal(result.fold_values[1], expected)
+
+def test_walk_forward_shares_information(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    walk_forward = WalkForward(initial_date=datetime(2018, 6, 1), final_date=datetime(2019, 6, 1),
+                               train=timedelta(days=120), test=timedelta(days=60), step=timedelta(days=30),
+                               universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=EqualWeightStrategy,
+                               data_module=DataModule(make_prices(start="2018-01-01", end="2020-01-01")))
+    folds = walk_forward.folds()
+    cache = walk_forward.precompute_information([walk_forward.make_backtest(fold, {}) for fold in folds[:1]])
+    shared = {}
+    walk_forward.precompute_information([walk_forward.make_backtest(fold, shared) for fold in folds])
+    # overlapping test windows compute each date only once
+    assert len(shared) < sum((fold.test_end - fold.test_start).days for fold in folds)
+    assert len(cache) == (folds[0].test_end - folds[0].test_start).days
+
+def test_precompute_information_in_chunks(monkeypatch, make_prices):
+    walk_forward = WalkForward(initial_date=datetime(2018, 6, 1), final_date=datetime(2019, 6, 1),
+                               train=timedelta(days=120), test=timedelta(days=60), step=timedelta(days=30),
+                               universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=EqualWeightStrategy,
+                               data_module=DataModule(make_prices(start="2018-01-01", end="2020-01-01")), max_workers=3)
+    folds = walk_forward.folds()
+    expected = walk_forward.precompute_information([walk_forward.make_backtest(fold, {}) for fold in folds])
+    calls = []
+    compute_information = FirstTwoMoments.compute_information
+    def counted(self, t):
+        calls.append(t)
+        return compute_information(self, t)
+    monkeypatch.setattr(FirstTwoMoments, "compute_information", counted)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        cache = walk_forward.precompute_information([walk_forward.make_backtest(fold, {}) for fold in folds], executor)
+    # each distinct date is computed once, by one of the chunks
+    assert cache.keys() == expected.keys() and len(calls) == len(set(calls)) == len(cache)
+    for key, (information_set, prices) in expected.items():
+        np.testing.assert_array_equal(cache[key][0]["covariance_matrix"], information_set["covariance_matrix"])
+        assert cache[key][1] == prices
@@ -0,0 +1,82 @@
+import pytest
+import pandas as pd
+from datetime import datetime, timedelta
+from pybacktestchain_ss.blockchain import load_blockchain
+from pybacktestchain_ss.broker import Backtest
+from pybacktestchain_ss.data_module import DataModule
+from pybacktestchain_ss.portfolio_strategies import MinimumVarianceStrategy
+from pybacktestchain_ss.service import backtest_from_request
+from pybacktestchain_ss.work_queue import SQLiteQueue, Worker, commit, load_data, store_data, submit_sweep
+
+
+def make_request(**kwargs):
+    request = {"initial_date": "2019-01-01", "final_date": "2019-05-01", "universe": ["AAPL", "MSFT", "WMT"],
+               "portfolio_strategy": "MinimumVarianceStrategy", "s": 90}
+    request.update(kwargs)
+    return request
+
+def test_claims_are_exclusive_and_by_priority(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / "queue.db"))
+    low = queue.put({"n": 1})
+    high = queue.put({"n": 2}, priority=5)
+    # the same payload is the same job
+    assert queue.put({"n": 1}) == low and queue.counts()["queued"] == 2
+    assert [job.id for job in queue.claim("a")] == [high]
+    assert [job.id for job in queue.claim("b")] == [low]
+    assert queue.start(high, "a") and not queue.start(low, "a")
+    assert queue.start(low, "b") and queue.claim("c") == []
+
+def test_failed_and_timed_out_jobs_are_retried(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / "queue.db"), retry_delay=0)
+    flaky, stuck = queue.put({"flaky": True}, max_attempts=2), queue.put({"stuck": True}, max_attempts=2)
+    def runner(payload, worker):
+        raise RuntimeError("boom")
+    worker = Worker(queue, name="a", runner=runner)
+    assert worker.step()
+    assert queue.job(flaky)["status"] == "queued" and "boom" in queue.job(flaky)["error"]
+    # a worker dies holding a job: its lease expires and another worker takes it over
+    assert [job.id for job in queue.claim("dead", n=2, lease=-1)] == [flaky, stuck]
+    assert queue.start(stuck, "dead", lease=-1)
+    assert [job.id for job in queue.claim("b", n=2)] == [flaky, stuck]
+    assert not queue.heartbeat(stuck, "dead")
+    assert queue.start(flaky, "b") and queue.fail(flaky, "b", "boom again")
+    assert queue.job(flaky)["status"] == "failed" and queue.job(flaky)["attempts"] == 2
+    assert queue.start(stuck, "b") and queue.complete(stuck, "b", {"ok": 1})
+    assert queue.counts() == {"queued": 0, "claimed": 0, "running": 0, "done": 1, "failed": 1}
+    assert queue.results() == {stuck: {"ok": 1}}
+
+def test_idle_worker_steals_unstarted_jobs(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / "queue.db"))
+    ids = queue.put_many([{"n": i} for i in range(4)])
+    assert [job.id for job in queue.claim("busy", n=4)] == ids
+    # half of the backlog of the busy worker, from its end
+    stolen = [job.id for job in queue.claim("idle", n=4)]
+    assert stolen == [ids[3], ids[2]]
+    assert not queue.start(ids[3], "busy") and queue.start(ids[0], "busy")
+    assert queue.start(ids[3], "idle")
+
+def test_sweep_runs_once_with_shared_data(tmp_path, monkeypatch, make_prices):
+    monkeypatch.chdir(tmp_path)
+    data = make_prices(start="2018-09-01")
+    digest = store_data(data)
+    pd.testing.assert_frame_equal(load_data(digest), data)
+    queue = SQLiteQueue()
+    requests = [make_request(), make_request(portfolio_strategy="RiskAverseStrategy")]
+    ids = submit_sweep(queue, requests, data=data)
+    assert submit_sweep(queue, requests, data=data) == ids
+    assert Worker(queue, prefetch=2).run(idle_timeout=0) == 2
+    results = queue.results()
+    expected, _, _ = Backtest(initial_date=datetime(2019, 1, 1), final_date=datetime(2019, 5, 1),
+                              universe=["AAPL", "MSFT", "WMT"], portfolio_strategy=MinimumVarianceStrategy,
+                              s=timedelta(days=90), verbose=False, persist=False,
+                              data_module=DataModule(data)).run_backtest()
+    assert results[ids[0]]["final_value"] == pytest.approx(expected["Portfolio value"].iloc[-1])
+    chain = load_blockchain("backtest")
+    assert [block.hash for block in chain.chain[1:]] == [results[id_]["block_hash"] for id_ in ids]
+
+    # a job run again after its commit (e.g. its lease expired just before completing) stores nothing new
+    backtest = backtest_from_request(requests[0], verbose=False, persist=False, use_cache=False,
+                                     data_module=DataModule(data))
+    result = commit(backtest, *backtest.run_backtest())
+    assert result["block_hash"] == results[ids[0]]["block_hash"]
+    assert len(load_blockchain("backtest").chain) == 3